@@ -64,5 +64,38 @@ def action_runtests(functional=False, unit=False):
     import webscavator.test
     webscavator.test.runTests(unit, functional)
     
+def action_benchmark_timestamps(count=1000000):
+    """
+        Compare how long it takes to parse `count` timestamps with `datetime.strptime` and 
+        with `TimestampParser` by calling `benchmark(count)` in :doc:`timestamps`
+    """
+    from webscavator.converters.timestamps import benchmark
+    strptime_time, parser_time = benchmark(count)
+    print 'strptime:        %.2fs' % strptime_time
+    print 'TimestampParser: %.2fs (%.1fx faster)' % (parser_time, strptime_time / parser_time)
+    
+def action_explain(case=''):
+    """
+        Show how SQLite runs the queries behind each visualisation endpoint on a case, by calling
+        `advise(case)` in :doc:`advisor`. Tables read without an index are flagged with `!`.
+        The case is not changed - if it has not been migrated, what it is missing is shown.
+    """
+    import webscavator.utils.utils
+    webscavator.utils.utils.setup()
+    from webscavator.model.advisor import advise
+    needed, results = advise(case)
+    if needed:
+        print 'The case is not up to date, load it in Webscavator to add:'
+        for m in needed:
+            print '    %s' % m
+        return
+    scans = 0
+    for endpoint, statement, steps, scanned in results:
+        print '%s: %s' % (endpoint, ' '.join(statement.split())[:100])
+        for step in steps:
+            print '    %s %s' % ('!' if step in scanned else ' ', step)
+        scans = scans + len(scanned)
+    print '%d full table scans' % scans
+    
 if __name__ == '__main__':
     script.run()
@@ -167,15 +167,19 @@ class Application(object):
         map.add(Rule('/json/addwizard2', endpoint='case.jsonAddEntries'))
         map.add(Rule('/json/editwizard1', endpoint='case.jsonEditCase'))
         map.add(Rule('/json/editwizard2', endpoint='case.jsonEditEntries'))
+        map.add(Rule('/json/importstatus/<int:job>', endpoint='case.jsonImportStatus'))
         
         # ajax visualisation calls
         map.add(Rule('/vis/getEntries/', endpoint='visual.jsonGetEntries'))
         map.add(Rule('/vis/getWordCloud/', endpoint='visual.jsonGetWordClouds'))
+        map.add(Rule('/vis/getSearches/', endpoint='visual.jsonGetSearches'))
         map.add(Rule('/vis/getDomains/', endpoint='visual.jsonGetDomains'))
+        map.add(Rule('/vis/getFileDates/', endpoint='visual.jsonGetFileDates'))
         
         # pages to add/delete filters
         map.add(Rule('/filter/add/', endpoint='visual.addFilter'))
         map.add(Rule('/filter/add/complete', endpoint='visual.jsonAddFilter'))
+        map.add(Rule('/filter/values/', endpoint='visual.jsonGetFilterValues'))
         
         # help pages
         map.add(Rule('/help/userguide/', endpoint='general.userguide'))  
@@ -18,7 +18,7 @@ from mako.lookup import TemplateLookup
 from formencode import Invalid
 from formencode.variabledecode import variable_decode
 # local imports
-from webscavator.utils.utils import session, CASE_FILE_DIR, ROOT_DIR, multidict_to_dict
+from webscavator.utils.utils import session, CASE_FILE_DIR, ROOT_DIR, multidict_to_dict, checkpoint
 from webscavator.model.models import *
 from webscavator.model.filters import FilterQuery
 
@@ -189,19 +189,34 @@ class BaseController(object):
         f.write("\n" + dbfile + "\t\t" + hash + "\t\t" + now + "\t\t" + msg)
         f.close()
         
-    def write_log(self, dbfile, msg):
-        """ 
-             Computes a MD5 hash of the dbfile by calling `_computeHash(file)` and then appends 
-             the hash in a file for that dbfile by calling `_storeHash(hash, dbfile, msg)`.
-             Returns the hash and the path to the folder where the hash file is kept.
+    hashfolder = path.abspath(path.join(ROOT_DIR, '..', 'case file hashes'))
+    
+    def hash_case(self, dbfile, loaded=True):
         """
-        
+             Returns the MD5 hash of the dbfile, computed by `_computeHash(file)`. If the case is
+             `loaded`, the database is checkpointed first so the file has everything in it.
+        """
+        if loaded:
+            checkpoint(session) # make sure the database file has everything in it
         database = open(path.join(CASE_FILE_DIR, dbfile), 'r')
-        hash = self._computeHash(database)  # create hash
-        hashfolder = path.abspath(path.join(ROOT_DIR, '..', 'case file hashes'))
+        try:
+            return self._computeHash(database)
+        finally:
+            database.close()
+        
+    def write_log(self, dbfile, msg, loaded=True, hash=None):
+        """ 
+             Computes a MD5 hash of the dbfile by calling `hash_case(dbfile, loaded)`, unless 
+             it is given as `hash`, and then appends the hash in a file for that dbfile by 
+             calling `_storeHash(hash, dbfile, msg)`. `loaded` is False for a case file which
+             has not been loaded yet. Returns the hash and the path to the folder where the 
+             hash file is kept.
+        """
+        if hash is None:
+            hash = self.hash_case(dbfile, loaded)  # create hash
         self._storeHash(hash, dbfile, msg)  # store hash in text file
         
-        return hash, hashfolder
+        return hash, self.hashfolder
     
         
     #     Cookies
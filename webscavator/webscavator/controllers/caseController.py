@@ -7,25 +7,31 @@
 
 #python imports
 import sys
-from os import path, rename, mkdir
+from os import path, rename, mkdir, fdopen
 from datetime import datetime, time
 import csv
-import urllib
+import tempfile
 # library imports
 from werkzeug import Response, redirect
+from werkzeug.exceptions import NotFound
 from mako.lookup import TemplateLookup
 # local imports
 from webscavator.utils.utils import session, ROOT_DIR, CASE_FILE_DIR, getCases, config
 from webscavator.controllers.baseController import BaseController, lookup, jsonify, jsonifyfile
 from webscavator.model.models import *
+from webscavator.model.importer import EntryImporter, ImportJob
+from webscavator.utils.jobs import job_queue
 from webscavator.forms.forms import wizard1_form, wizard2_form, edit1_form, edit2_form, load_form
-from webscavator.converters import get_program, get_names, convert_file
+from webscavator.forms.validators import dataError
+from webscavator.converters import get_program, get_names, convert_file, ConversionError
 
 class CaseController(BaseController):
     """
         Controller for the set up and editing of cases. 
     """
     
+    import_error = None
+    
     # Load cases
     # =======================================
     def load(self, **vars):
@@ -41,13 +47,18 @@ class CaseController(BaseController):
             Endpoint for when user has chosen to load a particular case. 
             Checks whether the case is valid. 
             If so, returns `finish_wizard()`. Otherwise, it returns `self.form_errors()`.   
+            
+            The case file is hashed and logged as it was given before it is loaded, as loading 
+            it can bring it up to date (see :doc:`migrations`). Any changes are logged by 
+            `finish_wizard()`.
         """
         if self.validate_form(load_form()):
-            # form is validated, so load case
+            # form is validated, so log the case file as it is and load it
             self.dbfile = self.form_result['case']
-            Case.load_database(self.dbfile) 
+            hash, hashfolder = self.write_log(self.dbfile, 'Loaded the case.', loaded=False)
+            versions = Case.load_database(self.dbfile) 
             
-            return self.finish_wizard()
+            return self.finish_wizard(loaded_hash=hash, versions=versions)
         else:
             return self.load(errors=self.form_error)
         
@@ -82,11 +93,18 @@ class CaseController(BaseController):
         return self.returnResponse('wizard', 'step3.html', headers = headers, 
                                    dblocation = dblocation, edit=edit)    
         
-    def finish_wizard(self, edit=False):
+    def finish_wizard(self, edit=False, loaded_hash=None, versions=None):
         """ 
-            Forth step of wizard: The wizard is complete. Creates a hash of the database
+            Forth step of wizard: The wizard is complete. Works out the overview statistics with
+            `Summary.fill()`, the filters' bitmaps with `FilterBitmap.fill()`, the values 
+            listed when adding a filter with `FilterValue.fill()` and the domain name counts 
+            with `DomainRollup.fill()` in :doc:`models`, then creates a hash of the database
             file and adds message to log file by calling `self.write_log(dbfile, msg)`
             found in :doc:`baseController`. 
+            
+            A loaded case was logged by `loaded()`, which gives its hash as `loaded_hash` and 
+            the (old, new) `versions` from `Case.load_database()`. It is only logged again if 
+            the file has changed since, saying whether it was migrated.
         """
 
         self.done_wizard = True # completed the wizard, start page is now the vizualisations
@@ -97,11 +115,26 @@ class CaseController(BaseController):
             if edit == False:
                 self.addDefaultFilters()
                     
+        Summary.fill()
+        FilterBitmap.fill()
+        FilterValue.fill()
+        DomainRollup.fill()
         session.commit() # before computing hash, commit everything to database
+        Filter.filtersChanged()
         
         # add what has happened to the db file to log
         if edit == True:
             hash, hashfolder = self.write_log(self.dbfile, 'Edited the data.') 
+        elif load == True and loaded_hash is not None:
+            hash = self.hash_case(self.dbfile)
+            if hash != loaded_hash:
+                if versions is not None and versions[0] < versions[1]:
+                    msg = 'Migrated the case from version %d to version %d.' % versions
+                else:
+                    msg = 'Updated the stored statistics.'
+                hash, hashfolder = self.write_log(self.dbfile, msg, hash=hash)
+            else:
+                hashfolder = self.hashfolder
         elif load == True:
             hash, hashfolder = self.write_log(self.dbfile, 'Loaded the case.') 
         else:
@@ -201,21 +234,18 @@ class CaseController(BaseController):
             Endpoint for wizard 2 form (adding CSV/XML data). This is done via Ajax. 
             If the form has errors, the error dictionary `self.form_errors` is jsonified 
             and passed back to the webpage and the errors displayed to the user. 
-            If the form is valid, then `self.addData()` is called. 
-            If all goes well, this will then return `True`, otherwise if their are errors in 
-            the adding of the data in `self.addData()` then self.form_erros is returned. 
+            If the form is valid, then `self.addData()` is called for each file and the files
+            are added to the database by a background `ImportJob` found in :doc:`importer`. 
+            This returns the URL the webpage polls for the job's progress, see 
+            `self.jsonImportStatus()`. 
         """
         if self.validate_form(wizard2_form()):
             # form is validated, so add group details
-            for i, v in enumerate(self.form_result.itervalues()):               
-                entry = v[0]
-                done = self.addData(entry)
-                if done is None:
-                    form_error = {}
-                    form_error['csv_entry-' + str(i) + '.data'] = \
-                    'The data could not be added to the database due to an error.'
-                    return form_error
-            return True
+            job = ImportJob(session.bind)
+            for v in self.form_result.itervalues():               
+                for i, entry in enumerate(v):
+                    self.addData(entry, job, i)
+            return self.submitImport(job)
         else:
             return self.form_error   
         
@@ -241,151 +271,137 @@ class CaseController(BaseController):
     def jsonEditEntries(self):
         """
             Same as `self.jsonAddEntries` but allows the editing of old entries and the addition
-            of new entries.
+            of new entries. The changes to the old groups and the groups to delete are given to
+            the `ImportJob`, so they are only made if all the files are added.
         """
         groups = []
         
         if self.validate_form(edit2_form()):
+            job = ImportJob(session.bind)
             # form is validated, so edit group details
-            for i, v in enumerate(self.form_result.itervalues()):   
-                for entry in v:            
+            for v in self.form_result.itervalues():   
+                for i, entry in enumerate(v):            
                     if entry[u'group'] is None: # new, so add it
-                        group = self.addData(entry)
-                        
-                        if group is None:
-                            form_error = {}
-                            form_error['csv_entry-' + str(i) + '.data'] = \
-                            'The data could not be added to the database due to an error.'
-                            return form_error
-                
+                        group = self.addData(entry, job, i)
                         groups.append(group)
                     else:                       # already there, edit it
                         group = entry[u'group']
                         groups.append(group)
-                        group.name = entry[u'name']
-                        group.description = entry[u'desc']
-                        group.program = get_program(entry[u'program'])
+                        values = {'name': entry[u'name'], 'description': entry[u'desc'],
+                                  'program': get_program(entry[u'program'])}
                         
                         if entry[u'keepcsv'] == False: # add new csv data
-                            group.csv_name = entry[u'data'].filename
+                            values['csv_name'] = entry[u'data'].filename
                             
-                            self.addEntry(group.program, entry['data'].stream, group)
+                            self.saveUpload(entry[u'data'], job, i, group, values['program'], 
+                                            False)
+                        job.edit(group, values)
                       
                     session.flush()
             
             # some data might be deleted, loop through all groups, if not in 'groups' then can delete it
             for g in self.case.groups:
                 if g not in groups:
-                    session.delete(g)
+                    job.delete(g)
             
-            return True
+            return self.submitImport(job)
         else:
             return self.form_error
+    
+    # IMPORT PROGRESS
+    # ---------------------------------------
+    
+    @jsonify
+    def jsonImportStatus(self, job):
+        """
+            Endpoint polled by the webpage while the files are being added in the background.
+            Returns the job's status: its state, how many rows have been parsed and inserted,
+            the rows inserted per second and the estimated number of seconds left. If the job 
+            failed, the form error for the file that could not be added is returned in `errors`.
+            The database is not touched, so this is quick to answer while the job is running.
+        """
+        job = job_queue.get(job)
+        if job is None:
+            raise NotFound()
+        
+        status = job.status()
+        if job.state == 'failed':
+            self.import_error = job.error
+            status['errors'] = self.dataError(job.error_field or 0)
+        return status
        
     # Useful methods
     # ======================================= 
 
     def addEntry(self, program, file, group):
         """
-            Calls the generator `convert_file()` found in :doc:`converters` on each row of the file, 
-            and adds the result to the database. If an exception happens during the converting and
-            adding of data, then the session is rolled back and `None` is returned. Otherwise
-            `True` is returned. 
+            Calls the generator `convert_file()` found in :doc:`converters` on the file, 
+            and adds the rows to the database in chunks using `EntryImporter` found in 
+            :doc:`importer`. The file is only read once: each row is checked as it is converted.
             
-            .. note::
-                This had been optimised to make the adding of data as fast as possible, but
-                has been slowed down again by adding search terms. 
-                
-                **ToDo**: Optimise the adding of search terms. 
+            The rows are staged in the current transaction, so they only become part of the case
+            if the whole file is added. If an exception happens during the converting and
+            adding of data, then the session is rolled back, the exception is kept in 
+            `self.import_error` and `None` is returned. Otherwise `True` is returned. 
+            
+            The wizard adds its files with `ImportJob` instead, which runs in the background.
         """
-        session.flush()
-        browser_ids = {}        
-        
         try:
-            entry_ins = Entry.__table__.insert()
-            url_ins = URL.__table__.insert()
-            for i, d in enumerate(convert_file(program, file)):
-                browser_name = d.pop('browser_name')
-                browser_version = d.pop('browser_version')
-                source = d.pop('source_file')
-                                
-                key = (browser_name, browser_version, source)                
-                browser_id = browser_ids.get(key)
-                if browser_id is None:
-                    browser = Browser.getFilterBy(name=browser_name, version=browser_version,
-                                                  source=source).first()
-                    if browser is None:
-                        browser = Browser(*key)
-                        session.add(browser)
-                        session.flush()
-                    browser_id = browser_ids[key] = browser.id
-                
-                # optimised to make adding data as fast as possible - ignores the ORM
-                v = d.pop('access_time')
-                if v is not None:
-                    d['access_date'] = datetime(v.year, v.month, v.day, 0, 0, 0, 0)
-                    d['access_time'] = time(v.hour, v.minute, v.second, v.microsecond)
-                else:
-                    continue # don't add data without an access time
-                v = d.pop('modified_time')
-                if v is not None:
-                    d['modified_date'] = datetime(v.year, v.month, v.day, 0, 0, 0, 0)
-                    d['modified_time'] = time(v.hour, v.minute, v.second, v.microsecond)
-                else:
-                    d['modified_date'] = None
-                    d['modified_time'] = None
-                
-                result = session.execute(entry_ins.values(browser_id=browser_id, 
-                                                          group_id=group.id,
-                                                           **d))                
-                entry_id = result.last_inserted_ids()[0]
-                
-                # add URLS
-                url = URL(d['url'])
-                session.execute(url_ins.values(entry_id=entry_id, **url.asDict()))  
-                url_id = result.last_inserted_ids()[0]
-                
-                # add search terms
-                # TODO: make this optimised like above!
-                entry = Entry.get(entry_id)
-                url = URL.get(url_id)
-                
-                opts = config.options('search_engines')
-                if url.query != None and 'search' in url.path:
-                    for opt in opts:
-                        if opt in url.netloc:
-                            query = url.query.split(config.get('search_engines', opt)+'=')\
-                                    [-1].split('&')[0]
-                            q_string, terms = SearchTerms.getTerms(urllib.unquote(query))
-                            url.search = q_string 
-                            for term in terms:
-                                t = SearchTerms.getFilterBy(term=term, engine=opt).first()
-                                if t is None:
-                                    t = SearchTerms(term, opt, config.get('search', opt))
-                                    session.add(t)
-                                else:
-                                    t.occurrence = t.occurrence + 1
-                                entry.search_terms.append(t)
-                                session.flush()                    
+            EntryImporter(group).run(convert_file(program, file))
         except Exception, e:
             session.rollback()            
+            self.import_error = e
             return None
         return True
     
-    def addData(self, entry):
+    def saveUpload(self, upload, job, i, group, program, new_group):
+        """
+            Saves the uploaded file to a temporary file and adds it to the `ImportJob` `job`,
+            so it can be added to `group` after the request has finished. `program` is the 
+            program the file was made by.
+        """
+        fd, filename = tempfile.mkstemp(prefix='webscavator-')
+        f = fdopen(fd, 'wb')
+        try:
+            upload.stream.seek(0) # the validators have already read the start of the file
+            upload.save(f)
+        finally:
+            f.close()
+        job.add(i, group, program, filename, new_group)
+        
+    def submitImport(self, job):
+        """
+            Commits the groups so the background job can see them, submits the job and 
+            returns the URL of its status for the webpage to poll. 
+        """
+        session.commit()
+        id = job_queue.submit(job)
+        return {'status': self.urls.build('case.jsonImportStatus', {'job': id})}
+    
+    def dataError(self, i):
+        """
+            Returns the form error for the `i`th file when its data could not be added. If the
+            file could not be converted, the error says which line of the file was bad. 
+        """
+        form_error = {}
+        if isinstance(self.import_error, ConversionError):
+            form_error['csv_entry-' + str(i) + '.data'] = \
+            dataError(self.urls.build('general.guidelines', {}), self.import_error)
+        else:
+            form_error['csv_entry-' + str(i) + '.data'] = \
+            'The data could not be added to the database due to an error.'
+        return form_error
+    
+    def addData(self, entry, job, i):
         """ 
             Given a validated form called `entry`, adds the group to the database, 
-            then calls `self.addEntry()` to convert the data in `entry['data']` to `Entry` objects. 
-            Returns the group if the adding of entries was successful, and otherwise
-            returns `None`. 
+            then calls `self.saveUpload()` so `job` converts the data in `entry['data']` to 
+            `Entry` objects. `i` is the index of the file in the form. Returns the group. 
         """        
         group = Group(entry[u'name'], entry[u'desc'], self.case, get_program(entry[u'program']))
         group.csv_name = entry[u'data'].filename
         session.add(group)
+        session.flush() # give the group an id
         
-        # convert the file to entries 
-        done = self.addEntry(group.program, entry['data'].stream, group)
-        if done == True:
-            return group # used in jsonEditEntries
-        else:
-            return None # exception happened!
+        self.saveUpload(entry[u'data'], job, i, group, group.program, True)
+        return group # used in jsonEditEntries
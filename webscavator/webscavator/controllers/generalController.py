@@ -17,7 +17,7 @@ from mako.lookup import TemplateLookup
 from werkzeug.exceptions import NotFound
 # local imports
 from webscavator.controllers.baseController import BaseController, lookup
-from webscavator.model.models import Case, Filter, Entry, Browser
+from webscavator.model.models import Case, Filter, Entry, Browser, Summary
 from webscavator.converters import get_program_infos, get_programs_files, get_names
 from webscavator.utils.utils import ROOT_DIR
 
@@ -32,15 +32,19 @@ class GeneralController(BaseController):
             Endpoint for index page of webscavator. If a case has been loaded, this will 
             show information about the case and lead onto the visualisations. 
             Otherwise, the index page will display a choice
-            to either load a case or create a new case. 
+            to either load a case or create a new case. The overview statistics come from 
+            `Summary.getStatistics()` in :doc:`models`.
         """    
         if self.done_wizard: # wizard completed
             if self.case: # just to check cookie set correctly
                 self.loaded_case = None
                 
+                # the statistics only change when data is added, so are kept in the database
+                statistics = Summary.getStatistics()
+                
                 # dates and times for the limits and end points of the timegraph
-                latest = Case.getNewestEntry(self.case).access_date
-                oldest = Case.getOldestEntry(self.case).access_date
+                latest = statistics['newest_date']
+                oldest = statistics['oldest_date']
                 start, end = Case.getMinMax(latest)
                 backward_limit = time.mktime(datetime(oldest.year, oldest.month, 1).timetuple())*1000
                 forward_limit = end
@@ -49,13 +53,14 @@ class GeneralController(BaseController):
                 allfilters = Filter.getAll().all()
                 
                 # for the overview statistics and heatmap
-                browser_stats = Browser.getPercentages()
-                average_pages = Entry.averagePages()
-                peak_time = Entry.peakTime()
-                heatmap_headers, heatmap_rows, high, low = Entry.generateHeatMap()
+                browser_stats = statistics['browser_stats']
+                average_pages = statistics['average_pages']
+                time_counts = statistics['time_counts']
+                peak_time = Entry.peakTime(counts=time_counts)
+                heatmap_headers, heatmap_rows, high, low = Entry.generateHeatMap(counts=time_counts)
                 
                 # for the local file access tab
-                files_accessed, file_amount = Entry.filesAccessed()
+                files_accessed, file_amount = statistics['files_accessed']
                     
                 return self.returnResponse('pages', 'index.html', ticksize = 61, start = start, 
                                            end = end, allfilters = allfilters, 
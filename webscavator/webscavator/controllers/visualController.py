@@ -32,11 +32,11 @@ class VisualController(BaseController):
         """
             Endpoint for the add filter pop-up page. 
         """
-        options = json.dumps({"Browser": self.processOptions(Browser.getFilterOptions()),
-                              "URL Parts": self.processOptions(URL.getFilterOptions()),
-                              "Web Files": self.processOptions(Group.getFilterOptions()),
-                              "Entry": self.processOptions(Entry.getFilterOptions()),
-                              'Search Terms':self.processOptions(SearchTerms.getFilterOptions())
+        options = json.dumps({"Browser": self.processOptions(Browser),
+                              "URL Parts": self.processOptions(URL),
+                              "Web Files": self.processOptions(Group),
+                              "Entry": self.processOptions(Entry),
+                              'Search Terms':self.processOptions(SearchTerms)
                               })
         list_files = getLists()
         return self.returnResponse('filters', 'add.html', 
@@ -47,8 +47,9 @@ class VisualController(BaseController):
     def jsonAddFilter(self):
         """
             Endpoint for the AJAX request to validate and add a new filter. If valid, the filter
-            is added and a new hash is created and appended to the database file with the current 
-            date and time, returning `True`. Otherwise `self.form_error` is returned.
+            is added along with its bitmap (see `FilterBitmap.fill()` in :doc:`models`) and a new
+            hash is created and appended to the database file with the current date and time, 
+            returning `True`. Otherwise `self.form_error` is returned.
         """
         if self.validate_form(add_filter_form()):
             text = self.form_result['name']
@@ -71,7 +72,9 @@ class VisualController(BaseController):
                 
             fil.query = fq
             session.add(fil)
+            FilterBitmap.fill()
             session.commit()
+            Filter.filtersChanged()
             
             self.write_log(self.dbfile, 'Added a filter called ' + text)
             
@@ -79,18 +82,48 @@ class VisualController(BaseController):
         else:
             return self.form_error  
         
+    @jsonify
+    def jsonGetFilterValues(self):
+        """
+            Endpoint for the AJAX request to get the values of a column that has too many to
+            list in the add filter pop-up. Calls `FilterValue.getValues()` in :doc:`models` with
+            the `column` and `prefix` arguments, and returns page `page` of the (value, count) 
+            tuples starting with the prefix and whether there are any more pages. There are
+            `value_page_size` values in a page, from the `[filters]` section of the config file.
+        """
+        column = self.request.args.get('column', u'')
+        prefix = self.request.args.get('prefix', u'')
+        page = self.request.args.get('page', 0, type=int)
+        if column not in FilterValue.getColumns():
+            return {'values': [], 'more': False}
+        
+        size = config.getint('filters', 'value_page_size')
+        values = FilterValue.getValues(column, prefix, page * size, size + 1)
+        return {'values': values[:size], 'more': len(values) > size}
+        
     @staticmethod
-    def processOptions(opts):
+    def processOptions(cls):
         """
             Process the options for each filterable table in :doc:`models`. 
             Returns a dictionary with the table attribute as keys and the operations, 
-            values and value type as the value tuple. 
+            values and value type as the value tuple. The values are (value, count) tuples 
+            from `FilterValue.getValues()`. Columns with more than `value_list_size` values
+            (from the `[filters]` section of the config file) have the value type `typeahead`
+            and no values; the name of the column to get them from with `jsonGetFilterValues()`
+            is added to the tuple instead.
         """
+        size = config.getint('filters', 'value_list_size')
         d = {}
-        for k, v in opts.iteritems():
+        for k, v in cls.getFilterOptions().iteritems():
             label, op, callback, value_type = v
-            vals = [getattr(obj, k) for obj in callback().group_by(k).all() \
-                    if getattr(obj, k) is not None and getattr(obj, k) != ''] if callback else None
+            if callback:
+                column = u'%s.%s' % (cls.__name__, k)
+                vals = FilterValue.getValues(column, limit=size + 1)
+                if len(vals) > size:
+                    d[label] = (op, None, 'typeahead', column)
+                    continue
+            else:
+                vals = None
             d[label] = (op, vals, value_type)
         return d
      
@@ -102,19 +135,34 @@ class VisualController(BaseController):
     def jsonGetWordClouds(self):
         """
             Endpoint for the AJAX request to get the search terms in the word cloud.
-            Calls `Filter.onlineSearches()` in :doc:`filters` for each search engine in the config file.
-            Returns a dictionary of terms.
+            Calls `Filter.onlineSearches()` in :doc:`models` to get the terms of every search 
+            engine in the config file. Returns a dictionary of terms.
         """
         highlight_funcs, remove_funcs = convertFilters(self.request.args)            
         amount = self.request.args.get('amount', 20)
         
         search_results = {}
-        opts = config.options('search_engines')
-        for opt in opts:
-            cloud, terms, unique, small = Filter.onlineSearches(opt, highlight_funcs, remove_funcs,
-                                                                amount)
+        clouds = Filter.onlineSearches(highlight_funcs, remove_funcs, amount)
+        for opt, (cloud, terms, unique, small) in clouds.iteritems():
             search_results[opt] = (cloud, terms, opt, config.get('search', opt), unique, small)
         return search_results
+    
+    @jsonify
+    def jsonGetSearches(self):
+        """
+            Endpoint for the AJAX request to get the searches a term in the word cloud was in, 
+            when the term is clicked. Calls `Filter.searches()` in :doc:`models` with the `term`
+            argument and the filters, and returns page `page` of the (search phrase, date) 
+            tuples and whether there are any more pages. There are `page_size` searches in a 
+            page, from the `[wordcloud]` section of the config file.
+        """
+        highlight_funcs, remove_funcs = convertFilters(self.request.args)
+        term = self.request.args.get('term', 0, type=int)
+        page = self.request.args.get('page', 0, type=int)
+        
+        size = config.getint('wordcloud', 'page_size')
+        searches = Filter.searches(term, highlight_funcs, remove_funcs, page * size, size + 1)
+        return {'searches': searches[:size], 'more': len(searches) > size}
 
     #
     #    Domains
@@ -132,6 +180,20 @@ class VisualController(BaseController):
         return URL.getTop(num=amount, highlight_funcs=highlight_funcs, remove_funcs=remove_funcs)
     
 
+    #    Files
+    # ======================
+    
+    @jsonify
+    def jsonGetFileDates(self):
+        """
+            Endpoint for the AJAX request to get the times a file in the File tab was accessed.
+            Calls `Entry.fileDates()` in :doc:`models` with the `path` argument, and returns
+            a list of (date, time) strings, latest first.
+        """
+        path = self.request.args.get('path', '')
+        return [(date.strftime("%d/%m/%Y"), time.strftime("%H:%M:%S")) 
+                for date, time in Entry.fileDates(path)]
+    
     #    Timegraph
     # ======================
     
@@ -142,6 +204,10 @@ class VisualController(BaseController):
             in :doc:`models` with the date, time and filter options and returns a list of 
             dictionaries that Flot can understand to plot. 
             The dictionaries are those points to be highlighted, removed and visible. 
+            
+            If there are more than `max_points` entries between the dates (from the 
+            `[timegraph]` section of the config file), `Case.getTimeGraphBins()` is called 
+            instead so the response stays small, and each dictionary has `binned` set. 
         """
         
         # Used incase of bad dates given, defaults to the latest month
@@ -180,30 +246,39 @@ class VisualController(BaseController):
         else:
             remove_duplicates = False
         
-        # get the two lists of data to be plotted: normal and highlighted.
-        # removed data is just not shown.
-        highlighted, not_highlighted,removed = Case.getTimeGraph(startdate, enddate, starttime, endtime,
-                                                   remove_funcs, highlight_funcs,
-                                                   remove_duplicates=remove_duplicates,
-                                                   duplicate_time=duplicate_time)   
+        # get the three lists of data to be plotted: removed, normal and highlighted.
+        # if there are too many entries, they are counted in cells instead.
+        binned = Case.countTimeGraph(startdate, enddate) > config.getint('timegraph', 'max_points')
+        if binned:
+            highlighted, not_highlighted, removed = Case.getTimeGraphBins(startdate, enddate,
+                                                       remove_funcs, highlight_funcs,
+                                                       config.getint('timegraph', 'max_bins'))
+        else:
+            highlighted, not_highlighted,removed = Case.getTimeGraph(startdate, enddate, starttime, endtime,
+                                                       remove_funcs, highlight_funcs,
+                                                       remove_duplicates=remove_duplicates,
+                                                       duplicate_time=duplicate_time)   
         
         return [{   
                 'label': 'removed',
                 'data': removed,
                 'points': {'show': True, 'fill': '0'},
-                'color': '#E8E8E8'
+                'color': '#E8E8E8',
+                'binned': binned
         },
         {   
                 'label': 'non-highlighted',
                 'data': not_highlighted,
                 'points': {'show': True, 'fill': '0'},
-                'color': '#1874CD'
+                'color': '#1874CD',
+                'binned': binned
         },                
         {   
                 'label': 'highlighted',
                 'data': highlighted,
                 'points': {'show': True, 'fill': '0'},
-                'color': '#FF6103'
+                'color': '#FF6103',
+                'binned': binned
         }]
     
     
@@ -236,19 +311,17 @@ def convertFilters(request_args):
     """
         For each request argument, if it is a filter, than put it in the appropriate filter list.
         The request arguments will either be "highlight" or "remove" and will subsequently be put
-        in either `highlight_funcs` or `remove_funcs`. Returns those lists.
+        in either `highlight_funcs` or `remove_funcs`. Returns those lists. The filters are looked
+        up in `Filter.getQueries()` in :doc:`models`, so they are not loaded on every request.
     """
     remove_funcs = []
     highlight_funcs = [] 
+    queries = Filter.getQueries()
     for label, value in request_args.iteritems():
-        f = Filter.getFilterBy(label=label).first()
-        if f is not None and value == "highlight":
-            q = getattr(f, 'query', None)
-            if q is not None:
-                highlight_funcs.append(q)
-        elif f is not None and value == "remove":
-            q = getattr(f, 'query', None)
-            if q is not None:
-                remove_funcs.append(q)
+        q = queries.get(label)
+        if q is not None and value == "highlight":
+            highlight_funcs.append(q)
+        elif q is not None and value == "remove":
+            remove_funcs.append(q)
                 
     return highlight_funcs, remove_funcs
\ No newline at end of file
@@ -98,20 +98,55 @@ program_info = {'Pasco': {
                 }
                 
 
+# Errors
+# ======
+
+class ConversionError(Exception):
+    """
+        Yielded by the converters in place of a normalised row when a row could not be 
+        converted. `line` is the line number (or record number for XML) of the bad row 
+        in the file, and `error` the original exception. 
+    """
+    def __init__(self, line, error, unit='line'):
+        Exception.__init__(self, line, error, unit)
+        self.line = line
+        self.error = error
+        self.unit = unit
+        
+    def __str__(self):
+        return "%s %s: %s" % (self.unit, self.line, self.error)
+
+
 # Convert file
 # =============
 
-def convert_file(type, file):
+def convert_file(type, file, processes=1):
     """
         Given a file, locates the correct converter and returns a generator which produces 
-        a normalised dictionary of data for each row in the file.  
+        a normalised dictionary of data for each row in the file. Rows that cannot be 
+        converted produce a `ConversionError` instead. 
+        
+        If `processes` is more than 1, the rows are converted by that many processes, 
+        see :doc:`parallel`. If it is 0, a process is used for each CPU. The rows are 
+        still produced in the order they are in the file. This must only be used in a 
+        process with one thread, so Webscavator itself always uses 1. 
+    """
+    cls = get_converter(type)
+    
+    if processes != 1:
+        from webscavator.converters.parallel import convert_parallel
+        return convert_parallel(type, cls(file), processes)
+    
+    return cls(file).process() # return the converter's row generator
+
+def get_converter(type):
+    """
+        Given the python file name of a converter, return the converter's class.
     """
     name = 'webscavator.converters.' + type 
     __import__(name) # import the correct converter
     mod = sys.modules[name]
-    cls = getattr(mod, type.capitalize() + 'Converter') # get the converter class
-    
-    return cls(file).process() # return the converter's row generator
+    return getattr(mod, type.capitalize() + 'Converter') # get the converter class
 
 
 # Helper functions to abstract program_lookup
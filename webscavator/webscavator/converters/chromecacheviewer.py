@@ -1,5 +1,7 @@
 from csv_converter import CSVConverter
-from datetime import datetime
+from timestamps import TimestampParser
+
+parse_time = TimestampParser("%d/%m/%Y %H:%M:%S")
 
 class ChromecacheviewerConverter(CSVConverter):
     """
@@ -30,12 +32,12 @@ class ChromecacheviewerConverter(CSVConverter):
         content_encoding, cache_name, cache_control, e_tag, _ = row
 
         if modified_time: 
-            modified_time = datetime.strptime(modified_time,"%d/%m/%Y %H:%M:%S")
+            modified_time = parse_time(modified_time)
         else:
             modified_time = None
 
         if access_time:
-            access_time = datetime.strptime(access_time,"%d/%m/%Y %H:%M:%S")
+            access_time = parse_time(access_time)
         else:
             access_time = None
 
@@ -28,6 +28,7 @@
     All entries in the dictionary may be `None` apart from `url` and `access_time`.
 """
 import csv
+from webscavator.converters import ConversionError
 
 class CSVConverter(object):
     """
@@ -50,24 +51,51 @@ class CSVConverter(object):
         """
         self.csv_file = csv_file
     
+    unit = 'line'
+    
     def process(self):
         """
             Reads in the CSV file, skips `skip` number of lines and then for each line in the CSV file calls
             `self.process_row()` in the child class.
             
-            Returns a generator which can be looped over to get the normalised row.
+            Returns a generator which can be looped over to get the normalised row. If a row
+            cannot be converted, a `ConversionError` with the line number is given instead.
+        """
+        for line, row in self.records():
+            try:
+                yield self.convert(row)
+            except Exception, e:
+                yield ConversionError(line, e, self.unit)
+                
+    def records(self):
+        """
+            Returns a generator of (line number, row) tuples for each line after the first `skip`
+            lines. The rows are only split into fields, not converted, so that they can be 
+            converted in other processes (see :doc:`parallel`). 
         """
         self.csv_file.seek(0) # rewind to beginning
         csvreader = csv.reader(self.csv_file, delimiter=self.delimiter)
         
-        
         for _ in xrange(self.skip):
             csvreader.next()
 
         for row in csvreader:
-            try:
-                yield self.process_row(row)
-            except Exception, e:
-                yield e
-
-        
\ No newline at end of file
+            yield csvreader.line_num, row
+            
+    def convert(self, row):
+        """
+            Convert a row given by `self.records()` into a normalised dictionary.
+        """
+        return self.process_row(row)
+    
+    def pack(self, row):
+        """
+            Returns the row in a form that can be sent to another process. 
+        """
+        return row
+    
+    def unpack(self, row):
+        """
+            Reverses `self.pack()`. 
+        """
+        return row
@@ -1,5 +1,7 @@
 from csv_converter import CSVConverter
-from datetime import datetime
+from timestamps import TimestampParser
+
+parse_time = TimestampParser("%d/%m/%Y %H:%M:%S")
 
 class FoxanalysisConverter(CSVConverter):
     """
@@ -38,7 +40,7 @@ class FoxanalysisConverter(CSVConverter):
                                  # This recombines any fields which have been separated because of this. 
         
         if datevisited:
-            access_time = datetime.strptime(datevisited,"%d/%m/%Y %H:%M:%S")
+            access_time = parse_time(datevisited)
         else:
             access_time = None
 
@@ -1,5 +1,7 @@
 from csv_converter import CSVConverter
-from datetime import datetime
+from timestamps import TimestampParser
+
+parse_time = TimestampParser("%d/%m/%Y %H:%M:%S %a")
 
 class NetanalysisConverter(CSVConverter):
     """
@@ -45,12 +47,12 @@ class NetanalysisConverter(CSVConverter):
         index_type, browser_version, ie_type, status, bookmark, urn = row
         
         if modified_time:
-            modified_time = datetime.strptime(modified_time,"%d/%m/%Y %H:%M:%S %a")
+            modified_time = parse_time(modified_time)
         else:
             modified_time = None
             
         if access_time: 
-            access_time = datetime.strptime(access_time,"%d/%m/%Y %H:%M:%S %a")
+            access_time = parse_time(access_time)
         else:
             access_time = None
 
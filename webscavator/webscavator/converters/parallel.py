@@ -0,0 +1,137 @@
+"""
+    Parallel Conversion
+    -------------------
+
+    Converting a file is mostly CPU work: parsing dates, decoding strings and splitting URLs
+    into their parts. `convert_parallel()` spreads this work over a pool of processes.
+
+    The file is still read in this process - the converter's `records()` splits it into
+    rows (or XML elements) without converting them. The rows are sent to the pool in
+    batches of `batch_size`, and each process converts them with the converter's `convert()`
+    and splits the URL using `URL.decompose()` in :doc:`models`. The converted rows are sent
+    back as tuples in the order of `FIELDS` and `URL_FIELDS` (rather than dictionaries, which
+    are slower to send between processes) and turned back into dictionaries here, in the
+    same order as they are in the file. The URL parts are put in the dictionary as
+    `url_parts`.
+
+    Only a few batches are sent to the pool at once, so a large file is never
+    held in memory all at the same time.
+
+    If the `multiprocessing` module is not available, the file is converted in this process.
+
+    Forking from a process which has threads is not safe in Python 2 - the child can inherit
+    a lock held by another thread and hang. Webscavator converts the files added by the 
+    wizard in the background threads of :doc:`jobs`, so it always converts them in the thread
+    itself. `convert_parallel()` is only for processes with one thread, such as scripts 
+    converting a file.
+
+    Functions
+    ---------
+"""
+
+# python imports
+from collections import deque
+try:
+    import multiprocessing
+except ImportError:
+    multiprocessing = None
+# local imports
+from webscavator.converters import get_converter, ConversionError
+
+FIELDS = ('type', 'url', 'modified_time', 'access_time', 'filename', 'directory',
+          'http_headers', 'title', 'deleted', 'content_type', 'browser_name',
+          'browser_version', 'source_file')
+
+URL_FIELDS = ('scheme', 'netloc', 'path', 'params', 'query', 'fragment', 'username',
+              'password', 'hostname', 'port', 'domain')
+
+batch_size = 1000
+
+
+def convert_parallel(type, converter, processes=0, size=None):
+    """
+        Given the python file name of a converter and a converter instance for the file,
+        returns a generator of normalised dictionaries like `converter.process()`, but
+        converts the rows using `processes` processes. If `processes` is 0, a process
+        is used for each CPU. `size` is the number of rows sent to a process at a time
+        and defaults to `batch_size`.
+    """
+    if multiprocessing is None:
+        return converter.process()
+
+    if processes == 0:
+        processes = multiprocessing.cpu_count()
+    if processes <= 1:
+        return converter.process()
+
+    return _convert(type, converter, processes, size or batch_size)
+
+def _convert(type, converter, processes, size):
+    """
+        Generator that sends batches of rows to the pool and gives back the converted rows
+        in order. At most two batches per process are waiting to be converted at a time.
+    """
+    pool = multiprocessing.Pool(processes)
+    try:
+        pending = deque()
+        for batch in _batches(converter, size):
+            pending.append(pool.apply_async(_convert_batch, (type, batch)))
+            if len(pending) > processes * 2:
+                for d in _rows(pending.popleft().get()):
+                    yield d
+        while pending:
+            for d in _rows(pending.popleft().get()):
+                yield d
+    finally:
+        pool.terminate()
+
+def _batches(converter, size):
+    """
+        Split the records of the converter into lists of `size` (number, record) tuples that
+        can be sent to another process.
+    """
+    batch = []
+    for number, record in converter.records():
+        batch.append((number, converter.pack(record)))
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def _convert_batch(type, batch):
+    """
+        Run in the pool. Converts a batch of records, returning a list of
+        (row tuple, URL tuple) tuples, or a `ConversionError` for a row that could not
+        be converted.
+    """
+    from webscavator.model.models import URL
+
+    converter = get_converter(type)(None)
+    rows = []
+    for number, record in batch:
+        try:
+            d = converter.convert(converter.unpack(record))
+            if d['url'] is not None:
+                url = URL.decompose(d['url'])
+                url = tuple([url[f] for f in URL_FIELDS])
+            else:
+                url = None
+            rows.append((tuple([d[f] for f in FIELDS]), url))
+        except Exception, e:
+            rows.append(ConversionError(number, e, converter.unit))
+    return rows
+
+def _rows(results):
+    """
+        Turn the tuples made by `_convert_batch()` back into normalised dictionaries.
+    """
+    for row in results:
+        if isinstance(row, ConversionError):
+            yield row
+        else:
+            values, url = row
+            d = dict(zip(FIELDS, values))
+            if url is not None:
+                d['url_parts'] = dict(zip(URL_FIELDS, url))
+            yield d
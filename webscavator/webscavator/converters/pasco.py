@@ -1,5 +1,7 @@
 from csv_converter import CSVConverter
-from datetime import datetime
+from timestamps import TimestampParser
+
+parse_time = TimestampParser("%m/%d/%Y %H:%M:%S")
 
 class PascoConverter(CSVConverter):
     """
@@ -31,12 +33,12 @@ class PascoConverter(CSVConverter):
         type, url, modified_time, access_time, filename, directory, http_headers = row
 
         if modified_time:
-            modified_time = datetime.strptime(modified_time,"%m/%d/%Y %H:%M:%S")
+            modified_time = parse_time(modified_time)
         else:
             modified_time = None
 
         if access_time:
-            access_time = datetime.strptime(access_time,"%m/%d/%Y %H:%M:%S")
+            access_time = parse_time(access_time)
         else:
             access_time = None
 
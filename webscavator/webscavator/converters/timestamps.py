@@ -0,0 +1,174 @@
+"""
+    Timestamps
+    ----------
+
+    The converters parse every timestamp in a file with a fixed format, so `datetime.strptime`
+    spends most of its time working out the same format over and over. `TimestampParser`
+    works out where each field is in the format once, and then reads the fields straight
+    out of the timestamp string. Files are usually sorted by time, so the date part of a
+    timestamp is nearly always the same as one seen before - dates (and times of day) are 
+    remembered so they are only checked once.
+
+    Only the fixed width directives `%d`, `%m`, `%Y`, `%H`, `%M`, `%S` and `%a` are read this way.
+    Any timestamp that does not fit the format exactly (e.g. a single digit day) is given
+    to `datetime.strptime`, so malformed timestamps raise the same errors as before.
+
+    `benchmark()` compares `TimestampParser` to `datetime.strptime`. It can be run from
+    :doc:`launch` by typing in the command line:
+
+    ::
+
+        > python launch.py benchmark_timestamps
+
+    Functions and Classes
+    ---------------------
+"""
+
+# python imports
+from datetime import datetime, timedelta
+import time
+
+WIDTHS = {'d': 2, 'm': 2, 'Y': 4, 'H': 2, 'M': 2, 'S': 2, 'a': 3}
+WEEKDAYS = frozenset(['Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun'])
+
+
+class TimestampParser(object):
+    """
+        Parses timestamps in the given `strptime` format. Call the parser with a timestamp
+        string to get a `datetime`.
+
+        `cache_size`
+            number of different dates remembered before the memory is cleared
+    """
+
+    cache_size = 10000
+
+    def __init__(self, format):
+        self.format = format
+        self.fields = {}    # directive -> slice
+        self.literals = []  # (position, character) that must match
+        self.dates = {}     # date part of timestamp -> (year, month, day)
+        self.times = {}     # time part of timestamp -> (hour, minute, second)
+        self.fast = True
+
+        pos = 0
+        i = 0
+        while i < len(format):
+            c = format[i]
+            if c == '%' and i + 1 < len(format):
+                directive = format[i + 1]
+                if directive not in WIDTHS or directive in self.fields:
+                    self.fast = False # can't read this format directly, always use strptime
+                    break
+                self.fields[directive] = slice(pos, pos + WIDTHS[directive])
+                pos = pos + WIDTHS[directive]
+                i = i + 2
+            else:
+                self.literals.append((pos, c))
+                pos = pos + 1
+                i = i + 1
+        self.length = pos
+
+        if not all([d in self.fields for d in 'dmYHMS']):
+            self.fast = False
+
+        if self.fast:
+            # the date fields and the time fields are next to each other in the formats used, 
+            # so the part of the string from the first to the last date (or time) field is 
+            # used to remember dates (or times). The characters between them are checked 
+            # when the date (or time) is first seen. 
+            self.date_part = self._span('dmY')
+            self.time_part = self._span('HMS')
+            self.outside = [(pos, c) for pos, c in self.literals 
+                            if not (self._inside(pos, self.date_part) or 
+                                    self._inside(pos, self.time_part))]
+            self.weekday = self.fields.get('a')
+
+    def __call__(self, value):
+        if not self.fast or len(value) != self.length:
+            return datetime.strptime(value, self.format)
+
+        for pos, c in self.outside:
+            if value[pos] != c:
+                return datetime.strptime(value, self.format)
+
+        key = value[self.date_part]
+        date = self.dates.get(key)
+        if date is None:
+            date = self._parse(value, self.date_part, 'Ymd')
+            if date is None:
+                return datetime.strptime(value, self.format)
+            if len(self.dates) >= self.cache_size:
+                self.dates.clear()
+            self.dates[key] = date
+
+        key = value[self.time_part]
+        hms = self.times.get(key)
+        if hms is None:
+            hms = self._parse(value, self.time_part, 'HMS')
+            if hms is None:
+                return datetime.strptime(value, self.format)
+            self.times[key] = hms # there are only 86400 different times
+
+        if self.weekday is not None and value[self.weekday] not in WEEKDAYS:
+            return datetime.strptime(value, self.format)
+
+        return datetime(date[0], date[1], date[2], hms[0], hms[1], hms[2])
+
+    def _span(self, directives):
+        """
+            Returns the slice from the start of the first to the end of the last directive.
+        """
+        fields = [self.fields[d] for d in directives]
+        return slice(min([s.start for s in fields]), max([s.stop for s in fields]))
+
+    def _inside(self, pos, span):
+        return span.start <= pos < span.stop
+
+    def _parse(self, value, span, directives):
+        """
+            Returns the values of the directives as a tuple of integers, or `None` if the 
+            fields are not numbers, the characters between them do not match the format or 
+            the values are out of range.
+        """
+        for pos, c in self.literals:
+            if self._inside(pos, span) and value[pos] != c:
+                return None
+        parts = []
+        for d in directives:
+            v = value[self.fields[d]]
+            if not v.isdigit():
+                return None
+            parts.append(int(v))
+        try:
+            if directives == 'Ymd':
+                datetime(parts[0], parts[1], parts[2])
+            else:
+                datetime(2000, 1, 1, parts[0], parts[1], parts[2])
+        except ValueError:
+            return None
+        return tuple(parts)
+
+
+def benchmark(count=1000000, format="%d/%m/%Y %H:%M:%S"):
+    """
+        Parse `count` timestamps spread over a month with `datetime.strptime` and with
+        `TimestampParser`. Returns the number of seconds each took as a
+        (strptime, TimestampParser) tuple.
+    """
+    start = datetime(2010, 5, 1)
+    step = timedelta(days=30) / count
+    values = [(start + step * i).strftime(format) for i in xrange(count)]
+
+    t = time.time()
+    for v in values:
+        datetime.strptime(v, format)
+    strptime_time = time.time() - t
+
+    parse = TimestampParser(format)
+    t = time.time()
+    for v in values:
+        parse(v)
+    parser_time = time.time() - t
+
+    return strptime_time, parser_time
@@ -1,7 +1,9 @@
 from xml_converter import XMLConverter
-from datetime import datetime
+from timestamps import TimestampParser
 import urllib
 
+parse_time = TimestampParser("%Y-%m-%dT%H:%M:%S")
+
 class WebhistorianConverter(XMLConverter):
     """
         Converts Web Historian XML output to normalised format. The toplevel element for a web history
@@ -29,7 +31,7 @@ class WebhistorianConverter(XMLConverter):
             title = None
         
         if access_time: 
-            access_time = datetime.strptime(access_time[:-6],"%Y-%m-%dT%H:%M:%S") 
+            access_time = parse_time(access_time[:-6]) 
         else:
             access_time = None
         
@@ -27,11 +27,41 @@
     All entries in the dictionary may be `None` apart from `url` and `access_time`.
 """
 
-from xml.etree import ElementTree
+try:
+    from xml.etree import cElementTree as ElementTree
+except ImportError:
+    from xml.etree import ElementTree
+from webscavator.converters import ConversionError
+
+class CountingFile(object):
+    """
+        Wraps a file and counts the number of bytes read from it.
+    """
+    def __init__(self, file):
+        self.file = file
+        self.bytes_read = 0
+        
+    def read(self, size=-1):
+        data = self.file.read(size)
+        self.bytes_read = self.bytes_read + len(data)
+        return data
 
 class XMLConverter(object):
     """
+        The file is read as a stream, so only the web history element currently being 
+        converted is kept in memory, however big the file is. 
+        
+        Children classes must override topelement:
+        
+        `topelement`
+            the tag of the elements directly inside the root element that hold one web 
+            history entry each.
+            
+        `bytes_read` is the number of bytes of the file read so far.
     """
+    
+    topelement = None
+    bytes_read = 0
 
     def __init__(self, xml_file):
         """
@@ -39,19 +69,68 @@ class XMLConverter(object):
         """
         self.xml_file = xml_file
     
+    unit = 'record'
+    
     def process(self):
         """
             Reads in the XML file. Finds all the top level web history elements and 
             returns a generator which can be looped over to get the normalised element entries.
+            If an element cannot be converted, a `ConversionError` with the element's record
+            number is given instead.
         """
-        self.xml_file.seek(0)
-        xmlreader = ElementTree.parse(self.xml_file)
-        for row in xmlreader.findall(self.topelement):
+        for i, element in self.records():
             try:
-                yield self.process_element(row)
+                yield self.convert(element)
             except Exception, e:
-                yield e
+                yield ConversionError(i, e, self.unit)
+    
+    def records(self):
+        """
+            Returns a generator of (record number, element) tuples for each of the top level 
+            web history elements. The elements are not converted, so that they can be converted 
+            in other processes (see :doc:`parallel`).
+            
+            The file is parsed with `iterparse`, so each element is given as soon as it 
+            has been read. Once it has been used, it and any other finished elements inside 
+            the root element are thrown away. 
+        """
+        self.xml_file.seek(0)
+        counter = CountingFile(self.xml_file)
+        
+        root = None
+        depth = 0
+        number = 0
+        for event, element in ElementTree.iterparse(counter, events=('start', 'end')):
+            if event == 'start':
+                if root is None:
+                    root = element
+                depth = depth + 1
+            else:
+                depth = depth - 1
+                if depth == 1: # a child of the root element has finished
+                    self.bytes_read = counter.bytes_read
+                    if element.tag == self.topelement:
+                        number = number + 1
+                        yield number, element
+                    element.clear()
+                    del root[:]
+        self.bytes_read = counter.bytes_read
                     
-                
-
-        
\ No newline at end of file
+    def convert(self, element):
+        """
+            Convert an element given by `self.records()` into a normalised dictionary.
+        """
+        return self.process_element(element)
+    
+    def pack(self, element):
+        """
+            Returns the element in a form that can be sent to another process. Elements 
+            cannot be pickled, so they are sent as XML strings.
+        """
+        return ElementTree.tostring(element)
+    
+    def unpack(self, element):
+        """
+            Reverses `self.pack()`. 
+        """
+        return ElementTree.fromstring(element)
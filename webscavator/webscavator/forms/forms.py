@@ -91,9 +91,13 @@ class AddData(Data):
         `desc` -- optional description of dataset.
         
         
-        `data` -- the web history file. 
+        `data` -- the web history file. Validator checks the start of the file can be processed.
     """
     data = UploadData(not_empty=True)
+    
+    chained_validators = [
+        ValidCSVData(),
+    ]
 
 class EditData(Data):
     """
@@ -126,6 +130,7 @@ class EditData(Data):
     
     chained_validators = [
         RequireIfEquals('keepcsv', False, requireds=['data']),  #if not keeping the old data, then must upload new data
+        ValidCSVData(),
     ]
 
 class wizard2_form(Schema):
@@ -30,6 +30,7 @@
 # python imports
 import operator
 from os import path
+from itertools import islice
 import datetime
 # library imports
 from formencode import validators as v, Invalid
@@ -37,7 +38,7 @@ from formencode.compound import CompoundValidator
 # local imports
 from webscavator.model.models import *
 from webscavator.utils.utils import ROOT_DIR, CASE_FILE_DIR, getCases
-from webscavator.converters import get_names, convert_file, get_program
+from webscavator.converters import get_names, convert_file, get_program, ConversionError
 
 
 
@@ -146,8 +147,12 @@ class RequireIfNotEquals(RequireIfCondition):
 
 class ValidCSVData(v.FormValidator):
     """
-        Checks that the data in a CSV file can be processed correctly
+        Checks that the first `sample` rows of the data in a CSV file can be processed correctly. 
+        This catches the wrong program being picked for a file without reading the whole 
+        file - the rest of the file is checked as it is added to the database. 
     """
+    sample = 10
+    
     def validate_partial(self, vals, state):
         self.validate_python(vals, state)
     
@@ -155,15 +160,21 @@ class ValidCSVData(v.FormValidator):
         program = vals.get('program')
         file = vals.get('data')
         
-        guidelines_url =  state.urls.build('general.guidelines', {})
-        
         if program and file:
-            for d in convert_file(get_program(program), file): 
-                if isinstance(d, Exception):
+            for d in islice(convert_file(get_program(program), file), self.sample): 
+                if isinstance(d, ConversionError):
+                    guidelines_url =  state.urls.build('general.guidelines', {})
                     raise Invalid('', vals, state, error_dict={'data': 
-                    'There was an error processing the file. Please follow the \
-                    <a href="javascript:popUp(\'' + guidelines_url + '\')">guidelines</a> [pop-up]'})
+                                                               dataError(guidelines_url, d)})
     
+def dataError(guidelines_url, error):
+    """
+        Returns the error message shown when an uploaded file could not be processed.
+        `error` is the `ConversionError` of the first bad row in the file.
+    """
+    return 'There was an error processing %s %s of the file. Please follow the \
+            <a href="javascript:popUp(\'%s\')">guidelines</a> [pop-up]' % \
+            (error.unit, error.line, guidelines_url)
 
 # Specific Validators
 # ====================
@@ -417,9 +428,8 @@ class CheckAllowedValues(v.FormValidator):
                 raise Invalid('', vals, state, error_dict={'data': 'You have chosen an invalid selection'})
             else:
                 if type == "select":
-                    vals = [getattr(obj, attr) for obj in callback().group_by(attr).all() \
-                            if getattr(obj, attr) is not None and getattr(obj, attr) != '']
-                    if value not in vals:
+                    column = u'%s.%s' % (classes.get(cls).__name__, attr)
+                    if not FilterValue.hasValue(column, value):
                         raise Invalid('', vals, state, error_dict={'data': 'You have chosen an invalid selection'})
                 elif type == "date":
                     vals['value'] = v.DateConverter(month_style='dd/mm/yyyy').to_python(value, state)
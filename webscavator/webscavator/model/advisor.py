@@ -0,0 +1,170 @@
+"""
+    Query Plan Advisor
+    ------------------
+
+    `advise()` runs the queries behind each visualisation endpoint on a case, without filters,
+    and asks SQLite how it runs each of them with `EXPLAIN QUERY PLAN`. Any step that reads a
+    whole table without using an index is flagged, which often means an index is missing.
+    Indexes are added to existing cases by a migration, see :doc:`migrations`. Some scans are
+    expected, e.g. when every entry of the case is counted.
+
+    The case is only read: `advise()` does not call `init_database()`, and its connections
+    refuse to write to the case. If the case has not had all the migrations yet, they are 
+    listed instead, as the queries would use tables, columns and indexes the case does not 
+    have. Loading the case in Webscavator migrates it.
+
+    It is run from :doc:`launch` with the name of a case in the case file directory, or the
+    path of a case database:
+
+    ::
+
+        > python launch.py explain --case=mycase.db
+
+    Functions and Classes
+    ---------------------
+"""
+
+# python imports
+from datetime import datetime, time as t
+from os import path
+import re
+# library imports
+from sqlalchemy.interfaces import ConnectionProxy, PoolListener
+# local imports
+from webscavator.utils.utils import connect, bind, session, config, CASE_FILE_DIR
+from webscavator.model.models import Base, Case, Entry, URL, Filter, SearchTerms, Summary, \
+                                     FilterValue
+from webscavator.model.migrations import migrations
+
+SCAN = re.compile(r'^SCAN (?:TABLE )?(\w+)')
+
+
+class QueryRecorder(ConnectionProxy):
+    """
+        Connection proxy that keeps the (statement, parameters) of every `SELECT` run, in
+        `queries`.
+    """
+
+    def __init__(self):
+        self.queries = []
+
+    def cursor_execute(self, execute, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith('SELECT'):
+            self.queries.append((statement, parameters))
+        return execute(cursor, statement, parameters, context)
+
+
+class ReadOnly(PoolListener):
+    """
+        Stops a connection writing to the database while it is checked out of the pool, with
+        SQLite's `query_only` pragma. It is turned off again when the connection is checked 
+        in, so `ListTables` in :doc:`utils` can still make its temporary tables at checkout.
+    """
+
+    def checkout(self, dbapi_con, con_record, con_proxy):
+        dbapi_con.execute('PRAGMA query_only = 1')
+
+    def checkin(self, dbapi_con, con_record):
+        dbapi_con.execute('PRAGMA query_only = 0')
+
+
+def endpoints():
+    """
+        Returns a list of (endpoint, function) tuples, where the function makes the same
+        queries as the endpoint does when no filters are used. The timegraph is for the latest
+        two months of the case, like it is when first shown.
+    """
+    newest = Case.getNewestEntry(Case.get_case())
+    latest = newest.access_date if newest is not None else datetime.now()
+    start, end = [datetime.fromtimestamp(ms / 1000) for ms in Case.getMinMax(latest)]
+    file_path = session.query(URL.path).filter(URL.scheme == "file").limit(1).scalar()
+    term_id = session.query(SearchTerms.id).limit(1).scalar()
+
+    def timegraph():
+        Case.countTimeGraph(start, end)
+        Case.getTimeGraph(start, end, t(0, 0), t(23, 59, 59), [], [])
+        Case.getTimeGraphBins(start, end, [], [], config.getint('timegraph', 'max_bins'))
+
+    def overview():
+        for name, statistic in sorted(Summary.statistics.iteritems()):
+            statistic()
+
+    def values():
+        for column in sorted(FilterValue.getColumns()):
+            FilterValue.countValues(column)
+
+    return [('general.index', overview),
+            ('visual.addFilter', values),
+            ('visual.jsonGetEntries', timegraph),
+            ('visual.jsonGetDomains', URL.countDomains),
+            ('visual.jsonGetWordClouds', Filter.onlineSearches),
+            ('visual.jsonGetSearches', lambda: Filter.searches(term_id)),
+            ('visual.jsonGetFileDates', lambda: Entry.fileDates(file_path)),
+            ]
+
+def explain(connection, statement, parameters):
+    """
+        Returns the steps of the query plan of the statement as strings, and the steps which
+        read a whole table without an index.
+    """
+    cursor = connection.cursor()
+    try:
+        cursor.execute('EXPLAIN QUERY PLAN ' + statement, parameters)
+        steps = [row[-1] for row in cursor.fetchall()]
+    finally:
+        cursor.close()
+
+    scans = []
+    for step in steps:
+        m = SCAN.match(step)
+        if m is not None and 'INDEX' not in step and m.group(1) in Base.metadata.tables:
+            scans.append(step)
+    return steps, scans
+
+def missing(connection):
+    """
+        Returns a list of the migrations (see :doc:`migrations`) the database has not had, 
+        by version and function name, followed by the tables it does not have.
+    """
+    version = connection.execute('PRAGMA user_version').scalar()
+    names = [row[0] for row in connection.execute("SELECT name FROM sqlite_master "
+                                                  "WHERE type = 'table'")]
+    return ['Version %d: %s' % (i + 1, migrations[i].__name__) 
+            for i in xrange(version, len(migrations))] + \
+           ['Table %s' % name for name in sorted(Base.metadata.tables) if name not in names]
+
+def advise(case):
+    """
+        Given the name of a case in the case file directory or the path of a case database,
+        returns a list of the migrations and tables the case is missing, from `missing()`,
+        and a list of (endpoint, statement, query plan steps, full table scan steps) tuples
+        for each query made by the functions in `endpoints()`. If anything is missing, the 
+        queries are not run and the second list is empty.
+    """
+    if not path.exists(case):
+        case = path.join(CASE_FILE_DIR, case)
+    recorder = QueryRecorder()
+    db = connect(case, recorder, [ReadOnly()])
+    
+    connection = db.connect()
+    try:
+        needed = missing(connection)
+    finally:
+        connection.close()
+    if needed:
+        return needed, []
+    bind(db)
+
+    results = []
+    connection = db.raw_connection()
+    try:
+        for endpoint, function in endpoints():
+            del recorder.queries[:]
+            function()
+            for statement, parameters in recorder.queries:
+                steps, scans = explain(connection, statement, parameters)
+                results.append((endpoint, statement, steps, scans))
+    finally:
+        connection.close()
+        session.rollback()
+    return needed, results
@@ -6,25 +6,69 @@
     `FilterQuery` objects save the filter details and are stored pickled in the `Filter` class as
     `Filter.query` in :doc:`models`. 
     
+    The `REGEXP` SQL function used by 'Matches regular expression' is `regexp()` in :doc:`utils`,
+    which is added to each database connection when it is made. Regular expressions that 
+    only match text at the start of a value, such as `^www\.google`, are turned into `GLOB` 
+    patterns instead by `literal_prefix()`, which SQLite checks without calling Python.
+    
+    'Is in list' and 'Is not in list' read case lists with `readList()` in :doc:`utils`, so a
+    list file is only read again when it changes. Long lists are checked against their 
+    temporary table from `listTable()` rather than passed to SQLite as bound parameters.
+    
+    The timegraph, domains and word clouds do not use the filter clauses directly. Each filter
+    is worked out once into a `Bitmap` of the entries it matches by `FilterQuery.bitmap()`, and
+    the bitmaps are combined (see `Case.filterBitmap()` in :doc:`models`). 
+    
 """
 
 from __future__ import with_statement
 
 # python imports
 import re
-from os import path
 # library imports
-from sqlalchemy import and_, not_
+from sqlalchemy import and_, not_, select
 # local imports
-from webscavator.utils.utils import session, ROOT_DIR
+from webscavator.utils.utils import session, regexp, readList, listModified, listTable
+from webscavator.utils.cache import LRUCache
+from webscavator.utils.bitmap import Bitmap
 from webscavator.model.models import *
 
-def regexp(expr, item):
+SPECIAL = frozenset('.^$*+?{}[]\\|()')
+
+def literal_prefix(expr):
     """
-        Enables regular expressions for filter queries.
+        If the regular expression `expr` matches exactly the values that start with some text, 
+        returns the text. Otherwise returns `None`. `regexp()` matches from the start of a value,
+        so a `^` at the start makes no difference, and nor does `.*` at the end.
     """
-    r = re.compile(expr)
-    return r.match(item) is not None            
+    if expr.startswith('^'):
+        expr = expr[1:]
+    if expr.endswith('.*'):
+        expr = expr[:-2]
+    
+    text = []
+    i = 0
+    while i < len(expr):
+        c = expr[i]
+        if c == '\\':
+            if i + 1 == len(expr) or expr[i + 1].isalnum(): # e.g. \d is not a literal
+                return None
+            text.append(expr[i + 1])
+            i = i + 2
+        elif c in SPECIAL:
+            return None
+        else:
+            text.append(c)
+            i = i + 1
+    if not text:
+        return None
+    return ''.join(text)
+
+def glob_escape(text):
+    """
+        Escapes the characters that mean something in a `GLOB` pattern.
+    """
+    return re.sub(r'([*?\[])', r'[\1]', text)
 
 class FilterQuery(object):
     """
@@ -40,8 +84,15 @@ class FilterQuery(object):
         `FilterQuery` objects get stored inside a `Filter` object in :doc:`models`. The
         object stored inside the `Filter` object gets pickled thereby preserving the
         filter information. 
+        
+        The clauses made by `query()` are kept in `clauses`, so a filter's clause is only made
+        once rather than on every request that uses the filter. Likewise the bitmaps made by
+        `bitmap()` are kept in `bitmaps`.
     """
     
+    clauses = LRUCache(1000)   # filter key, see _key() -> clause
+    bitmaps = LRUCache(50)     # (database, case date, data version, bitmap key) -> bitmap
+    
     classes = {'Browser': Browser,
                'URL Parts': URL,
                'Entry': Entry,
@@ -68,9 +119,69 @@ class FilterQuery(object):
             clause. Returns an ANDed list of filters e.g. `Entry.title = "test" AND
             Entry.url <> "http://example.org"`
         """
-        conn = session.bind.connect()
-        conn.connection.create_function("regexp", 2, regexp)
+        key = self._key()
+        try:
+            clause = self.clauses.get(key, False)
+        except TypeError: # a value that can't be a dictionary key, so don't remember the clause
+            return self._makeClause()
+        if clause is False:
+            clause = self._makeClause()
+            self.clauses.set(key, clause)
+        return clause
+    
+    def _key(self):
+        """
+            Returns what the filter's clause depends on: the filter lines, and the time the
+            lists used by the filter were last changed. If the filter is changed, so is its key.
+        """
+        mtimes = []
+        for cls, attr, func, val, val_list in self.params:
+            if func in ("Is in list", "Is not in list"):
+                mtimes.append(listModified(val_list if val_list is not None else val))
+        return tuple(self.params), tuple(mtimes)
+    
+    def bitmapKey(self):
+        """
+            Returns `_key()` as a string, which is used to store the filter's bitmap in 
+            `FilterBitmap` in :doc:`models`.
+        """
+        return unicode(repr(self._key()))
+    
+    def bitmap(self):
+        """
+            Returns a `Bitmap` (see :doc:`bitmap`) of the ids of the entries the filter matches.
+            The bitmap stored in `FilterBitmap` in :doc:`models` is used if it is for the 
+            current data, otherwise the entries are found using `query()`. 
+        """
+        key = self.bitmapKey()
+        case = session.query(Case.date, Case.data_version).first()
+        date, version = case if case is not None else (None, 0)
+        version = version or 0
         
+        cache_key = (str(session.bind.url), date, version, key)
+        bitmap = self.bitmaps.get(cache_key)
+        if bitmap is None:
+            bitmap = FilterBitmap.load(key, version)
+            if bitmap is None:
+                bitmap = self._makeBitmap()
+            self.bitmaps.set(cache_key, bitmap)
+        return bitmap
+    
+    def _makeBitmap(self):
+        """
+            Makes the bitmap returned by `bitmap()`.
+        """
+        clause = self.query()
+        if clause is None:
+            return Bitmap()
+        q = session.query(Entry.id).join('browser').join('parsedurl').join('group')\
+                   .outerjoin(Entry.search_terms).filter(clause).order_by(Entry.id)
+        return Bitmap.fromIds([row[0] for row in session.execute(q.statement)])
+    
+    def _makeClause(self):
+        """
+            Makes the clause returned by `query()`.
+        """
         ands = []
               
         for cls, attr, func, val, val_list in self.params:            
@@ -103,7 +214,10 @@ class FilterQuery(object):
         elif op == "Is not":
             return col != val
         elif op == "Matches regular expression":
-            return col.op('REGEXP')(val)
+            prefix = literal_prefix(val)
+            if prefix is None:
+                return col.op('REGEXP')(val)
+            return col.op('GLOB')(glob_escape(prefix) + '*')
         elif op == "Contains fuzzy":
             return None
         elif op == "Contains":
@@ -121,9 +235,11 @@ class FilterQuery(object):
         
     def _getList(self, name):
         """
-            Given a file called `name`, return a list of the lines in the file. 
-            Used when the filter is value IN [list]
+            Given a list called `name`, return what to check values are IN: the lines of the
+            list, or a select of its temporary table if it has one.
         """
-        with open(path.join(ROOT_DIR, '..','case lists',name),'r') as file:
-            return [unicode(line.strip(), 'utf-8') for line in file.readlines()]
+        table = listTable(name)
+        if table is None:
+            return readList(name)
+        return select([table.c.value])
        
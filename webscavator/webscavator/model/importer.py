@@ -0,0 +1,379 @@
+"""
+    Importer
+    --------
+
+    `EntryImporter` adds the normalised rows produced by the generators in :doc:`converters`
+    to the database. Rather than inserting one row at a time, rows are buffered into chunks
+    and each chunk is written with a single `executemany` per table, bypassing the ORM.
+
+    Search terms are found while the rows are being normalised. An in-memory map of
+    `(term, engine)` to search term id is kept for the whole import, so the `search_terms`
+    and `entry_terms` rows can also be written in bulk at the end of each chunk.
+
+    The size of a chunk is set by `chunk_size` in the `[import]` section of the config file.
+
+    `ImportJob` runs the import of the files uploaded in the add/edit data wizard as a 
+    background job (see :doc:`jobs`), so the upload request does not have to wait for the
+    files to be added.
+"""
+
+# python imports
+from datetime import datetime, time
+import os
+import threading
+# library imports
+from sqlalchemy import func, bindparam
+# local imports
+from webscavator.utils.utils import session, config, begin_bulk_load, end_bulk_load
+from webscavator.utils.jobs import Job
+from webscavator.model.models import Entry, URL, Browser, Group, Case, SearchTerms, entry_terms, \
+                                     DomainRollup, plot_date, plot_hour
+from webscavator.converters import convert_file
+
+
+class EntryImporter(object):
+    """
+        Adds the rows of one uploaded file to a group. Entry ids are assigned up front from the
+        current highest id, so the URL rows of a chunk can be written straight after the entry
+        rows without asking the database for each inserted id.
+
+        `group`
+            the group object the entries belong to
+
+        `chunk_size`
+            number of rows buffered before they are written to the database. Defaults to
+            the config file value.
+
+        `inserted`
+            number of entries written so far
+    """
+
+    def __init__(self, group, chunk_size=None):
+        self.group = group
+        if chunk_size is None:
+            chunk_size = config.getint('import', 'chunk_size')
+        self.chunk_size = chunk_size
+        self.inserted = 0
+
+        self.browser_ids = {}
+        self.plot_dates = {}    # access date -> Entry.plot_date
+        self.entries = []
+        self.urls = []
+        self.next_id = None
+
+        self.term_ids = {}      # (term, engine) -> search term id
+        self.occurrences = {}   # search term id -> occurrence
+        self.new_terms = {}     # search term id -> search term row not yet written
+        self.changed_terms = set()
+        self.links = []
+        self.next_term_id = None
+
+        terms = SearchTerms.__table__
+        self.entry_ins = Entry.__table__.insert()
+        self.url_ins = URL.__table__.insert()
+        self.term_ins = terms.insert()
+        self.term_upd = terms.update().where(terms.c.id == bindparam('term_id'))\
+                        .values(occurrence=bindparam('occurrence'))
+        self.link_ins = entry_terms.insert()
+
+    def run(self, rows):
+        """
+            Given a generator of normalised rows from `convert_file()` in :doc:`converters`,
+            adds them all to the database. Any exception yielded by the converter is raised.
+            Returns the number of entries added. The case's data version is changed with 
+            `Case.dataChanged()` in :doc:`models`.
+        """
+        session.flush() # make sure the group has an id
+        self.next_id = (session.query(func.max(Entry.id)).scalar() or 0) + 1
+
+        self.next_term_id = 1
+        for id, term, engine, occurrence in session.query(SearchTerms.id, SearchTerms.term,
+                                                          SearchTerms.engine, 
+                                                          SearchTerms.occurrence):
+            self.term_ids[(term, engine)] = id
+            self.occurrences[id] = occurrence
+            self.next_term_id = max(self.next_term_id, id + 1)
+
+        for d in rows:
+            if isinstance(d, Exception):
+                raise d
+            self.add(d)
+        self.flush()
+        Case.dataChanged()
+
+        return self.inserted
+
+    def add(self, d):
+        """
+            Normalise one row into an entry and a URL row and buffer them. The entry's plot
+            columns (see `plot_date()` in :doc:`models`), weekday and minute of the day are 
+            worked out here. The buffer is
+            written to the database when it reaches `chunk_size` rows. Rows without an access
+            time are not added.
+        """
+        v = d.pop('access_time')
+        if v is None:
+            return # don't add data without an access time
+        d['access_date'] = date = datetime(v.year, v.month, v.day, 0, 0, 0, 0)
+        d['access_time'] = t = time(v.hour, v.minute, v.second, v.microsecond)
+        d['plot_date'] = self.plot_dates.get(date)
+        if d['plot_date'] is None:
+            d['plot_date'] = self.plot_dates[date] = plot_date(date)
+        d['plot_hour'] = plot_hour(t)
+        d['access_weekday'] = date.weekday()
+        d['access_minute'] = v.hour * 60 + v.minute
+
+        v = d.pop('modified_time')
+        if v is not None:
+            d['modified_date'] = datetime(v.year, v.month, v.day, 0, 0, 0, 0)
+            d['modified_time'] = time(v.hour, v.minute, v.second, v.microsecond)
+        else:
+            d['modified_date'] = None
+            d['modified_time'] = None
+
+        key = (d.pop('browser_name'), d.pop('browser_version'), d.pop('source_file'))
+        d['browser_id'] = self._getBrowser(key)
+        d['group_id'] = self.group.id
+        d['id'] = entry_id = self.next_id
+        self.next_id = self.next_id + 1
+
+        url = d.pop('url_parts', None) # already split up if converted in parallel
+        if url is None:
+            url = URL.decompose(d['url'])
+        url['entry_id'] = entry_id
+        url['search'] = self._addSearchTerms(entry_id, url)
+
+        self.entries.append(d)
+        self.urls.append(url)
+
+        if len(self.entries) >= self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        """
+            Write the buffered chunk of entries and URLs to the database.
+        """
+        if not self.entries:
+            return
+
+        session.execute(self.entry_ins, self.entries)
+        session.execute(self.url_ins, self.urls)
+
+        if self.new_terms:
+            for id, row in self.new_terms.iteritems():
+                row['occurrence'] = self.occurrences[id]
+            session.execute(self.term_ins, self.new_terms.values())
+        if self.changed_terms:
+            session.execute(self.term_upd, [{'term_id': id, 'occurrence': self.occurrences[id]}
+                                            for id in self.changed_terms])
+        if self.links:
+            session.execute(self.link_ins, self.links)
+
+        self.inserted = self.inserted + len(self.entries)
+        self.entries = []
+        self.urls = []
+        self.new_terms = {}
+        self.changed_terms = set()
+        self.links = []
+
+    def _getBrowser(self, key):
+        """
+            Given a (browser name, browser version, source) tuple, return the browser id,
+            adding the browser if it is not already in the database.
+        """
+        browser_id = self.browser_ids.get(key)
+        if browser_id is None:
+            name, version, source = key
+            browser = Browser.getFilterBy(name=name, version=version, source=source).first()
+            if browser is None:
+                browser = Browser(*key)
+                session.add(browser)
+                session.flush()
+            browser_id = self.browser_ids[key] = browser.id
+        return browser_id
+
+    def _addSearchTerms(self, entry_id, url):
+        """
+            If the URL is a search engine query, link the entry to its search terms and
+            return the search string. Otherwise returns `None`. A term is only linked once
+            to the same entry.
+        """
+        search = None
+        linked = set()
+        for engine, q_string, terms in SearchTerms.getSearches(url['netloc'], url['path'],
+                                                               url['query']):
+            search = q_string
+            for term in terms:
+                key = (term, engine)
+                id = self.term_ids.get(key)
+                if id is None:
+                    id = self.term_ids[key] = self.next_term_id
+                    self.next_term_id = self.next_term_id + 1
+                    self.occurrences[id] = 0
+                    self.new_terms[id] = {'id': id, 'term': term, 'engine': engine,
+                                          'engine_long': config.get('search', engine)}
+                elif id not in self.new_terms:
+                    self.changed_terms.add(id)
+
+                if id not in linked:
+                    linked.add(id)
+                    self.occurrences[id] = self.occurrences[id] + 1
+                    self.links.append({'entry_id': entry_id, 'search_id': id})
+        return search
+
+
+class ImportJob(Job):
+    """
+        Background job that adds one or more uploaded files to their groups. The files are 
+        added in one transaction, so either all of them are added or none are. Changes to 
+        existing groups given by `edit()` and `delete()` are made in the same transaction. If
+        a file cannot be added, any groups that were created for this job are deleted again and 
+        `error_field` is set to the form index of the file that failed. 
+        
+        Only one job adds data to a database at a time. 
+    """
+    
+    locks = {}
+    
+    def __init__(self, bind):
+        Job.__init__(self)
+        self.bind = bind
+        self.files = []
+        self.total_bytes = 0
+        self.done_bytes = 0
+        self.parsed = 0
+        self.inserted = 0
+        self.error_field = None
+        self.importer = None
+        self.edits = []     # (group id, dictionary of attributes to set)
+        self.deletes = []   # ids of groups to delete
+        
+    def add(self, field, group, program, filename, new_group):
+        """
+            Add a file to the job. `field` is the index of the file in the form, `filename` the
+            location of the uploaded file on disk and `new_group` whether the group was created 
+            for this upload, and so should be deleted if the file cannot be added. The file is 
+            deleted once the job has finished.
+        """
+        self.files.append((field, group.id, program, filename, new_group))
+        self.total_bytes = self.total_bytes + os.path.getsize(filename)
+    
+    def edit(self, group, values):
+        """
+            Set the attributes of an existing group to `values`, a dictionary of attribute 
+            names and values, when the files are added.
+        """
+        self.edits.append((group.id, values))
+    
+    def delete(self, group):
+        """
+            Delete an existing group when the files are added.
+        """
+        self.deletes.append(group.id)
+    
+    def run(self):
+        """
+            Make the changes to the existing groups and add each of the files in turn, then 
+            work out the Domains tab counts again with `DomainRollup.fill()` in :doc:`models`
+            for the new `Case.data_version` and commit. If anything goes wrong, the session is 
+            rolled back, so the existing groups are left as they were, and the new groups are 
+            deleted. 
+            
+            The database is switched to its bulk load settings while the files are added, see 
+            `begin_bulk_load()` in :doc:`utils`. The indexes are only dropped and rebuilt if 
+            there is at least `defer_indexes` bytes of data (from the `[import]` section of 
+            the config file), as rebuilding them is slower than keeping them up to date when 
+            only a little data is added to a large case.
+        """
+        lock = self.locks.setdefault(str(self.bind.url), threading.Lock())
+        lock.acquire()
+        try:
+            session(bind=self.bind)
+            defer_indexes = self.total_bytes >= config.getint('import', 'defer_indexes')
+            settings = None
+            try:
+                try:
+                    settings = begin_bulk_load(session, defer_indexes)
+                    self._editGroups()
+                    for field, group_id, program, filename, new_group in self.files:
+                        self.error_field = field
+                        self._addFile(Group.get(group_id), program, filename)
+                    self.error_field = None
+                    DomainRollup.fill()
+                    session.commit()
+                except:
+                    session.rollback()
+                    for field, group_id, program, filename, new_group in self.files:
+                        if new_group:
+                            session.delete(Group.get(group_id))
+                    session.commit()
+                    raise
+            finally:
+                if settings is not None:
+                    end_bulk_load(session, settings)
+        finally:
+            lock.release()
+            for field, group_id, program, filename, new_group in self.files:
+                os.remove(filename)
+            
+    def _editGroups(self):
+        """
+            Make the changes given by `edit()` and `delete()`. The case's data version is 
+            changed with `Case.dataChanged()` in :doc:`models`, as filters can use the group
+            names and programs.
+        """
+        for group_id, values in self.edits:
+            group = Group.get(group_id)
+            for name, value in values.iteritems():
+                setattr(group, name, value)
+        for group_id in self.deletes:
+            session.delete(Group.get(group_id))
+        if self.edits or self.deletes:
+            session.flush()
+            Case.dataChanged()
+    
+    def _addFile(self, group, program, filename):
+        file = open(filename, 'rb')
+        try:
+            self.importer = EntryImporter(group)
+            rows = convert_file(program, file)
+            self.importer.run(self._progress(rows, file))
+            self.inserted = self.inserted + self.importer.inserted
+            self.importer = None
+            self.done_bytes = self.done_bytes + os.path.getsize(filename)
+        finally:
+            file.close()
+    
+    def _progress(self, rows, file):
+        """
+            Count the rows as they are converted. The position in the file is looked at every 
+            so often to work out how much of the job is left.
+        """
+        start = self.done_bytes
+        for i, d in enumerate(rows):
+            if i % 1000 == 0:
+                self.done_bytes = start + file.tell()
+            self.parsed = self.parsed + 1
+            yield d
+        self.done_bytes = start
+    
+    def status(self):
+        """
+            Adds the rows parsed, rows inserted, rows inserted per second and the estimated
+            number of seconds left to the job's status.
+        """
+        d = Job.status(self)
+        importer = self.importer
+        inserted = self.inserted + (importer.inserted if importer is not None else 0)
+        elapsed = self.elapsed
+        
+        d['parsed'] = self.parsed
+        d['inserted'] = inserted
+        d['rate'] = inserted / elapsed if elapsed > 0 else 0.0
+        if self.state in ('done', 'failed'):
+            d['eta'] = 0.0
+        elif self.done_bytes > 0 and elapsed > 0:
+            d['eta'] = (self.total_bytes - self.done_bytes) * elapsed / self.done_bytes
+        else:
+            d['eta'] = None
+        return d
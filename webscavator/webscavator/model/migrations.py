@@ -0,0 +1,158 @@
+"""
+    Migrations
+    ----------
+
+    Cases made by older versions of Webscavator are brought up to date when they are created
+    or loaded by `migrate()`, which is called from `init_database()` in :doc:`utils`.
+    The version of a case database is kept in SQLite's `user_version` pragma.
+
+    Each function in `migrations` updates a database from the version before it,
+    so `migrations[0]` updates a database from version 0 to version 1. Migrations are also
+    run on new databases (which already have the new tables and columns), so they must
+    check what is already there. To change the database, add a function to the end of
+    `migrations`. Any missing indexes are created once the migrations have run.
+
+    Functions
+    ---------
+"""
+
+# library imports
+from sqlalchemy import select, bindparam
+# local imports
+from webscavator.utils.utils import create_indexes
+from webscavator.model.models import Entry, plot_date, plot_hour
+
+CHUNK = 10000
+
+
+def migrate(db):
+    """
+        Runs all the migrations the database `db` has not had yet. Returns the version the
+        database was and the version it is now.
+    """
+    connection = db.connect()
+    try:
+        version = connection.execute('PRAGMA user_version').scalar()
+        for i in xrange(version, len(migrations)):
+            migrations[i](connection)
+            connection.execute('PRAGMA user_version = %d' % (i + 1))
+        if version < len(migrations):
+            create_indexes(connection)
+    finally:
+        connection.close()
+    return version, len(migrations)
+
+def get_columns(connection, table):
+    """
+        Returns the names of the columns of `table`.
+    """
+    return [row[1] for row in connection.execute('PRAGMA table_info("%s")' % table)]
+
+def add_columns(connection, table, columns):
+    """
+        Adds any of the (name, SQL type) `columns` which are not in `table`.
+    """
+    existing = get_columns(connection, table)
+    for name, type in columns:
+        if name not in existing:
+            connection.execute('ALTER TABLE "%s" ADD COLUMN %s %s' % (table, name, type))
+
+def fill_columns(connection, values):
+    """
+        Goes through the entries already in the case in chunks, calling `values` with the 
+        access date and time of each entry that has them. `values` returns a dictionary of 
+        the columns to set for the entry.
+    """
+    entry = Entry.__table__
+    last = 0
+    update = None
+    while True:
+        rows = connection.execute(select([entry.c.id, entry.c.access_date, entry.c.access_time])\
+                                  .where(entry.c.id > last).order_by(entry.c.id).limit(CHUNK))\
+                                  .fetchall()
+        if not rows:
+            break
+
+        params = []
+        for id, d, t in rows:
+            if d is not None and t is not None:
+                v = values(d, t)
+                if update is None:
+                    update = entry.update().where(entry.c.id == bindparam('entry_id'))\
+                                  .values(**dict([(k, bindparam('new_' + k)) for k in v]))
+                v = dict([('new_' + k, value) for k, value in v.iteritems()])
+                v['entry_id'] = id
+                params.append(v)
+
+        transaction = connection.begin()
+        if params:
+            connection.execute(update, params)
+        transaction.commit()
+        last = rows[-1][0]
+
+# Migrations
+# ==========
+
+def add_plot_columns(connection):
+    """
+        Version 1: adds `Entry.plot_date` and `Entry.plot_hour` and fills them in for
+        the entries already in the case.
+    """
+    add_columns(connection, 'entry', [('plot_date', 'FLOAT'), ('plot_hour', 'FLOAT')])
+
+    dates = {}
+    def values(d, t):
+        if d not in dates:
+            dates[d] = plot_date(d)
+        return {'plot_date': dates[d], 'plot_hour': plot_hour(t)}
+    fill_columns(connection, values)
+
+def add_weekday_columns(connection):
+    """
+        Version 2: adds `Entry.access_weekday` and `Entry.access_minute`, used by the heatmap, 
+        and fills them in for the entries already in the case.
+    """
+    add_columns(connection, 'entry', [('access_weekday', 'INTEGER'), ('access_minute', 'INTEGER')])
+
+    def values(d, t):
+        return {'access_weekday': d.weekday(), 'access_minute': t.hour * 60 + t.minute}
+    fill_columns(connection, values)
+
+def add_file_index(connection):
+    """
+        Version 3: indexes `URL.scheme` and `URL.path`, used to count the files accessed.
+    """
+    create_indexes(connection, ['ix_url_file'])
+
+def add_data_version(connection):
+    """
+        Version 4: adds `Case.data_version`. The `summary` table is new, so it is made by 
+        `init_database()`.
+    """
+    add_columns(connection, 'case', [('data_version', 'INTEGER DEFAULT 0')])
+
+def add_join_indexes(connection):
+    """
+        Version 5: indexes the columns tables are joined on, `Entry.browser_id`, 
+        `Entry.group_id` and `entry_terms.search_id`, and the columns the Domains tab and the
+        search term filters look up, `URL.domain` with `URL.netloc` and `SearchTerms.term` with
+        `SearchTerms.engine`. The tables made for the new `DomainRollup` and `FilterValue` are
+        made by `init_database()`.
+    """
+    create_indexes(connection, ['ix_entry_browser', 'ix_entry_group', 'ix_entry_terms_search',
+                                'ix_url_domain', 'ix_search_terms_term'])
+
+def utc_plot_dates(connection):
+    """
+        Version 6: fills in `Entry.plot_date` again as midnight UTC, as it used to depend on 
+        the timezone of the machine which added the entries.
+    """
+    dates = {}
+    def values(d, t):
+        if d not in dates:
+            dates[d] = plot_date(d)
+        return {'plot_date': dates[d]}
+    fill_columns(connection, values)
+
+migrations = [add_plot_columns, add_weekday_columns, add_file_index, add_data_version,
+              add_join_indexes, utc_plot_dates]
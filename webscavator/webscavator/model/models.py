@@ -15,35 +15,56 @@ from datetime import datetime, timedelta, time as t
 import time, calendar
 from os import path
 import urllib
+from weakref import WeakKeyDictionary
 # library imports
 from sqlalchemy import Table, Column, Integer, Boolean, Float, Unicode, MetaData, Time 
-from sqlalchemy import ForeignKey, DateTime, CheckConstraint, asc, desc, func, PickleType
-from sqlalchemy.sql import or_, not_, and_
+from sqlalchemy import ForeignKey, DateTime, CheckConstraint, asc, desc, func, PickleType, Index, \
+                       Binary
+from sqlalchemy.sql import or_, not_, and_, case, cast
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import backref, relation, contains_eager, aliased
+from sqlalchemy.orm import backref, relation
 # local imports
-from webscavator.utils.utils import connect, bind, init_database, session, ROOT_DIR, CASE_FILE_DIR, FILE_TYPES
+from webscavator.utils.utils import connect, bind, init_database, session, config, ROOT_DIR, CASE_FILE_DIR, \
+                                    FILE_TYPES
+from webscavator.utils.cache import LRUCache
+from webscavator.utils.bitmap import Bitmap, register
 from webscavator.converters import get_name, get_program_info
 
 
 
 Base = declarative_base()
 
-__all__ = ['Browser', 'Case', 'Group', 'Entry', 'URL', 'Filter', 'SearchTerms', 'get_plotable', 'getFilter']
+__all__ = ['Browser', 'Case', 'Group', 'Entry', 'URL', 'Filter', 'SearchTerms', 'Summary', 'FilterBitmap',
+           'FilterValue', 'DomainRollup', 'get_plotable', 'getFilter', 'filterClause', 'plot_date', 'plot_hour',
+           'flot_date']
+
+TOPLEVEL = frozenset(['aero', 'arpa', 'asia', 'biz', 'cat', 'com', 'coop', 'edu', 'gov', 'info', 'int', 
+                     'jobs', 'mil', 'mobi', 'museum', 'name', 'net', 'org', 'pro', 'tel', 'travel'])
 
 entry_terms = Table('entry_terms', Base.metadata,
                       Column('entry_id', Integer, ForeignKey('entry.id'), primary_key = True),
                       Column('search_id', Integer, ForeignKey('search_terms.id'), primary_key = True)
                       )
+Index('ix_entry_terms_search', entry_terms.c.search_id, entry_terms.c.entry_id)
 
 # Useful functions
 # ===================
-def get_plotable(d, t, u, bn, bv, bs, p, ti):
+def plot_date(d):
     """
-        Returns (date, time, URL, browser name, browser version, browser source, program name, title)
-        in a format Flot (the JavaScript timeline library) will understand. 
-        Only (date, time) needs to be sent in order
-        for the graph to be displayed properly. The others are used for hover over and clickable text.
+        Returns the date `d` at midnight in milliseconds since Unix Epoch, taking `d` to be in 
+        UTC so the value does not depend on the timezone of the server. This is stored for 
+        each entry in `Entry.plot_date` when the entry is added, and is turned into the date 
+        Flot (the JavaScript timeline library) shows by `flot_date()`.
+    """
+    return calendar.timegm(d.timetuple()) * 1000
+
+_flot_dates = {} # Entry.plot_date -> date for Flot, remembered by flot_date()
+
+def flot_date(date):
+    """
+        Returns an `Entry.plot_date` as midnight of the same date in the server's timezone in 
+        milliseconds since Unix Epoch, the format Flot uses for dates. There are only as many 
+        of these as days in the case, so each is only worked out once.
         
         .. note:: 
             Currently this function uses a hack to get British Summer Time dates to be displayed
@@ -51,36 +72,64 @@ def get_plotable(d, t, u, bn, bv, bs, p, ti):
             
             **ToDo**: Fix this urgently!!
     """
-    
-    # Hack to get British Summer Time to convert to GMT for flot to display this properly
-    if d >= datetime(2010, 3, 28):
-        d = d + timedelta(hours=1)
-    
-    # date at midnight in milliseconds since Unix Epoch
-    d = time.mktime(d.timetuple()) * 1000
-    # time in a faction e.g. 5:30pm --> 17.5
-    t = float(t.hour) + t.minute/60.0 + t.second/3600.00
-    return (d, t, u, bn, bv, bs, get_name(p), ti if ti else '--')
+    f = _flot_dates.get(date)
+    if f is None:
+        d = datetime(1970, 1, 1) + timedelta(milliseconds=date)
+        
+        # Hack to get British Summer Time to convert to GMT for flot to display this properly
+        if d >= datetime(2010, 3, 28):
+            d = d + timedelta(hours=1)
+        
+        f = _flot_dates[date] = time.mktime(d.timetuple()) * 1000
+    return f
 
-def getFilter(highlight_funcs=[], remove_funcs=[]):
+def plot_hour(t):
     """
-        Get the right filter. This is used to filter domain names and search terms correctly.
-        `Case.filter_queries` is called, and if `highlight_funcs` != [] then return
-        the highlighted query, otherwise return the non-highlighted query. 
+        Returns the time `t` as a fraction of hours e.g. 5:30pm --> 17.5. This is stored for 
+        each entry in `Entry.plot_hour` when the entry is added.
     """
-    filter_q = session.query(Entry.id)\
-                .join(Entry.parsedurl, Entry.browser, Entry.group)\
-                .outerjoin(Entry.search_terms)                    
+    return float(t.hour) + t.minute/60.0 + t.second/3600.00
 
-    q_removed, q_highlighted, q_not_highlighted = \
-        Case.filter_queries(filter_q, remove_funcs, highlight_funcs)        
+def get_plotable(d, t, u, bn, bv, bs, p, ti):
+    """
+        Returns (date, time, URL, browser name, browser version, browser source, program name, title)
+        in a format Flot (the JavaScript timeline library) will understand. 
+        Only (date, time) needs to be sent in order
+        for the graph to be displayed properly. The others are used for hover over and clickable text.
         
+        `d` and `t` are the stored `Entry.plot_date` and `Entry.plot_hour`, see `plot_date()` 
+        and `plot_hour()`, and `d` is turned into Flot's format by `flot_date()`.
+    """
+    return (flot_date(d), t, u, bn, bv, bs, get_name(p), ti if ti else '--')
+
+def getFilter(highlight_funcs=[], remove_funcs=[]):
+    """
+        Get the right filter. If `highlight_funcs` != [] then return a subquery of the 
+        highlighted entries, otherwise of the non-highlighted entries, see `filterClause()`.
+    """
+    filter_q = session.query(Entry.id)
+    clause = filterClause(Entry.id, highlight_funcs, remove_funcs)
+    if clause is not None:
+        filter_q = filter_q.filter(clause)
+    return filter_q.subquery()
+
+def filterClause(id_col, highlight_funcs=[], remove_funcs=[]):
+    """
+        Returns a clause on the entry id column `id_col` which is true for the highlighted 
+        entries if `highlight_funcs` != [], otherwise for the entries that are not removed. 
+        Returns `None` if there are no filters. This is used to filter domain names and search
+        terms correctly. The filters' bitmaps are combined first (see `Case.filterBitmap()`), so 
+        only one bitmap is checked for each row.
+    """
+    removed = Case.filterBitmap(remove_funcs)
     if highlight_funcs:
-        filter_q = q_highlighted 
-    else:
-        filter_q = q_not_highlighted
-        
-    return filter_q.group_by(Entry.id).subquery()
+        highlighted = Case.filterBitmap(highlight_funcs)
+        if removed is not None:
+            highlighted = highlighted - removed
+        return Case.inBitmap(highlighted, id_col)
+    if removed is not None:
+        return not_(Case.inBitmap(removed, id_col))
+    return None
 
 
 # Model Classes
@@ -196,6 +245,10 @@ class Case(Base, Model):
         `date`
             date this case was created
         
+        `data_version`
+            counts the number of times data has been added to or removed from the case, 
+            see `Summary`
+        
         `groups`
             A list of group objects that belong to this case
     """
@@ -204,6 +257,7 @@ class Case(Base, Model):
     id = Column(Integer, primary_key = True)
     name = Column(Unicode)
     date = Column(DateTime)
+    data_version = Column(Integer, default=0)
     
     def __init__(self, name):
         self.name = name
@@ -225,10 +279,14 @@ class Case(Base, Model):
     @staticmethod  
     def load_database(dbfile):
         """
-            Given a database file, connects to the database and binds it to webscavator's session.
+            Given a database file, connects to the database, updates it with `init_database()` 
+            in :doc:`utils` and binds it to webscavator's session. Returns the version the 
+            case was and the version it is now, see :doc:`migrations`.
         """
         db = connect(path.join(CASE_FILE_DIR, dbfile))
-        bind(db)        
+        versions = init_database(db) # bring cases made by older versions up to date
+        bind(db)
+        return versions
         
     @staticmethod
     def get_case():
@@ -237,6 +295,22 @@ class Case(Base, Model):
         """
         return session.query(Case).first()
     
+    @staticmethod
+    def getDataVersion():
+        """
+            Returns the current case's `data_version`.
+        """
+        return session.query(Case.data_version).scalar() or 0
+    
+    @staticmethod
+    def dataChanged():
+        """
+            Adds one to the case's `data_version`, so the statistics in `Summary` are worked out
+            again. Called in the same transaction as the change to the data.
+        """
+        table = Case.__table__
+        session.execute(table.update().values(data_version=func.coalesce(table.c.data_version, 0) + 1))
+    
     def dblocation(self, dbfile):
         """
             Return the absolute location of a given database file.
@@ -294,55 +368,149 @@ class Case(Base, Model):
     @staticmethod
     def filter_queries(q, remove_funcs, highlight_funcs):
         """
-            This expects `q` to have entry, browser, url, group and search_terms available 
-            for filtering. Returns three queries with the correct entries put in each according
-            to the filters:
+            This expects `q` to have entry available for filtering. Returns three queries with 
+            the correct entries put in each according to the filters:
             `q_removed`, `q_highlighted` and `q_not_highlighted`.
         """
         # do the filtering query
         # ---------------------        
-        filtered_ors = []
-        for f in remove_funcs:
-            ands = f.query()
-            filtered_ors.append(ands)
+        removed = Case.filterBitmap(remove_funcs)
 
         q_filtered = q        
-        if filtered_ors:
-            q_removed = q_filtered.filter((or_(*filtered_ors)))
-            q_filtered = q_filtered.filter(not_(or_(*filtered_ors)))
+        if removed is not None:
+            q_removed = q_filtered.filter(Case.inBitmap(removed))
+            q_filtered = q_filtered.filter(not_(Case.inBitmap(removed)))
         else:
             q_removed = q_filtered.filter('0')
 
-        highlighted_ors = []
-        for f in highlight_funcs:
-            ands = f.query()
-            highlighted_ors.append(ands)
+        highlighted = Case.filterBitmap(highlight_funcs)
             
         q_highlighted = q_filtered
-        if highlighted_ors:
-            q_highlighted = q_highlighted.filter(or_(*highlighted_ors))
+        if highlighted is not None:
+            q_highlighted = q_highlighted.filter(Case.inBitmap(highlighted))
         else:
             q_highlighted = q_highlighted.filter('0')
 
         q_not_highlighted = q_filtered
-        if highlighted_ors:
-            q_not_highlighted.filter(not_(and_(*highlighted_ors)))       
+        if highlighted is not None:
+            q_not_highlighted = q_not_highlighted.filter(not_(Case.inBitmap(highlighted)))       
         
         return q_removed, q_highlighted, q_not_highlighted
+    
+    @staticmethod
+    def filterBitmap(funcs):
+        """
+            Returns a `Bitmap` (see :doc:`bitmap`) of the entries matched by any of the filters
+            in `funcs`, or `None` if there are no filters. Each filter's bitmap comes from
+            `FilterQuery.bitmap()` in :doc:`filters`, so only the bitmaps are combined here.
+        """
+        bitmap = None
+        for f in funcs:
+            if bitmap is None:
+                bitmap = f.bitmap()
+            else:
+                bitmap = bitmap | f.bitmap()
+        return bitmap
+    
+    @staticmethod
+    def inBitmap(bitmap, id_col=None):
+        """
+            Returns a column which is true for the entries in `bitmap`. `id_col` is the entry
+            id column to check and defaults to `Entry.id`. The column keeps the bitmap, so 
+            it stays registered (see `register()` in :doc:`bitmap`) while a query uses it.
+        """
+        if id_col is None:
+            id_col = Entry.id
+        column = func.in_bitmap(register(bitmap), id_col)
+        column.bitmap = bitmap
+        return column
         
+    REMOVED, HIGHLIGHTED, NOT_HIGHLIGHTED = 2, 1, 0
+    
+    @staticmethod
+    def classify(remove_funcs, highlight_funcs):
+        """
+            Returns a column which is `Case.REMOVED` for entries removed by the filters, 
+            `Case.HIGHLIGHTED` for entries that are highlighted and not removed, and 
+            `Case.NOT_HIGHLIGHTED` for the rest. This puts the entries into the same groups as 
+            `filter_queries()` but in one query. Returns `None` if there are no filters, 
+            when everything is not highlighted.
+        """
+        whens = []
+        if remove_funcs:
+            whens.append((Case.inBitmap(Case.filterBitmap(remove_funcs)), Case.REMOVED))
+        if highlight_funcs:
+            whens.append((Case.inBitmap(Case.filterBitmap(highlight_funcs)), Case.HIGHLIGHTED))
+        
+        if whens:
+            return case(whens, else_=Case.NOT_HIGHLIGHTED)
+        return None
+    
     @staticmethod
     def getTimeGraph(startdate, enddate, starttime, endtime, remove_funcs, highlight_funcs,
                remove_duplicates=False, duplicate_time=0):
         """
             Given a start and end date and time and filters, returns three lists of entry points:
-            `highlighted`, `not_highlighted` and `removed` by calling `filter_queries()`
-            Each entry will be in one of those lists for Flot to draw.  
+            `highlighted`, `not_highlighted` and `removed`. 
+            Each entry will be in one of those lists for Flot to draw. The entries are fetched 
+            in one query ordered by time, with a column from `classify()` saying which list
+            each entry goes in.
+            
+            If `remove_duplicates` is `True`, only entries at least `duplicate_time` minutes
+            after the previous entry in the same list are kept. This is worked out by 
+            `_removeDuplicates()` from just the ids and times of the entries, and only the 
+            entries kept are fetched in full.
         """
         
-        # make the queries
-        # ----------------
-        q = session.query(Entry.access_date, Entry.access_time, Entry.url, Browser.name,
-                          Browser.version, Browser.source, Group.program, Entry.title)
+        # make the query
+        # --------------
+        cols = [Entry.plot_date, Entry.plot_hour, Entry.url, Browser.name,
+                Browser.version, Browser.source, Group.program, Entry.title]
+        classification = Case.classify(remove_funcs, highlight_funcs)
+        
+        if remove_duplicates == True:
+            kept = Case._removeDuplicates(startdate, enddate, classification, duplicate_time)
+            q = session.query(Entry.id, *cols).join('browser').join('parsedurl').join('group')
+            
+            plots = {}
+            ids = [id for id, kind in kept]
+            for i in xrange(0, len(ids), Case.CHUNK):
+                for row in q.filter(Entry.id.in_(ids[i:i + Case.CHUNK])):
+                    plots[row[0]] = get_plotable(*row[1:])
+            
+            series = {Case.REMOVED: [], Case.HIGHLIGHTED: [], Case.NOT_HIGHLIGHTED: []}
+            for id, kind in kept:
+                if id in plots:     # entries without a browser, URL or group are not plotted
+                    series[kind].append(plots[id])
+            return series[Case.HIGHLIGHTED], series[Case.NOT_HIGHLIGHTED], series[Case.REMOVED]
+        
+        if classification is not None:
+            cols.append(classification)
+        q = Case._timeGraphQuery(cols, startdate, enddate)
+        
+        # put the results in the format Flot wants it
+        # -------------------------------------------
+        series = {Case.REMOVED: [], Case.HIGHLIGHTED: [], Case.NOT_HIGHLIGHTED: []}
+        not_highlighted = series[Case.NOT_HIGHLIGHTED]
+        
+        for cols in q:
+            if classification is not None:
+                series[cols[8]].append(get_plotable(*cols[:8]))
+            else:
+                not_highlighted.append(get_plotable(*cols))
+                
+        return series[Case.HIGHLIGHTED], series[Case.NOT_HIGHLIGHTED], series[Case.REMOVED]
+    
+    CHUNK = 500
+    
+    @staticmethod
+    def _timeGraphQuery(cols, startdate, enddate):
+        """
+            Returns a query for `cols` of the entries between the start and end dates, joined 
+            onto all the other tables and ordered by time. An entry with more than one search 
+            term is in the query once for each term.
+        """
+        q = session.query(*cols)
         
         # join onto all the other tables
         q = q.join('browser').join('parsedurl').join('group').outerjoin(Entry.search_terms)
@@ -350,35 +518,112 @@ class Case(Base, Model):
         # filter by the start and end dates and times
         q = q.filter(Entry.access_date >= startdate).filter(Entry.access_date <= enddate)
         
-        q_removed, q_highlighted, q_not_highlighted = Case.filter_queries(q, remove_funcs, highlight_funcs)
-
-        removed = (q_removed.order_by(asc(Entry.access_date), asc(Entry.access_time)), [])
-        highlighted = (q_highlighted.order_by(asc(Entry.access_date), asc(Entry.access_time)), []) 
-        not_highlighted = (q_not_highlighted.order_by(asc(Entry.access_date), asc(Entry.access_time)), [])
-
-        # put the results in the format Flot wants it
+        return q.order_by(asc(Entry.access_date), asc(Entry.access_time), asc(Entry.id))
+    
+    @staticmethod
+    def _removeDuplicates(startdate, enddate, classification, duplicate_time):
+        """
+            Scans the ids, times and `classification` of the entries between the start and 
+            end dates in time order, and returns the (id, list) pairs of the entries that are 
+            the first in their list on a day or at least `duplicate_time` minutes after the 
+            last entry kept in their list. Only the entry table is read (the classification 
+            uses the entry ids), so each entry is scanned once.
+        """
+        cols = [Entry.id, Entry.plot_date, Entry.plot_hour]
+        if classification is not None:
+            cols.append(classification)
+        q = session.query(*cols)\
+                   .filter(Entry.access_date >= startdate).filter(Entry.access_date <= enddate)\
+                   .order_by(asc(Entry.access_date), asc(Entry.access_time), asc(Entry.id))
+        
+        gap = float(duplicate_time)/float(60)
+        last = {}   # list -> (date, time) of the last entry kept
+        kept = []
+        for row in q:
+            id, date, hour = row[:3]
+            kind = row[3] if classification is not None else Case.NOT_HIGHLIGHTED
+            previous = last.get(kind)
+            if previous is None or previous[0] < date or \
+               (previous[0] == date and hour - previous[1] >= gap):
+                # only add entries <duplicate_time> minutes apart
+                last[kind] = (date, hour)
+                kept.append((id, kind))
+        return kept
+    
+    BIN_HOURS = (0.25, 0.5, 1, 2, 3, 4, 6, 8, 12, 24)
+    
+    @staticmethod
+    def countTimeGraph(startdate, enddate):
+        """
+            Returns the number of entries between the start and end dates, i.e. roughly how
+            many points `getTimeGraph()` would return.
+        """
+        return session.query(func.count(Entry.id))\
+                      .filter(Entry.access_date >= startdate)\
+                      .filter(Entry.access_date <= enddate).scalar()
+    
+    @staticmethod
+    def getTimeGraphBins(startdate, enddate, remove_funcs, highlight_funcs, max_bins):
+        """
+            Like `getTimeGraph()`, but rather than returning every entry, the entries are
+            counted in cells of one or more days by a time slot of `BIN_HOURS`. The smallest
+            cells that make no more than `max_bins` cells are used, so the number of points
+            does not depend on the number of entries. 
+            
+            Returns `highlighted`, `not_highlighted` and `removed` lists of 
+            (date, time, entries, highlighted, not highlighted, removed) points, where 
+            (date, time) is the middle of the cell's first day and time slot. A cell is put in 
+            the highlighted list if any of its entries are highlighted, otherwise in the 
+            not highlighted list if any are not removed. Duplicates are not removed.
+        """
+        start = plot_date(startdate)
+        days = (enddate - startdate).days + 1
+        slot = Case.BIN_HOURS[-1]
+        for hours in Case.BIN_HOURS:
+            if days * 24 / hours <= max_bins:
+                slot = hours
+                break
+        cells_per_day = int(24 / slot)
+        days_per_cell = max(1, -(-days * cells_per_day // max_bins))
+        
+        # count the entries in each day and time slot
         # -------------------------------------------
-        for (q, entries) in [removed, highlighted, not_highlighted]:
-            seen = set()
-            for cols in q:   
-                plot = get_plotable(*cols)
-
-                if remove_duplicates == True: # remove duplicates                
-                    if plot not in seen:
-                        if len(entries) == 0:
-                            entries.append(plot)   # add first entry regardless
-                            seen.add(plot)
-                        else:
-                            if (entries[-1][0] == plot[0] and \
-                            (plot[1] - entries[-1][1]) >= float(duplicate_time)/float(60)) \
-                            or (entries[-1][0] < plot[0]): 
-                                # only add entries <duplicate_time> minutes apart
-                                entries.append(plot)
-                                seen.add(plot)
-                else: # else add everything
-                    entries.append(plot)
-                
-        return highlighted[1], not_highlighted[1], removed[1]
+        slot_col = cast(Entry.plot_hour / slot, Integer)
+        cols = [Entry.plot_date, slot_col, func.count(Entry.id)]
+        classification = Case.classify(remove_funcs, highlight_funcs)
+        if classification is not None:
+            cols.append(classification)
+        q = session.query(*cols)
+        q = q.filter(Entry.access_date >= startdate).filter(Entry.access_date <= enddate)
+        q = q.group_by(*([Entry.plot_date, slot_col] + cols[3:]))
+        
+        # add them up into cells
+        # ----------------------
+        cells = {}  # (day index, slot) -> [date, time, entries, highlighted, not highlighted, removed]
+        columns = {Case.HIGHLIGHTED: 3, Case.NOT_HIGHLIGHTED: 4, Case.REMOVED: 5}
+        for row in q:
+            date, s, amount = row[:3]
+            kind = row[3] if classification is not None else Case.NOT_HIGHLIGHTED
+            s = min(s, cells_per_day - 1)
+            key = (int(round((date - start) / 86400000.0)) // days_per_cell, s)
+            cell = cells.get(key)
+            if cell is None:
+                cell = cells[key] = [date, (s + 0.5) * slot, 0, 0, 0, 0]
+            cell[0] = min(cell[0], date)
+            cell[2] = cell[2] + amount
+            cell[columns[kind]] = cell[columns[kind]] + amount
+        
+        highlighted, not_highlighted, removed = [], [], []
+        for key in sorted(cells):
+            cell = cells[key]
+            cell[0] = flot_date(cell[0])
+            if cell[3]:
+                highlighted.append(cell)
+            elif cell[4]:
+                not_highlighted.append(cell)
+            else:
+                removed.append(cell)
+        return highlighted, not_highlighted, removed
 
 class Group(Base, Model):
     """
@@ -523,6 +768,18 @@ class Entry(Base, Model):
         `content_type`
             type of content, usually only index.dat files store this
             
+        `plot_date`
+            access date at midnight UTC in milliseconds since Unix Epoch, see `plot_date()`
+            
+        `plot_hour`
+            access time as a fraction of hours, see `plot_hour()`
+            
+        `access_weekday`
+            day of the week of the access date, 0 is Monday
+            
+        `access_minute`
+            minute of the day of the access time, 0 to 1439
+            
         `group`
             group object this entry belongs to
             
@@ -548,6 +805,10 @@ class Entry(Base, Model):
     title = Column(Unicode)
     deleted = Column(Boolean)
     content_type = Column(Unicode)
+    plot_date = Column(Float)
+    plot_hour = Column(Float)
+    access_weekday = Column(Integer)
+    access_minute = Column(Integer)
     
     browser_id = Column(Integer, ForeignKey('browser.id'))
     group_id = Column(Integer, ForeignKey('groups.id'))
@@ -562,6 +823,10 @@ class Entry(Base, Model):
             if k == "access_time" :
                 self.access_date = datetime(v.year, v.month, v.day, 0, 0, 0, 0)
                 self.access_time = t(v.hour, v.minute, v.second, v.microsecond)
+                self.plot_date = plot_date(self.access_date)
+                self.plot_hour = plot_hour(self.access_time)
+                self.access_weekday = v.weekday()
+                self.access_minute = v.hour * 60 + v.minute
             elif k == "modified_time" :
                 self.modified_date = datetime(v.year, v.month, v.day, 0, 0, 0, 0)
                 self.modified_time = t(v.hour, v.minute, v.second, v.microsecond)
@@ -605,45 +870,70 @@ class Entry(Base, Model):
         return self.browser.name
     browsername = property(_browsername) 
     
+    HEATMAP_STEP = 15 # smallest number of minutes counted together by getTimeCounts()
+    
     @staticmethod
-    def generateHeatMap():
+    def getTimeCounts():
+        """
+            Counts the entries in every `HEATMAP_STEP` minutes of every day of the week with
+            one grouped query. Returns a dictionary of (weekday, step) -> number of entries, 
+            where Monday is weekday 0. The result can be given to `generateHeatMap()` and 
+            `peakTime()` so they do not have to count the entries again.
+        """
+        step = cast(Entry.access_minute / Entry.HEATMAP_STEP, Integer)
+        q = session.query(Entry.access_weekday, step, func.count(Entry.id))\
+                   .filter(Entry.access_weekday != None)\
+                   .group_by(Entry.access_weekday, step)
+        return dict([((weekday, s), amount) for weekday, s, amount in q])
+    
+    @staticmethod
+    def _timeRows(step, counts):
         """
-            Returns heatmap things for the overview: the table headers, the heatmap
-            table and the highest and lowest values (used to calculate heatmap colour).
+            Adds up `counts` from `getTimeCounts()` into rows of `step` minutes. Returns a list
+            of (title, amounts) tuples, one for each row of the day, where amounts has the 
+            number of entries on each day of the week from Monday.
         """
-        headers = ['Mon', 'Tue','Wed','Thu','Fri','Sat','Sun']
-        rows = []
-        step = 1 # number of hours each row in table represents
+        if step % Entry.HEATMAP_STEP != 0 or 1440 % step != 0:
+            raise ValueError("The heatmap step must be a multiple of %d minutes that divides a day" 
+                             % Entry.HEATMAP_STEP)
         
+        per_row = step / Entry.HEATMAP_STEP
+        rows = []
         init = datetime(1, 1, 1)
-        start_time = init.time()
-        until_time = None
-        
-        highest = 0
-        lowest = 0
-        
-        while(start_time < t((24-step),0,0)):
+        for row in xrange(1440 / step):
             start_time = init.time()
-            until_time = (init + timedelta(hours=step) - timedelta(milliseconds=1)).time()
-            
+            until_time = (init + timedelta(minutes=step) - timedelta(milliseconds=1)).time()
             title = start_time.strftime('%H:%M - ') + until_time.strftime('%H:%M')
             
-            values = []
-            for weekday in [1,2,3,4,5,6,0]: # '%w' gives weekdays starting on sunday
-                q = session.query(Entry)\
-                    .filter(func.strftime('%w', Entry.access_date) == str(weekday))\
-                    .filter(Entry.access_time >= start_time)\
-                    .filter(Entry.access_time <= until_time).count()
-
-                if q > highest:
-                    highest = q
-                if q < lowest:
-                    lowest = q
-                
-                values.append(q)
-                
-            rows.append((title, values))
-            init = init + timedelta(hours=step)
+            amounts = [0] * 7
+            for weekday in xrange(7):
+                for s in xrange(row * per_row, (row + 1) * per_row):
+                    amounts[weekday] = amounts[weekday] + counts.get((weekday, s), 0)
+            rows.append((title, amounts))
+            init = init + timedelta(minutes=step)
+        return rows
+    
+    @staticmethod
+    def generateHeatMap(step=None, counts=None):
+        """
+            Returns heatmap things for the overview: the table headers, the heatmap
+            table and the highest and lowest values (used to calculate heatmap colour).
+            
+            Each row of the table is `step` minutes, e.g. 15, 60 or 240, defaulting to 
+            `heatmap_step` in the `[overview]` section of the config file. `counts` is the 
+            result of `getTimeCounts()`, which is called if it is not given.
+        """
+        if step is None:
+            step = config.getint('overview', 'heatmap_step')
+        if counts is None:
+            counts = Entry.getTimeCounts()
+        
+        headers = ['Mon', 'Tue','Wed','Thu','Fri','Sat','Sun']
+        rows = Entry._timeRows(step, counts)
+        
+        values = [v for title, amounts in rows for v in amounts]
+        highest = max([0] + values)
+        lowest = min([0] + values)
 
         return headers, rows, highest, lowest   
     
@@ -663,31 +953,21 @@ class Entry(Base, Model):
             return 0  
     
     @staticmethod
-    def peakTime():  
+    def peakTime(step=60, counts=None):  
         """
             Returns the peak time of web browser usage. Similar to the heatmap, although doesn't 
-            do for each day of the week - sums up each hour and returns the highest.
+            do for each day of the week - sums up each `step` minutes and returns the highest.
+            `counts` is the result of `getTimeCounts()`, which is called if it is not given.
         """     
-        step = 1
-        
-        init = datetime(1, 1, 1)
-        start_time = init.time()
-        until_time = None
+        if counts is None:
+            counts = Entry.getTimeCounts()
         
         highest = 0
         timeperiod = None
-        while(start_time < t(24-step,0,0)):
-            start_time = init.time()
-            until_time = (init + timedelta(hours=step) - timedelta(milliseconds=1)).time()
-        
-            q = session.query(Entry).filter(Entry.access_time >= start_time)\
-                    .filter(Entry.access_time <= until_time).count()
-
-            if q > highest:
-                highest = q
-                timeperiod = start_time.strftime('%H:%M - ') + until_time.strftime('%H:%M')
-                
-            init = init + timedelta(hours=step)
+        for title, amounts in Entry._timeRows(step, counts):
+            if sum(amounts) > highest:
+                highest = sum(amounts)
+                timeperiod = title
         return timeperiod  
     
     @staticmethod
@@ -695,13 +975,13 @@ class Entry(Base, Model):
         """
             Used to build the file directory tree for the File tab.
         """
-        path, count, dates = element               
+        path, count, file_path = element               
         current = tree
         
         parts = path.split('/')
         for part in parts[:-1]:
             current = current.setdefault(part, {})
-        current[parts[-1]] = (count, dates)
+        current[parts[-1]] = (count, file_path)
     
     @staticmethod
     def filesAccessed():
@@ -709,33 +989,27 @@ class Entry(Base, Model):
             Returns a file directory tree and the total amount of files accessed. The tree
             is a dictionary of drives, each drive letter is the key and the value is another dictionary 
             with the keys being file types. For each file type, the value is a tree structure with the
-            end point being a file name, the number of times the file was accessed and a list of 
-            access dates.
+            end point being a file name, the number of times the file was accessed and the path
+            of the file's URL, which can be given to `fileDates()` to get the access dates.
+            
+            The files are counted in one query grouped by path, using the `ix_url_file` index.
                     
             .. note::
                 This does not allow for Linux etc drives, only Windows one letter drives.
-                
-                **ToDo**: re-optimise this query, more things were done making it slow again for 
-                larger datasets. 
             
                 **ToDo**: Allow other operating systems file systems. 
         """
-        q = session.query(URL, func.count(1)).filter(URL.scheme == "file").order_by(func.count(1))
-        q = q.group_by(URL.path)
+        q = session.query(URL.path, func.count(1)).filter(URL.scheme == "file")
+        q = q.group_by(URL.path).order_by(func.count(1))
         
-        total = q.count()
-         
+        total = 0
         drives = {}
         
-        for file, count in q:
-            path = urllib.unquote(file.path[1:])
+        for file_path, count in q:
+            total = total + 1
+            path = urllib.unquote(file_path[1:])
             
-            # hack to get dates working: needs to be made into above query ^
-            dates = session.query(Entry.access_date, Entry.access_time).join(URL)\
-                .filter(URL.path==file.path)\
-                .order_by(desc(Entry.access_date), desc(Entry.access_time))
-            
-            if path[1] == ":":
+            if path[1:2] == ":":
                 drive = path[0]
             else:
                 continue #don't deal with Linux yet
@@ -753,10 +1027,25 @@ class Entry(Base, Model):
             drives[drive] = (drives[drive][0], drives[drive][1] + count)
             drives[drive][0][type] = (drives[drive][0][type][0], drives[drive][0][type][1] + count)
      
-            Entry._buildTree(drives[drive][0][type][0], (path, count, dates))
+            Entry._buildTree(drives[drive][0][type][0], (path, count, file_path))
                             
         return drives, total    
+    
+    @staticmethod
+    def fileDates(file_path):
+        """
+            Returns the access dates and times of the file with the URL path `file_path`, 
+            latest first. Used by the File tab when a file is clicked on.
+        """
+        return session.query(Entry.access_date, Entry.access_time).join('parsedurl')\
+                      .filter(URL.scheme == "file").filter(URL.path == file_path)\
+                      .order_by(desc(Entry.access_date), desc(Entry.access_time)).all()
                 
+Index('ix_entry_plot', Entry.plot_date, Entry.plot_hour)
+Index('ix_entry_weekday', Entry.access_weekday, Entry.access_minute)
+Index('ix_entry_browser', Entry.browser_id)
+Index('ix_entry_group', Entry.group_id)
+
 Entry.filter_options = {
     'access_date': ('Access Date', 
                     ['Is','Is not','Greater than','Less than'], 
@@ -862,27 +1151,52 @@ class URL(Base, Model):
     
     entry = relation(Entry, backref=backref('parsedurl', uselist=False))
     
+    url_cache = LRUCache(100000)    # raw URL -> dictionary of its parts
+    domain_cache = LRUCache(10000)  # hostname -> domain
+    
     def __init__(self, url=None):
         
         if url is not None:
-            parsed_url = urlparse.urlparse(self.urlstrip(url))
-
-            self.scheme=parsed_url.scheme
-            self.netloc=parsed_url.netloc
-            self.path=parsed_url.path
-            self.params=parsed_url.params
-            self.query=parsed_url.query
-            self.fragment=parsed_url.fragment
-            self.username=parsed_url.username
-            self.password=parsed_url.password
-            self.hostname=parsed_url.hostname
+            for k, v in URL.decompose(url).iteritems():
+                setattr(self, k, v)
+    
+    @staticmethod
+    def decompose(url):
+        """
+            Returns a dictionary of the parts of `url`, in the same form as `asDict()`. 
+            Browser histories repeat the same URLs many times, so the parts are remembered 
+            in `URL.url_cache`. 
+        """
+        parts = URL.url_cache.get(url)
+        if parts is None:
+            parsed_url = urlparse.urlparse(URL.urlstrip(url))
+            parts = {
+                'scheme': parsed_url.scheme,
+                'netloc': parsed_url.netloc,
+                'path': parsed_url.path,
+                'params': parsed_url.params,
+                'query': parsed_url.query,
+                'fragment': parsed_url.fragment,
+                'username': parsed_url.username,
+                'password': parsed_url.password,
+                'hostname': parsed_url.hostname,
+                'port': None,
+                'domain': None
+            }
             try:
-                self.port=parsed_url.port # sometimes throws exception on odd protocols such as res://
+                parts['port'] = parsed_url.port # sometimes throws exception on odd protocols such as res://
             except:
-                self.port = None
-            self.domain = None
-            
-            self.setDomain()
+                pass
+            parts['domain'] = URL.getDomain(parts['hostname'], parts['scheme'])
+            URL.url_cache.set(url, parts)
+        return dict(parts)
+    
+    @staticmethod
+    def cacheStats():
+        """
+            Returns the hits and misses of the URL and domain caches, for tuning their sizes.
+        """
+        return {'url': URL.url_cache.stats(), 'domain': URL.domain_cache.stats()}
     
     def __repr__(self):
         return "[url %s]" % (self.domain)  
@@ -905,7 +1219,8 @@ class URL(Base, Model):
             'domain': self.domain
         }
     
-    def urlstrip(self, url):
+    @staticmethod
+    def urlstrip(url):
         """
             Some urls from IE appear like [username]@[url]. urlstrip() gets rid of the 
             [username]@ bit. Returns the shortened URL
@@ -922,53 +1237,67 @@ class URL(Base, Model):
              
             
     def setDomain(self):
+        """
+            Sets the domain using `URL.getDomain()`.
+        """        
+        self.domain = URL.getDomain(self.hostname, self.scheme)
+        
+    @staticmethod
+    def getDomain(hostname, scheme):
         """
             Removes www from front of any hostnames to normalise the hostnames and 
             then tries to remove subdomains by working backwards to find the domain.
+            The domain of each hostname is remembered in `URL.domain_cache`.
         """        
+        if hostname and scheme not in ['res', 'ms-help']:
+            domain = URL.domain_cache.get(hostname, False)
+            if domain is False:
+                domain = URL.findDomain(hostname)
+                URL.domain_cache.set(hostname, domain)
+            return domain
+        else:
+            return None
         
-        toplevel = ['aero', 'arpa', 'asia', 'biz', 'cat', 'com', 'coop', 'edu', 'gov', 'info', 'int', 
-                    'jobs', 'mil', 'mobi', 'museum', 'name', 'net', 'org', 'pro', 'tel', 'travel']
-        
-        if self.hostname and self.scheme not in ['res', 'ms-help']:
-            
-            if self.hostname.startswith('www.'):
-                d = self.hostname[4:]
-            else:
-                d = self.hostname
-                
-            parts = d.split('.')
-            
-            all_int = True  # check to make sure it's a domain name rather than IP address
-            for p in parts:
-                try:
-                    int(p)
-                except Exception, e:
-                    all_int = False
+    @staticmethod
+    def findDomain(hostname):
+        """
+            Returns the domain of `hostname`, or `None` if it is an IP address.
+        """    
+        if hostname.startswith('www.'):
+            d = hostname[4:]
+        else:
+            d = hostname
             
-            if all_int == True:
-                self.domain = None
+        parts = d.split('.')
+        
+        all_int = True  # check to make sure it's a domain name rather than IP address
+        for p in parts:
+            try:
+                int(p)
+            except Exception, e:
+                all_int = False
+                break
+        
+        if all_int == True:
+            return None
+    
+        ending = ending1 = ""
+        
+        if parts[-1] in TOPLEVEL or len(parts[-1]) == 2:
+            ending = "." + parts[-1] # ends with toplevel domain name or 
+                                     # a 2 letter country code
+            parts = parts[0:-1]
+            if len(parts) > 1 and (len(parts[-1]) == 2 or parts[-1] in TOPLEVEL):
+                ending1 = "." + parts[-1]   
+                # second to last part is in toplevel (e.g. org.uk) or 2 letter
+                # code (e.g. co.uk) -- only if url has 2 or more parts left
+                parts = parts[0:-1]         
             else:
-            
-                ending = ending1 = ""
-                
-                if parts[-1] in toplevel or len(parts[-1]) == 2:
-                    ending = "." + parts[-1] # ends with toplevel domain name or 
-                                             # a 2 letter country code
-                    parts = parts[0:-1]
-                    if len(parts) > 1 and (len(parts[-1]) == 2 or parts[-1] in toplevel):
-                        ending1 = "." + parts[-1]   
-                        # second to last part is in toplevel (e.g. org.uk) or 2 letter
-                        # code (e.g. co.uk) -- only if url has 2 or more parts left
-                        parts = parts[0:-1]         
-                    else:
-                        ending1 = ""
-                        
-                domain = parts[-1]
+                ending1 = ""
                 
-                self.domain = domain + ending1 + ending
-        else:
-            self.domain = None
+        domain = parts[-1]
+        
+        return domain + ending1 + ending
            
     @staticmethod        
     def setDomain_manual(group):
@@ -983,35 +1312,46 @@ class URL(Base, Model):
     @staticmethod    
     def getTop(num=100, highlight_funcs=[], remove_funcs=[]):
         """
-            Get the top [amount] filtered URLS for a case. This has been optimised as one 
-            query with a subquery. 
+            Get the top [amount] filtered URLS for a case. The filtered URLs are counted by 
+            domain name and netloc in one query, and the domain names with the most URLs are 
+            picked from those counts. Without filters, the counts stored by `DomainRollup` are 
+            used if they are up to date.
         """        
-
-        filter = getFilter(highlight_funcs, remove_funcs)
-        
-        url2 = aliased(URL)
-        subq = session.query(url2.domain, func.count(url2.domain).label('domain_count'))\
-                .join(filter).filter(url2.domain != None)\
-                .group_by(url2.domain).order_by(desc(func.count(url2.domain)))
-
-        if num != "all":
-            subq = subq.limit(num)           
-        subq = subq.subquery()
-
-        q = session.query(URL.netloc, func.count(1), subq.c.domain, subq.c.domain_count)\
-            .join((subq, URL.domain == subq.c.domain))\
-            .join(filter)\
-            .group_by(URL.netloc)\
-            .order_by(desc(subq.c.domain_count), asc(subq.c.domain), asc(URL.netloc))
+        filter = filterClause(URL.entry_id, highlight_funcs, remove_funcs)
+        counts = None
+        if filter is None:
+            counts = DomainRollup.getCounts()
+        if counts is None:
+            counts = URL.countDomains(filter)
 
         domains = []
-        for netloc, netloc_count, domain, domain_count in q:
+        for domain, netloc, netloc_count in counts:
             if len(domains) == 0 or domains[-1][0] != domain:
-                domains.append((domain, domain_count, []))
-                
+                domains.append([domain, 0, []])
+            
+            domains[-1][1] = domains[-1][1] + netloc_count
             domains[-1][2].append((netloc, netloc_count))
+        
+        domains.sort(key=lambda d: -d[1]) # stable, so equal counts stay in domain order
+        if num != "all":
+            domains = domains[:int(num)]
           
-        return domains 
+        return [tuple(d) for d in domains]
+    
+    @staticmethod
+    def countDomains(filter=None):
+        """
+            Returns a list of (domain name, netloc, number of URLs) tuples ordered by domain 
+            name and netloc, counting the URLs that match the clause `filter` if it is given.
+        """
+        q = session.query(URL.domain, URL.netloc, func.count(1)).filter(URL.domain != None)
+        if filter is not None:
+            q = q.filter(filter)
+        q = q.group_by(URL.domain, URL.netloc).order_by(asc(URL.domain), asc(URL.netloc))
+        return q.all()
+
+Index('ix_url_file', URL.scheme, URL.path)
+Index('ix_url_domain', URL.domain, URL.netloc)
 
 URL.filter_options = {'domain': ('Domain name', ['Is','Is not', 'Contains','Matches regular expression',\
                                                  'Is in list','Is not in list'], None, 'text'),
@@ -1045,6 +1385,9 @@ class Filter(Base, Model):
             
         `query`
             pickled Filter object which stores the filter parts see model/filters.py
+            
+        The filters of a case are loaded once by `getQueries()` and kept in `registry` until 
+        `filtersChanged()` is called.
     """
 
     __tablename__ = 'filters'
@@ -1063,50 +1406,103 @@ class Filter(Base, Model):
     def __repr__(self):
         return "[filter %s]" % (self.label) 
     
+    registry = WeakKeyDictionary()  # database engine -> {label: FilterQuery}
+    
+    @staticmethod
+    def getQueries():
+        """
+            Returns a dictionary of each filter's label to its unpickled `query`. The filters
+            are only loaded the first time this is called for a database. If more than one 
+            filter has the same label, the first is used.
+        """
+        bind = session.bind
+        queries = Filter.registry.get(bind)
+        if queries is None:
+            queries = {}
+            for label, query in session.query(Filter.label, Filter.query).order_by(asc(Filter.id)):
+                if label not in queries:
+                    queries[label] = query
+            Filter.registry[bind] = queries
+        return queries
+    
     @staticmethod
-    def onlineSearches(engine, highlight_funcs=[], remove_funcs=[], num=20):
+    def filtersChanged():
         """
-            Given a search engine, amount and filters, returns a word cloud dictionary of search terms.
-            The keys are the terms and the values are a (ratio, search phrases term was in, 
-            length of search phrases) tuple. Also returns total amount of terms, total number of unique 
-            terms and the smallest ratio (used to make the sizes of the words relative to smallest).
+            Forgets the filters loaded by `getQueries()`, so they are loaded again the next time
+            they are used. Called after filters are added.
         """
+        Filter.registry.pop(session.bind, None)
+    
+    @staticmethod
+    def onlineSearches(highlight_funcs=[], remove_funcs=[], num=20):
+        """
+            Given the filters and amount, returns a dictionary with a word cloud for each search
+            engine in the config file. A word cloud is a dictionary of the `num` (or "all") 
+            most used search terms. The keys are the terms and the values are a (ratio, search
+            term id, number of searches term was in) tuple; the searches themselves are given by
+            `searches()` when a term is looked at. Each word cloud also has the total amount of 
+            terms, total number of unique terms and the smallest ratio (used to make the sizes 
+            of the words relative to smallest).
+            
+            The searches of the terms of every search engine are counted in one query.
+        """
+        q = session.query(SearchTerms.engine, SearchTerms.id, SearchTerms.term, 
+                          SearchTerms.occurrence, func.count(Entry.id))\
+            .join((entry_terms, entry_terms.c.search_id == SearchTerms.id))\
+            .join((Entry, Entry.id == entry_terms.c.entry_id))\
+            .join((URL, URL.entry_id == Entry.id))
+        filter = filterClause(entry_terms.c.entry_id, highlight_funcs, remove_funcs)
+        if filter is not None:
+            q = q.filter(filter)
         
-        filter = getFilter(highlight_funcs, remove_funcs)
-
-        searchterms2 = aliased(SearchTerms)
-        subq = session.query(searchterms2.id).filter(searchterms2.engine==engine)\
-            .join(searchterms2.entries).join((filter, Entry.id == filter.c.id))\
-            .group_by(searchterms2.id)\
-            .order_by(desc(searchterms2.occurrence))
+        found = dict([(engine, []) for engine in config.options('search_engines')])
+        for engine, id, term, occurrence, count in q.group_by(SearchTerms.id):
+            if engine in found:
+                found[engine].append((occurrence, id, term, count))
         
-        if num != "all":
-            subq = subq.limit(num)
-                
-        subq = subq.subquery()
-        
-        q = session.query(SearchTerms)\
-            .join((subq, subq.c.id == SearchTerms.id))\
-            .join(SearchTerms.entries)\
-            .join((filter, Entry.id == filter.c.id))\
-            .join(Entry.parsedurl).filter(SearchTerms.engine==engine)\
-            .options(contains_eager('entries'), contains_eager('entries.parsedurl'))\
-            .order_by(desc(Entry.access_date), desc(Entry.access_time))            
-        
-        
-        terms = q.all()
-        total_terms = float(sum(len(t.entries) for t in terms))        
-        unique_terms = len(terms)
-        cloud = {}
-        smallest = 1.0
-        for term in terms:
-            search_strings = [(entry.parsedurl.search, entry.timeline_date) for entry in term.entries]
-            ratio = len(search_strings)/total_terms
-            # Hack to stop javascript name-space clash. TODO: Fix this in nicer way.
-            cloud['_' + term.term] = (ratio, search_strings, len(search_strings))
-            if ratio < smallest:
-                smallest = ratio
-        return cloud, total_terms, unique_terms, smallest
+        clouds = {}
+        for engine, terms in found.iteritems():
+            terms.sort(reverse=True) # most used first, then the newest terms
+            if num != "all":
+                terms = terms[:int(num)]
+            total_terms = float(sum(count for occurrence, id, term, count in terms))
+            cloud = {}
+            smallest = 1.0
+            for occurrence, id, term, count in terms:
+                ratio = count/total_terms
+                # Hack to stop javascript name-space clash. TODO: Fix this in nicer way.
+                cloud['_' + term] = (ratio, id, count)
+                if ratio < smallest:
+                    smallest = ratio
+            clouds[engine] = (cloud, total_terms, len(terms), smallest)
+        return clouds
+    
+    @staticmethod
+    def searches(term_id, highlight_funcs=[], remove_funcs=[], offset=0, limit=None):
+        """
+            Given a search term id and filters, returns a list of (search phrase, date) tuples of
+            the searches the term was in, latest first. The date is in the same format as 
+            `Entry.timeline_date`. `offset` and `limit` give the part of the list wanted.
+        """
+        q = session.query(URL.search, Entry.access_date, Entry.access_time)\
+            .filter(URL.entry_id == Entry.id)\
+            .filter(Entry.id == entry_terms.c.entry_id)\
+            .filter(entry_terms.c.search_id == term_id)
+        filter = filterClause(entry_terms.c.entry_id, highlight_funcs, remove_funcs)
+        if filter is not None:
+            q = q.filter(filter)
+        q = q.order_by(desc(Entry.access_date), desc(Entry.access_time)).offset(offset)
+        if limit is not None:
+            q = q.limit(limit)
+        
+        searches = []
+        for search, date, time in q:
+            if date and time:
+                date = date.strftime("%a %b %d %Y") + " " + time.strftime("%H:%M:%S")
+            else:
+                date = None
+            searches.append((search, date))
+        return searches
 
 class SearchTerms(Base, Model):
     """
@@ -1181,6 +1577,27 @@ class SearchTerms(Base, Model):
         current_terms = [c.lower() for c in current_terms]
         
         return actual_query, current_terms 
+    
+    @staticmethod
+    def getSearches(netloc, path, query):
+        """
+            Given the parts of a URL, works out if it is a search engine query for any of the 
+            search engines in the config file. Returns a list of (engine, search string, terms)
+            tuples, one for each matching search engine. 
+        """
+        searches = []
+        if query is None or path is None or 'search' not in path:
+            return searches
+        
+        for opt in config.options('search_engines'):
+            if opt in netloc:
+                q = query.split(config.get('search_engines', opt)+'=')[-1].split('&')[0]
+                q_string, terms = SearchTerms.getTerms(urllib.unquote(q))
+                searches.append((opt, q_string, terms))
+        return searches
+
+Index('ix_search_terms_term', SearchTerms.term, SearchTerms.engine)
+
 SearchTerms.filter_options = {'term': ('Search Term', 
                                        ['Is','Is not', 'Contains',\
                                         'Matches regular expression','Is in list','Is not in list'], 
@@ -1191,3 +1608,378 @@ SearchTerms.filter_options = {'term': ('Search Term',
                               'engine_long':('Search Engine',
                                              ['Is','Is not'],SearchTerms.getAll,'select')
                               }
+
+
+class Summary(Base, Model):
+    """
+        Class that stores the statistics shown on the overview page, so they are not worked out 
+        every time the page is loaded. Each statistic is worked out by its function in 
+        `Summary.statistics`. A stored statistic is only used if it was worked out for the 
+        current `Case.data_version`.
+        
+        `name`
+            name of the statistic
+            
+        `version`
+            `Case.data_version` when the statistic was worked out
+            
+        `value`
+            pickled value of the statistic
+    """
+    __tablename__ = 'summary'
+    
+    name = Column(Unicode, primary_key = True)
+    version = Column(Integer)
+    value = Column(PickleType)
+    
+    def __init__(self, name, version, value):
+        self.name = name
+        self.version = version
+        self.value = value
+    
+    def __repr__(self):
+        return "[summary %s]" % (self.name)
+    
+    @staticmethod
+    def fill():
+        """
+            Works out and stores any statistics that are missing or were worked out for an older
+            `Case.data_version`. Called when the wizard is finished, before the database is hashed.
+        """
+        version = Case.getDataVersion()
+        stored = dict([(row.name, row) for row in session.query(Summary)])
+        for name, statistic in Summary.statistics.iteritems():
+            row = stored.get(name)
+            if row is None:
+                session.add(Summary(name, version, statistic()))
+            elif row.version != version:
+                row.version = version
+                row.value = statistic()
+    
+    @staticmethod
+    def getStatistics():
+        """
+            Returns a dictionary of all the statistics. Statistics that are not stored for the 
+            current `Case.data_version` are worked out but not stored, so the database is only 
+            changed by `fill()`.
+        """
+        version = Case.getDataVersion()
+        statistics = dict([(row.name, row.value) for row in 
+                           session.query(Summary).filter(Summary.version == version)])
+        for name, statistic in Summary.statistics.iteritems():
+            if name not in statistics:
+                statistics[name] = statistic()
+        return statistics
+
+def _accessDate(entry):
+    """
+        Returns the access date of an entry, or `None` if there is no entry.
+    """
+    if entry is None:
+        return None
+    return entry.access_date
+
+Summary.statistics = {'newest_date': lambda: _accessDate(Case.getNewestEntry(Case.get_case())),
+                      'oldest_date': lambda: _accessDate(Case.getOldestEntry(Case.get_case())),
+                      'browser_stats': Browser.getPercentages,
+                      'average_pages': Entry.averagePages,
+                      'time_counts': Entry.getTimeCounts,
+                      'files_accessed': Entry.filesAccessed,
+                      }
+
+
+class FilterBitmap(Base, Model):
+    """
+        Class that stores which entries a filter matches as a `Bitmap` (see :doc:`bitmap`), so
+        the filter's query is not run every time the filter is used. A stored bitmap is only 
+        used if it was worked out for the current `Case.data_version`.
+        
+        `key`
+            the filter's key, see `FilterQuery.bitmapKey()` in :doc:`filters`
+            
+        `version`
+            `Case.data_version` when the bitmap was worked out
+            
+        `bits`
+            the bitmap from `Bitmap.toString()`
+    """
+    __tablename__ = 'filter_bitmaps'
+    
+    key = Column(Unicode, primary_key = True)
+    version = Column(Integer)
+    bits = Column(Binary)
+    
+    def __init__(self, key, version, bits):
+        self.key = key
+        self.version = version
+        self.bits = bits
+    
+    def __repr__(self):
+        return "[filter bitmap %s]" % (self.key)
+    
+    @staticmethod
+    def load(key, version):
+        """
+            Returns the bitmap stored for the filter key and `Case.data_version`, or `None` if
+            there is not one.
+        """
+        bits = session.query(FilterBitmap.bits).filter(FilterBitmap.key == key)\
+                      .filter(FilterBitmap.version == version).scalar()
+        if bits is None:
+            return None
+        return Bitmap.fromString(str(bits))
+    
+    @staticmethod
+    def fill():
+        """
+            Works out and stores the bitmaps of the filters that are missing or were worked out
+            for an older `Case.data_version`, and deletes the bitmaps no filter uses any more. 
+            Called when the wizard is finished and when a filter is added, before the database 
+            is hashed.
+        """
+        version = Case.getDataVersion()
+        stored = dict([(row.key, row) for row in session.query(FilterBitmap)])
+        keys = set()
+        for f in Filter.getAll():
+            if f.query is None:
+                continue
+            key = f.query.bitmapKey()
+            if key in keys:
+                continue
+            keys.add(key)
+            row = stored.get(key)
+            if row is None:
+                session.add(FilterBitmap(key, version, f.query.bitmap().toString()))
+            elif row.version != version:
+                row.version = version
+                row.bits = f.query.bitmap().toString()
+        for key, row in stored.iteritems():
+            if key not in keys:
+                session.delete(row)
+
+
+class FilterValue(Base, Model):
+    """
+        Class that stores the values of the columns picked from a list when adding a filter 
+        (those with a callback in their class's `filter_options`), with the number of entries 
+        that have each value, so the add filter pop-up does not have to load every object to 
+        list them. The values of a column are only used if they were worked out for the 
+        current `Case.data_version`.
+        
+        `column`
+            the column the value is from, e.g. `URL.port`
+            
+        `value`
+            the value as a string. Each column has a row with the empty string, which counts 
+            the entries without a value
+            
+        `count`
+            number of entries with the value
+            
+        `version`
+            `Case.data_version` when the values were worked out
+    """
+    __tablename__ = 'filter_values'
+    
+    column = Column(Unicode, primary_key = True)
+    value = Column(Unicode, primary_key = True)
+    count = Column(Integer)
+    version = Column(Integer)
+    
+    def __init__(self, column, value, count, version):
+        self.column = column
+        self.value = value
+        self.count = count
+        self.version = version
+    
+    def __repr__(self):
+        return "[filter value %s %s]" % (self.column, self.value)
+    
+    @staticmethod
+    def getColumns():
+        """
+            Returns a dictionary of column name to (class, attribute) tuples for the columns 
+            whose values are stored.
+        """
+        columns = {}
+        for cls in (Browser, Group, Entry, URL, SearchTerms):
+            for attr, (label, ops, callback, value_type) in cls.filter_options.iteritems():
+                if callback is not None:
+                    columns[u'%s.%s' % (cls.__name__, attr)] = (cls, attr)
+        return columns
+    
+    @staticmethod
+    def countValues(column):
+        """
+            Works out the values of a column. Returns a list of (value, count) tuples ordered 
+            by value, starting with the empty string.
+        """
+        cls, attr = FilterValue.getColumns()[column]
+        col = getattr(cls, attr)
+        if cls is Entry:
+            q = session.query(col, func.count(Entry.id))
+        elif cls is URL:
+            q = session.query(col, func.count(URL.entry_id))
+        elif cls is SearchTerms:
+            q = session.query(col, func.sum(SearchTerms.occurrence))
+        else:
+            q = session.query(col, func.count(Entry.id))\
+                       .select_from(cls.__table__.outerjoin(Entry.__table__))
+        
+        counts = {u'': 0}
+        for value, count in q.group_by(col):
+            value = u'' if value is None else unicode(value)
+            counts[value] = counts.get(value, 0) + (count or 0)
+        return sorted(counts.iteritems())
+    
+    @staticmethod
+    def getValues(column, prefix=u'', offset=0, limit=None):
+        """
+            Returns a list of the (value, count) tuples of a column starting with `prefix`, 
+            ordered by value, without the empty string. `offset` and `limit` give the part of
+            the list wanted. If the stored values are not for the current `Case.data_version` 
+            they are worked out, but not stored, so the database is only changed by `fill()`.
+        """
+        if not FilterValue.isCurrent(column):
+            values = [(value, count) for value, count in FilterValue.countValues(column)
+                      if value and value.startswith(prefix)]
+            if limit is None:
+                return values[offset:]
+            return values[offset:offset + limit]
+        
+        q = session.query(FilterValue.value, FilterValue.count)\
+                   .filter(FilterValue.column == column).filter(FilterValue.value != u'')
+        if prefix:
+            q = q.filter(_startsWith(FilterValue.value, prefix))
+        q = q.order_by(FilterValue.value).offset(offset)
+        if limit is not None:
+            q = q.limit(limit)
+        return [(value, count) for value, count in q]
+    
+    @staticmethod
+    def isCurrent(column):
+        """
+            Returns whether the stored values of a column are for the current 
+            `Case.data_version`.
+        """
+        version = session.query(FilterValue.version).filter(FilterValue.column == column)\
+                         .filter(FilterValue.value == u'').scalar()
+        return version == Case.getDataVersion()
+    
+    @staticmethod
+    def hasValue(column, value):
+        """
+            Returns whether `value` (not the empty string) is one of the values of a column. 
+            Looks up the stored value if the values are current, otherwise looks for one object
+            with the value, so the column's values are never all loaded.
+        """
+        if not value:
+            return False
+        if FilterValue.isCurrent(column):
+            q = session.query(FilterValue.count).filter(FilterValue.column == column)\
+                       .filter(FilterValue.value == value)
+        else:
+            cls, attr = FilterValue.getColumns()[column]
+            col = getattr(cls, attr)
+            q = session.query(col).filter(col == value)
+        return q.first() is not None
+    
+    @staticmethod
+    def fill():
+        """
+            Works out and stores the values of the columns that are missing or were worked out 
+            for an older `Case.data_version`. Called when the wizard is finished, before the 
+            database is hashed.
+        """
+        version = Case.getDataVersion()
+        columns = FilterValue.getColumns()
+        table = FilterValue.__table__
+        stored = dict(session.query(FilterValue.column, FilterValue.version)\
+                             .filter(FilterValue.value == u''))
+        for column in set(columns) | set(stored):
+            if column in columns and stored.get(column) == version:
+                continue
+            session.execute(table.delete().where(table.c.column == column))
+            if column in columns:
+                session.execute(table.insert(), 
+                                [{'column': column, 'value': value, 'count': count, 
+                                  'version': version}
+                                 for value, count in FilterValue.countValues(column)])
+
+def _startsWith(col, prefix):
+    """
+        Returns the clause for the strings in `col` that start with `prefix`. Strings are 
+        compared by character, so these are the strings from `prefix` up to (but not including)
+        `prefix` with its last character changed to the next one, which can use an index.
+    """
+    last = ord(prefix[-1])
+    if last >= 0xd7ff:
+        return func.substr(col, 1, len(prefix)) == prefix
+    return and_(col >= prefix, col < prefix[:-1] + unichr(last + 1))
+
+
+class DomainRollup(Base, Model):
+    """
+        Class that stores the number of URLs of each domain name and netloc, which is what the 
+        Domains tab shows when no filters are used, so they are not counted every time the tab
+        is loaded. The counts are only used if they were worked out for the current 
+        `Case.data_version`.
+        
+        `domain`
+            the domain name
+            
+        `netloc`
+            the netloc
+            
+        `count`
+            number of URLs with the domain name and netloc
+            
+        `version`
+            `Case.data_version` when the counts were worked out
+    """
+    __tablename__ = 'domain_rollup'
+    
+    domain = Column(Unicode, primary_key = True)
+    netloc = Column(Unicode, primary_key = True)
+    count = Column(Integer)
+    version = Column(Integer)
+    
+    def __init__(self, domain, netloc, count, version):
+        self.domain = domain
+        self.netloc = netloc
+        self.count = count
+        self.version = version
+    
+    def __repr__(self):
+        return "[domain rollup %s %s]" % (self.domain, self.netloc)
+    
+    @staticmethod
+    def getCounts():
+        """
+            Returns the stored counts like `URL.countDomains()`, or `None` if they were not 
+            worked out for the current `Case.data_version`.
+        """
+        version = session.query(DomainRollup.version).limit(1).scalar()
+        if version is None or version != Case.getDataVersion():
+            return None
+        return session.query(DomainRollup.domain, DomainRollup.netloc, DomainRollup.count)\
+                      .order_by(asc(DomainRollup.domain), asc(DomainRollup.netloc)).all()
+    
+    @staticmethod
+    def fill():
+        """
+            Works out and stores the counts if they were worked out for an older 
+            `Case.data_version`. Called when the wizard is finished, before the database is 
+            hashed.
+        """
+        version = Case.getDataVersion()
+        if session.query(DomainRollup.version).limit(1).scalar() == version:
+            return
+        table = DomainRollup.__table__
+        session.execute(table.delete())
+        counts = URL.countDomains()
+        if counts:
+            session.execute(table.insert(), 
+                            [{'domain': domain, 'netloc': netloc, 'count': count, 
+                              'version': version}
+                             for domain, netloc, count in counts])
@@ -9,6 +9,8 @@ test_units = [
     'unittests.test_validators',
     'unittests.test_forms',
     'unittests.test_models',
+    'unittests.test_converters',
+    'unittests.test_importer',
 ]
 
 test_functions = [
@@ -1,9 +1,116 @@
 # python imports
-import unittest 
+import unittest
+from os import path, remove
+import shutil
+import hashlib
+import tempfile
+import time
+import simplejson as json
+# library imports
+from werkzeug import Client, BaseResponse
 # local imports
 import baseTester
+from webscavator.application import make_app
+from webscavator.utils.utils import connect, init_database, bind, setup, session, ROOT_DIR, \
+     CASE_FILE_DIR
+from webscavator.utils.jobs import job_queue
+from webscavator.model.models import Case, Group
+from webscavator.model.migrations import migrations
+from webscavator.model.importer import ImportJob
 
 class CaseControllerTestCase(baseTester.BaseReadTest):
     pass
+
+class LoadCaseTestCase(unittest.TestCase):
+    def setUp(self):
+        self.dbfile = path.join(CASE_FILE_DIR, 'functional_test_load.db')
+        self.logfile = path.join(ROOT_DIR, '..', 'case file hashes',
+                                 'functional_test_load_hashes.txt')
+        shutil.copy(path.join(ROOT_DIR, 'webscavator', 'test', 'test.db'), self.dbfile)
+
+        # make the case look like it was made before the last migration
+        db = connect(self.dbfile)
+        db.execute('PRAGMA user_version = %d' % (len(migrations) - 1))
+        db.dispose()
+        self.client = Client(make_app(), BaseResponse)
+    def tearDown(self):
+        for f in self.dbfile, self.logfile:
+            if path.exists(f):
+                remove(f)
+        setup(True)
+    def load(self):
+        self.client.get('/case/load/')
+        response = self.client.post('/case/load/complete/',
+                                    data={'case': 'functional_test_load.db', 'x': 1, 'y': 1})
+        self.assertEqual(response.status_code, 200)
+    def hash(self):
+        return hashlib.md5(open(self.dbfile, 'rb').read()).hexdigest()
+    def log(self):
+        return [line.split('\t\t') for line in open(self.logfile).read().splitlines() if line]
+    def testLoad(self):
+        received = self.hash()
+        self.load()
+
+        # the case is logged as it was given, then the migration is logged
+        log = self.log()
+        self.assertEqual([(l[1], l[3]) for l in log],
+            [(received, 'Loaded the case.'),
+             (self.hash(), 'Migrated the case from version %d to version %d.' %
+                           (len(migrations) - 1, len(migrations)))])
+
+        # loading it again does not change it
+        self.load()
+        self.assertEqual([(l[1], l[3]) for l in self.log()[2:]],
+                         [(self.hash(), 'Loaded the case.')])
+
+class ImportStatusTestCase(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.db = connect(path.join(self.dir, 'new.db'))
+        init_database(self.db)
+        bind(self.db)
+        case = Case(u'New Case')
+        session.add(case)
+        session.add(Group(u'Test Group', u'', case, u'netanalysis'))
+        session.commit()
+        self.client = Client(make_app(), BaseResponse)
+    def tearDown(self):
+        session.remove()
+        self.db.dispose()
+        shutil.rmtree(self.dir)
+        setup(True)
+    def submit(self, broken=False):
+        lines = open(path.join(ROOT_DIR, 'webscavator', 'test', 'test.csv'), 'rb').readlines()
+        if broken:
+            lines[2] = lines[2].replace('01/08/2010', '99/99/2010')
+        filename = path.join(self.dir, 'upload.csv')
+        open(filename, 'wb').write(''.join(lines))
         
-    
\ No newline at end of file
+        job = ImportJob(self.db)
+        job.add(0, session.query(Group).one(), 'netanalysis', filename, False)
+        return job_queue.submit(job)
+    def poll(self, id):
+        for i in xrange(200):
+            response = self.client.get('/json/importstatus/%d' % id)
+            self.assertEqual(response.status_code, 200)
+            status = json.loads(response.data)
+            self.assertEqual(status['id'], id)
+            if status['state'] in ('done', 'failed'):
+                return status
+            time.sleep(0.05)
+        self.fail('import did not finish')
+    def testDone(self):
+        status = self.poll(self.submit())
+        self.assertEqual(status['state'], 'done')
+        self.assertEqual((status['parsed'], status['inserted'], status['eta']), 
+                         (1818, 1818, 0.0))
+        self.assertFalse('errors' in status)
+    def testFailed(self):
+        status = self.poll(self.submit(broken=True))
+        self.assertEqual(status['state'], 'failed')
+        self.assertEqual(status['errors'].keys(), ['csv_entry-0.data'])
+    def testUnknownJob(self):
+        id = self.submit()
+        self.poll(id)
+        response = self.client.get('/json/importstatus/%d' % (id + 1))
+        self.assertEqual(response.status_code, 404)
@@ -0,0 +1,96 @@
+# python imports
+import unittest
+from datetime import datetime
+from StringIO import StringIO
+from os import path
+# local imports
+from webscavator.converters.timestamps import TimestampParser
+from webscavator.converters.xml_converter import XMLConverter
+from webscavator.converters import ConversionError, convert_file
+from webscavator.converters import parallel
+from webscavator.model.models import URL
+from webscavator.utils.utils import ROOT_DIR
+
+class TimestampParserTestCase(unittest.TestCase):
+    def setUp(self):
+        self.formats = ["%m/%d/%Y %H:%M:%S", "%d/%m/%Y %H:%M:%S %a", "%Y-%m-%dT%H:%M:%S"]
+        self.values = [datetime(2010, 5, 1, 0, 0, 0), datetime(2010, 5, 1, 23, 59, 59), 
+                       datetime(2009, 12, 31, 9, 5, 7), datetime(2008, 2, 29, 12, 30, 1)]
+    def tearDown(self):
+        pass
+    def testSameAsStrptime(self):
+        for format in self.formats:
+            parse = TimestampParser(format)
+            for v in self.values:
+                s = v.strftime(format)
+                self.assertEqual(parse(s), v)
+                self.assertEqual(parse(s), datetime.strptime(s, format)) # remembered date
+    def testFallback(self):
+        parse = TimestampParser("%d/%m/%Y %H:%M:%S")
+        self.assertEqual(parse("1/5/2010 10:20:30"), datetime(2010, 5, 1, 10, 20, 30))
+        self.assertEqual(parse("01/05/2010  0:20:30"), datetime(2010, 5, 1, 0, 20, 30))
+    def testMalformed(self):
+        parse = TimestampParser("%d/%m/%Y %H:%M:%S %a")
+        for s in ["99/07/2010 23:25:01 Tue", "01/05/2010 25:00:00 Sat", "01/05/2010 10:20:30 Foo",
+                  "01-05-2010 10:20:30 Sat", "", "garbage"]:
+            self.assertRaises(ValueError, parse, s)
+
+class XMLConverterTestCase(unittest.TestCase):
+    def setUp(self):
+        self.xml = StringIO('<History><Header><Item>0</Item></Header><Item>1</Item>'
+                            '<Other/><Item>2</Item><Item>bad</Item></History>')
+        self.converter = XMLConverter(self.xml)
+        self.converter.topelement = 'Item'
+        self.converter.process_element = lambda element: int(element.text)
+    def tearDown(self):
+        pass
+    def testProcess(self):
+        rows = list(self.converter.process())
+        self.assertEqual(rows[:2], [1, 2])
+        self.assertTrue(isinstance(rows[2], ConversionError))
+        self.assertEqual(str(rows[2])[:9], 'record 3:')
+        self.assertEqual(self.converter.bytes_read, len(self.xml.getvalue()))
+
+class ParallelTestCase(unittest.TestCase):
+    def setUp(self):
+        self.batch_size = parallel.batch_size
+        parallel.batch_size = 100 # so the files are sent to the pool in several batches
+        lines = open(path.join(ROOT_DIR, 'webscavator', 'test', 'test.csv'), 'r').readlines()
+        lines[2] = lines[2].replace('01/08/2010', '99/99/2010')
+        self.csv = ''.join(lines)
+        item = ('<UrlHistoryItem><URL>http://www.example.org/page%%20%d?q=%d</URL>'
+                '<VisitType>URL</VisitType><LastVisitDate>%s</LastVisitDate>'
+                '<BrowserName>IE</BrowserName><BrowserVersion>8</BrowserVersion>'
+                '<Profile>p</Profile><PageTitle>t\xc3\xa9 %d</PageTitle></UrlHistoryItem>')
+        items = [item % (i, i, '2010-05-%02dT10:%02d:00+01:00' % (i % 28 + 1, i % 60), i) 
+                 for i in xrange(250)]
+        items[7] = item % (7, 7, 'garbage+01:00', 7)
+        self.xml = '<UrlHistory><Header>x</Header>%s</UrlHistory>' % ''.join(items)
+    def tearDown(self):
+        parallel.batch_size = self.batch_size
+    def convert(self, type, data, processes):
+        """
+            Returns the rows converted by `processes` processes, with the URL split up like 
+            `parallel` does and errors as strings, so they can be compared.
+        """
+        rows = []
+        for d in convert_file(type, StringIO(data), processes):
+            if isinstance(d, ConversionError):
+                rows.append(str(d))
+                continue
+            d = dict([(f, d[f]) for f in parallel.FIELDS + ('url_parts',) if f in d])
+            if 'url_parts' not in d and d['url'] is not None:
+                url = URL.decompose(d['url'])
+                d['url_parts'] = dict([(f, url[f]) for f in parallel.URL_FIELDS])
+            rows.append(d)
+        return rows
+    def testCSV(self):
+        serial = self.convert('netanalysis', self.csv, 1)
+        self.assertEqual(len(serial), 1818)
+        self.assertTrue(isinstance(serial[2], str))
+        self.assertEqual(self.convert('netanalysis', self.csv, 2), serial)
+    def testXML(self):
+        serial = self.convert('webhistorian', self.xml, 1)
+        self.assertEqual(len(serial), 250)
+        self.assertTrue(isinstance(serial[7], str))
+        self.assertEqual(self.convert('webhistorian', self.xml, 2), serial)
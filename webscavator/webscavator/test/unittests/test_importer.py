@@ -0,0 +1,299 @@
+# python imports
+import unittest
+import os
+from os import path
+import shutil
+import tempfile
+import threading
+import time
+import sqlite3
+# local imports
+from webscavator.model.models import *
+from webscavator.model.importer import EntryImporter, ImportJob
+from webscavator.utils import utils
+from webscavator.utils.utils import connect, init_database, bind, setup, session, ROOT_DIR, \
+     get_indexes, begin_bulk_load, end_bulk_load
+from webscavator.utils.jobs import Job, JobQueue
+from webscavator.converters import convert_file, ConversionError
+
+TEST_DIR = path.join(ROOT_DIR, 'webscavator', 'test')
+
+def entryRows(group):
+    """
+        Returns the entries of a group in id order, with their browser and URL in place of 
+        the ids, so the entries of two groups can be compared. The URL's search string is 
+        left out.
+    """
+    entry = [c.name for c in Entry.__table__.columns if c.name not in ('id', 'group_id',
+                                                                         'browser_id')]
+    url = [c.name for c in URL.__table__.columns if c.name not in ('id', 'entry_id', 
+                                                                     'search')]
+    return session.execute('SELECT %s, %s, browser.name, browser.version, browser.source '
+                           'FROM entry JOIN url ON url.entry_id = entry.id '
+                           'JOIN browser ON browser.id = entry.browser_id '
+                           'WHERE entry.group_id = :group ORDER BY entry.id' %
+                           (', '.join(['entry.' + c for c in entry]),
+                            ', '.join(['url.' + c for c in url])), 
+                           {'group': group.id}).fetchall()
+
+def searchRows(bind):
+    """
+        Returns the search terms, the entries linked to them and the search strings of the 
+        URLs, without their ids, so the search terms of two cases can be compared.
+    """
+    return [bind.execute(sql).fetchall() for sql in (
+        'SELECT term, engine, engine_long, occurrence FROM search_terms ORDER BY term, engine',
+        'SELECT entry.url, entry.access_time, search_terms.term, search_terms.engine '
+        'FROM entry_terms JOIN entry ON entry.id = entry_terms.entry_id '
+        'JOIN search_terms ON search_terms.id = entry_terms.search_id '
+        'ORDER BY entry.id, search_terms.term, search_terms.engine',
+        'SELECT entry.url, url.search FROM url JOIN entry ON entry.id = url.entry_id '
+        'WHERE url.search IS NOT NULL ORDER BY entry.id')]
+
+class NewCaseTestCase(unittest.TestCase):
+    """
+        Runs each test on a new case database, rather than on test.db.
+    """
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.db = connect(path.join(self.dir, 'new.db'))
+        init_database(self.db)
+        bind(self.db)
+        self.case = Case(u'New Case')
+        self.group = Group(u'Test Group', u'', self.case, u'netanalysis')
+        session.add(self.case)
+        session.add(self.group)
+        session.flush()
+    def tearDown(self):
+        session.rollback()
+        session.remove()
+        self.db.dispose()
+        shutil.rmtree(self.dir)
+        setup(True)
+    def addFile(self, group, name, program, chunk_size=None):
+        file = open(path.join(TEST_DIR, name), 'rb')
+        try:
+            return EntryImporter(group, chunk_size).run(convert_file(program, file))
+        finally:
+            file.close()
+    def addRowByRow(self, group, name, program):
+        """
+            Adds the file one `Entry` object at a time, like Webscavator used to.
+        """
+        file = open(path.join(TEST_DIR, name), 'rb')
+        try:
+            for d in convert_file(program, file):
+                if d['access_time'] is None:
+                    continue
+                key = (d.pop('browser_name'), d.pop('browser_version'), d.pop('source_file'))
+                browser = Browser.getFilterBy(name=key[0], version=key[1], source=key[2]).first()
+                if browser is None:
+                    browser = Browser(*key)
+                    session.add(browser)
+                    session.flush()
+                if d['modified_time'] is None:
+                    del d['modified_time']
+                session.add(Entry(browser_id=browser.id, group_id=group.id, **d))
+                session.flush()
+        finally:
+            file.close()
+
+    def upload(self, broken=False):
+        """
+            Copies test.csv to a file the way an upload is saved, breaking the date on its 
+            third line if `broken`. Returns the file name.
+        """
+        lines = open(path.join(TEST_DIR, 'test.csv'), 'rb').readlines()
+        if broken:
+            lines[2] = lines[2].replace('01/08/2010', '99/99/2010')
+        fd, filename = tempfile.mkstemp(dir=self.dir)
+        f = os.fdopen(fd, 'wb')
+        f.write(''.join(lines))
+        f.close()
+        return filename
+    def execute(self, job):
+        """
+            Runs the job in its own thread, like a worker of the `JobQueue` does.
+        """
+        worker = threading.Thread(target=job.execute)
+        worker.start()
+        worker.join()
+        session.expire_all()
+
+class EntryImporterTestCase(NewCaseTestCase):
+    def testChunks(self):
+        self.addRowByRow(self.group, 'test.csv', 'netanalysis')
+        chunked = Group(u'Chunked', u'', self.case, u'netanalysis')
+        session.add(chunked)
+        self.assertEqual(self.addFile(chunked, 'test.csv', 'netanalysis', 7), 1818)
+        
+        rows = entryRows(chunked)
+        self.assertEqual(len(rows), 1818)
+        self.assertEqual(rows, entryRows(self.group))
+    def testSearchTerms(self):
+        self.addFile(self.group, 'test.csv', 'netanalysis', 7)
+        
+        fixture = connect(path.join(TEST_DIR, 'test.db'))
+        try:
+            terms, links, searches = searchRows(fixture)
+        finally:
+            fixture.dispose()
+        self.assertEqual(searchRows(session), [terms, links, searches])
+        
+        # a second import uses the terms already in the case
+        second = Group(u'Second', u'', self.case, u'netanalysis')
+        session.add(second)
+        self.addFile(second, 'test.csv', 'netanalysis')
+        new_terms, new_links, new_searches = searchRows(session)
+        self.assertEqual(new_terms, [t[:3] + (t[3] * 2,) for t in terms])
+        self.assertEqual(len(new_links), len(links) * 2)
+        self.assertEqual(new_searches, searches * 2)
+
+class ImportJobTestCase(NewCaseTestCase):
+    def testAdd(self):
+        session.commit()
+        job = ImportJob(self.db)
+        filename = self.upload()
+        job.add(0, self.group, 'netanalysis', filename, True)
+        job.edit(self.group, {'description': u'Edited'})
+        self.execute(job)
+        
+        self.assertEqual(job.state, 'done')
+        self.assertFalse(path.exists(filename))
+        self.assertEqual(self.group.description, u'Edited')
+        self.assertEqual(session.query(Entry).filter_by(group=self.group).count(), 1818)
+        
+        # the Domains tab counts are for the new data
+        self.assertNotEqual(DomainRollup.getCounts(), None)
+        self.assertEqual(DomainRollup.getCounts(), URL.countDomains())
+        
+        status = job.status()
+        self.assertEqual((status['parsed'], status['inserted'], status['eta']), 
+                         (1818, 1818, 0.0))
+    def testRollback(self):
+        new_group = Group(u'New Group', u'', self.case, u'netanalysis')
+        session.add(new_group)
+        session.commit()
+        new_id = new_group.id
+        
+        job = ImportJob(self.db)
+        filenames = [self.upload(), self.upload(broken=True)]
+        job.add(0, self.group, 'netanalysis', filenames[0], False)
+        job.add(1, new_group, 'netanalysis', filenames[1], True)
+        job.edit(self.group, {'name': u'Renamed'})
+        self.execute(job)
+        
+        # the group made for the bad file is deleted, the other group is left as it was
+        self.assertEqual(job.state, 'failed')
+        self.assertTrue(isinstance(job.error, ConversionError))
+        self.assertEqual(job.error_field, 1)
+        self.assertEqual(Group.get(new_id), None)
+        self.assertEqual(self.group.name, u'Test Group')
+        self.assertEqual(session.query(Entry).count(), 0)
+        self.assertEqual(session.query(SearchTerms).count(), 0)
+        self.assertFalse(path.exists(filenames[0]) or path.exists(filenames[1]))
+        
+class BulkLoadTestCase(NewCaseTestCase):
+    def settings(self, execute=session.execute):
+        """
+            Returns the journal mode, synchronous and cache size pragmas and the names of the 
+            indexes in the database.
+        """
+        pragmas = [execute('PRAGMA %s' % name).scalar() 
+                   for name in 'journal_mode', 'synchronous', 'cache_size']
+        names = [name for name, in execute("SELECT name FROM sqlite_master "
+                                           "WHERE type = 'index' AND sql IS NOT NULL")]
+        return pragmas, sorted(names)
+    def setUp(self):
+        NewCaseTestCase.setUp(self)
+        session.commit()
+        self.indexes = sorted([index.name for index in get_indexes()])
+        self.before = self.settings()
+    def testBulkLoad(self):
+        self.assertEqual(self.before[1], self.indexes)
+        
+        settings = begin_bulk_load(session, True)
+        self.assertEqual(self.settings(), 
+                         (['wal', 1, utils.config.getint('import', 'cache_size')], []))
+        self.addFile(self.group, 'test.csv', 'netanalysis')
+        session.commit()
+        end_bulk_load(session, settings)
+        
+        self.assertEqual(self.settings(), self.before)
+        self.assertFalse(path.exists(path.join(self.dir, 'new.db-wal')))
+        self.assertTrue(session.execute('SELECT count(*) FROM sqlite_stat1').scalar() > 0)
+    def testCheckpoint(self):
+        # another connection to the case stops it leaving WAL mode
+        settings = begin_bulk_load(session, False)
+        other = sqlite3.connect(path.join(self.dir, 'new.db'))
+        try:
+            other.execute('SELECT count(*) FROM entry').fetchall()
+            self.addFile(self.group, 'test.csv', 'netanalysis')
+            session.commit()
+            end_bulk_load(session, settings)
+            self.assertEqual(self.settings()[0][0], 'wal')
+        finally:
+            other.close()
+        
+        # but the database file has everything in it without the WAL
+        shutil.copy(path.join(self.dir, 'new.db'), path.join(self.dir, 'copy.db'))
+        copy = sqlite3.connect(path.join(self.dir, 'copy.db'))
+        try:
+            self.assertEqual(copy.execute('SELECT count(*) FROM entry').fetchone()[0], 1818)
+        finally:
+            copy.close()
+    def testImportJob(self):
+        group_id = self.group.id
+        for defer_indexes in '0', '1000000000':
+            utils.config.set('import', 'defer_indexes', defer_indexes)
+            job = ImportJob(self.db)
+            job.add(0, Group.get(group_id), 'netanalysis', self.upload(), False)
+            self.execute(job)
+            self.assertEqual(job.state, 'done')
+            
+            # the job's own connection is closed, so look at the file from a new one
+            session.remove()
+            self.assertEqual(self.settings(), self.before)
+        self.assertEqual(session.query(Entry).count(), 1818 * 2)
+        
+class WaitJob(Job):
+    def __init__(self, fail=False):
+        Job.__init__(self)
+        self.fail = fail
+        self.go = threading.Event()
+    def run(self):
+        self.go.wait()
+        if self.fail:
+            raise ValueError('failed')
+    
+class JobQueueTestCase(unittest.TestCase):
+    def wait(self, job):
+        for i in xrange(100):
+            if job.finished is not None:
+                return
+            time.sleep(0.05)
+        self.fail('job did not finish')
+    def testSubmit(self):
+        queue = JobQueue()
+        jobs = [WaitJob(), WaitJob(fail=True)]
+        ids = [queue.submit(job) for job in jobs]
+        
+        self.assertEqual(ids, [1, 2])
+        self.assertEqual(queue.get(1), jobs[0])
+        self.assertEqual(queue.get(3), None)
+        self.assertEqual(queue.get(2).status()['id'], 2)
+        
+        for job in jobs:
+            job.go.set()
+            self.wait(job)
+        self.assertEqual([job.state for job in jobs], ['done', 'failed'])
+        self.assertTrue(isinstance(jobs[1].error, ValueError))
+        
+        # finished jobs are pruned once they have been kept long enough
+        jobs[0].finished = time.time() - queue.keep - 1
+        queue.submit(WaitJob())
+        self.assertEqual(queue.get(1), None)
+        self.assertEqual(queue.get(2), jobs[1])
+
+if __name__ == "__main__":
+    unittest.main()
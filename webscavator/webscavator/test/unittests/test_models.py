@@ -5,7 +5,10 @@ import time
 # local models
 from webscavator.model.models import *
 from webscavator.model.filters import *
-from webscavator.utils.utils import session
+from webscavator.model.advisor import explain
+from webscavator.utils.utils import session, readList, listTable
+from webscavator.utils.cache import LRUCache
+from webscavator.utils.bitmap import Bitmap, register, in_bitmap
 from webscavator.converters import get_name
 
 class get_plotableTestCase(unittest.TestCase):
@@ -19,7 +22,8 @@ class get_plotableTestCase(unittest.TestCase):
         self.bs = "places.sqlite"
         self.p = "netanalysis"
         self.ti = "Example.org"
-        self.result = get_plotable(self.d, self.t, self.u, self.bn, self.bv, self.bs, self.p, self.ti)    
+        self.result = get_plotable(plot_date(self.d), plot_hour(self.t), self.u, self.bn, self.bv, 
+                                   self.bs, self.p, self.ti)    
     def tearDown(self):
         self.result = self.d = self.t = None
     def testPlotable(self):
@@ -35,7 +39,8 @@ class get_plotableTestCase(unittest.TestCase):
         self.assertEqual(self.result[7], self.ti)
         
         self.ti = None
-        self.result = get_plotable(self.d, self.t, self.u, self.bn, self.bv, self.bs, self.p, self.ti)
+        self.result = get_plotable(plot_date(self.d), plot_hour(self.t), self.u, self.bn, self.bv, 
+                                   self.bs, self.p, self.ti)
         self.assertEqual(self.result[7], '--')
         
 class BrowserTestCase(unittest.TestCase):
@@ -92,7 +97,7 @@ class CaseTestCase(unittest.TestCase):
         
         self.assertEqual(qrem.count(), 4)
         self.assertEqual(qhigh.count(), 10)
-        self.assertEqual(qnot.count(), 15)  
+        self.assertEqual(qnot.count(), 5)  
         
     def testgetTimeGraph(self):
         startdate = datetime(2010, 5, 1)
@@ -111,9 +116,51 @@ class CaseTestCase(unittest.TestCase):
             self.assertEqual(point[0][0], time.mktime((startdate + timedelta(hours=1)).timetuple()) * 1000) 
             
         self.assertEqual(len(qhigh), 10)
-        self.assertEqual(len(qnot), 15)
+        self.assertEqual(len(qnot), 5)
         self.assertEqual(len(qrem), 4)
         
+        # a day apart keeps only the first entry of each list
+        qhigh, qnot, qrem = Case.getTimeGraph(startdate, enddate, starttime, endtime, 
+                                              remove_funcs, highlight_funcs,
+                                              remove_duplicates=True, duplicate_time=24*60)
+        self.assertEqual([len(qhigh), len(qnot), len(qrem)], [1, 1, 1])
+        qhigh, qnot, qrem = Case.getTimeGraph(startdate, enddate, starttime, endtime, 
+                                              [], [], remove_duplicates=True, duplicate_time=24*60)
+        self.assertEqual([len(qhigh), len(qnot), len(qrem)], [0, 1, 0])
+        
+        # an entry with more than one search term is only plotted once
+        day = datetime(2010, 6, 5)
+        entry = Entry.get(1136)
+        self.assertTrue(len(entry.search_terms) > 1)
+        qhigh, qnot, qrem = Case.getTimeGraph(day, day, starttime, endtime, [], [], 
+                                              remove_duplicates=True, duplicate_time=0)
+        self.assertEqual(len(qnot), Case.countTimeGraph(day, day))
+        self.assertEqual(len([p for p in qnot if p[2] == entry.url]), 1)
+    
+    def testgetTimeGraphBins(self):
+        startdate = datetime(2010, 5, 1)
+        enddate = datetime(2010, 5, 1)
+        rem = FilterQuery()   
+        rem.add_element('URL Parts','domain','Is','bbc.co.uk', None) 
+        high = FilterQuery()
+        high.add_element('URL Parts','domain','Is','google.com', None) 
+        self.assertEqual(Case.countTimeGraph(startdate, enddate), 19)
+        
+        # one cell for the whole day holds every entry
+        qhigh, qnot, qrem = Case.getTimeGraphBins(startdate, enddate, [rem], [high], 1)
+        self.assertEqual(qnot, [])
+        self.assertEqual(qrem, [])
+        self.assertEqual(qhigh[0][1:], [12.0, 19, 10, 5, 4])
+        
+        # smaller cells add up to the same amounts
+        qhigh, qnot, qrem = Case.getTimeGraphBins(startdate, enddate, [rem], [high], 96)
+        cells = qhigh + qnot + qrem
+        self.assertEqual(sum([c[2] for c in cells]), 19)
+        self.assertEqual(sum([c[3] for c in cells]), 10)
+        self.assertEqual(sum([c[5] for c in cells]), 4)
+        for cell in cells:
+            self.assertEqual(cell[0], time.mktime((startdate + timedelta(hours=1)).timetuple()) * 1000) 
+        
               
 class GroupTestCase(unittest.TestCase):
     def setUp(self):
@@ -140,6 +187,18 @@ class EntryTestCase(unittest.TestCase):
         self.assertEqual(low, 0)
         self.assertEqual(table[0][1], [0,0,0,0,8,0,0])
         self.assertEqual(table[23][1], [122, 218, 139, 221, 0, 0, 0])
+        
+        # smaller and bigger steps add up to the same amounts
+        counts = Entry.getTimeCounts()
+        headers, small, high, low = Entry.generateHeatMap(15, counts)
+        headers, big, high, low = Entry.generateHeatMap(240, counts)
+        self.assertEqual(len(small), 96)
+        self.assertEqual(small[0][0], '00:00 - 00:14')
+        self.assertEqual(len(big), 6)
+        self.assertEqual(big[5][0], '20:00 - 23:59')
+        for rows in small, big:
+            self.assertEqual(sum([sum(v) for title, v in rows]), sum([sum(v) for title, v in table]))
+        self.assertRaises(ValueError, Entry.generateHeatMap, 25, counts)
     def testaveragePages(self):
         average = Entry.averagePages()
         self.assertEqual(average, 15)
@@ -155,15 +214,76 @@ class EntryTestCase(unittest.TestCase):
         self.assertEqual(len(drives), 3)
         self.assertTrue('image' in drives['H'][0])
         self.assertEqual(len(drives['H'][0]), 1)
+        
+        # the dates of each file are fetched separately
+        tree, count = drives['H'][0]['image']
+        while not isinstance(tree, tuple):
+            tree = tree.values()[0]
+        count, file_path = tree
+        dates = Entry.fileDates(file_path)
+        self.assertEqual(len(dates), count)
+        self.assertEqual(dates, sorted(dates, reverse=True))
           
         
 class URLTestCase(unittest.TestCase):
     def setUp(self):
-        pass
+        URL.url_cache.clear()
+        URL.domain_cache.clear()
     def tearDown(self):
         pass
     def testStaticMethods(self):
-        pass
+        parts = URL.decompose(u'http://user@www.news.bbc.co.uk:8080/path?q=1#top')
+        self.assertEqual(parts['hostname'], u'www.news.bbc.co.uk')
+        self.assertEqual(parts['port'], 8080)
+        self.assertEqual(parts['domain'], u'bbc.co.uk')
+        self.assertEqual(URL.decompose(u'joe@http://192.168.0.1/')['domain'], None)
+        self.assertEqual(URL.decompose(u'res://ieframe.dll/')['domain'], None)
+        self.assertEqual(URL.decompose(u'http://mail.google.com/')['domain'], u'google.com')
+        
+        parts['domain'] = None # changing the dictionary doesn't change the remembered parts
+        parts = URL.decompose(u'http://user@www.news.bbc.co.uk:8080/path?q=1#top')
+        self.assertEqual(parts['domain'], u'bbc.co.uk')
+        self.assertEqual(URL.cacheStats()['url']['hits'], 1)
+        self.assertEqual(URL(u'http://www.google.com/').domain, u'google.com')
+    def testCache(self):
+        cache = LRUCache(2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        self.assertEqual(cache.get('a'), 1)
+        cache.set('c', 3) # b is the least recently used
+        self.assertFalse('b' in cache)
+        self.assertEqual(cache.get('a'), 1)
+        self.assertEqual(cache.get('c'), 3)
+        self.assertEqual(cache.get('b'), None)
+        self.assertEqual(cache.stats(), {'size': 2, 'hits': 3, 'misses': 1})
+        cache.set('a', 4) # setting a marks it as the most recently used
+        cache.set('d', 5)
+        self.assertFalse('c' in cache)
+        self.assertEqual(cache.get('a'), 4)
+    def testgetTop(self):
+        top = URL.getTop("all")
+        self.assertEqual(DomainRollup.getCounts(), None)
+        DomainRollup.fill()
+        self.assertEqual(DomainRollup.getCounts(), URL.countDomains())
+        self.assertEqual(URL.getTop("all"), top)
+        self.assertEqual(URL.getTop(1), top[:1])
+        
+        # the counts are not used once the data changes
+        Case.dataChanged()
+        self.assertEqual(DomainRollup.getCounts(), None)
+        session.rollback()
+    def testIndexes(self):
+        connection = session.bind.raw_connection()
+        try:
+            steps, scans = explain(connection, 'SELECT netloc FROM url WHERE domain = ?', 
+                                   [u'google.com'])
+            self.assertEqual(scans, [])
+            self.assertTrue('ix_url_domain' in steps[0])
+            steps, scans = explain(connection, 'SELECT netloc FROM url WHERE fragment = ?', 
+                                   [u'top'])
+            self.assertEqual(scans, steps)
+        finally:
+            connection.close()
     def testTableLinks(self):
         pass
     
@@ -174,8 +294,141 @@ class FilterTestCase(unittest.TestCase):
         pass
     def testStaticMethods(self):
         pass
+    def testQuery(self):
+        date = datetime(2010, 5, 1)
+        q = session.query(Entry.id).join('parsedurl').filter(Entry.access_date==date)
+        regex = FilterQuery()
+        regex.add_element('URL Parts','domain','Matches regular expression','^goog', None)
+        self.assertEqual(q.filter(regex.query()).count(), 10)
+        slow = FilterQuery()
+        slow.add_element('URL Parts','domain','Matches regular expression','^go+g', None)
+        self.assertEqual(q.filter(slow.query()).count(), 10)
+        
+        # the same filter lines give the same clause until they change
+        same = FilterQuery()
+        same.add_element('URL Parts','domain','Matches regular expression','^goog', None)
+        self.assertTrue(same.query() is regex.query())
+        same.add_element('URL Parts','hostname','Is','www.google.com', None)
+        self.assertFalse(same.query() is regex.query())
+    def testLists(self):
+        q = session.query(Entry.id).join('parsedurl')
+        for name in ['news.txt', 'socialmedia.txt']: # a short list and one kept in a table
+            values = readList(name)
+            self.assertTrue(readList(name) is values)
+            f = FilterQuery()
+            f.add_element('URL Parts', 'domain', 'Is in list', name, None)
+            self.assertEqual(q.filter(f.query()).count(),
+                             q.filter(URL.domain.in_(values)).count())
+        self.assertEqual(listTable('news.txt'), None)
+        self.assertNotEqual(listTable('socialmedia.txt'), None)
+    def testBitmap(self):
+        bitmap = Bitmap.fromIds([3, 8, 9, 200])
+        self.assertTrue(8 in bitmap)
+        self.assertFalse(7 in bitmap)
+        self.assertFalse(5000 in bitmap)
+        self.assertEqual(len(bitmap | Bitmap.fromIds([1, 3])), 5)
+        self.assertEqual(len(bitmap - Bitmap.fromIds([3, 4])), 3)
+        self.assertEqual(Bitmap.fromString(bitmap.toString()).bits, bitmap.bits)
+        
+        # a registered bitmap is checked by in_bitmap() until it is garbage collected
+        key = register(bitmap)
+        self.assertTrue(in_bitmap(key, 200))
+        self.assertFalse(in_bitmap(key, 201))
+        del bitmap
+        self.assertRaises(KeyError, in_bitmap, key, 200)
+        
+        # a filter's bitmap has the entries its clause matches, and is stored by fill()
+        f = Filter.getFilterBy(label=u'workhours').first()
+        ids = set([id for (id,) in session.query(Entry.id).filter(f.query.query())])
+        self.assertEqual(len(f.query.bitmap()), len(ids))
+        self.assertTrue(min(ids) in f.query.bitmap())
+        FilterBitmap.fill()
+        stored = FilterBitmap.load(f.query.bitmapKey(), Case.getDataVersion())
+        self.assertEqual(stored.bits, f.query.bitmap().bits)
+        session.rollback()
+    def testgetQueries(self):
+        queries = Filter.getQueries()
+        self.assertTrue(Filter.getQueries() is queries)
+        self.assertEqual(queries[u'workhours'].params, 
+                         Filter.getFilterBy(label=u'workhours').first().query.params)
+        
+        # added filters are only seen once the filters have changed
+        f = Filter(u'test', u'Test')
+        f.query = FilterQuery()
+        session.add(f)
+        session.flush()
+        self.assertFalse(u'test' in Filter.getQueries())
+        Filter.filtersChanged()
+        self.assertTrue(u'test' in Filter.getQueries())
+        session.rollback()
+        Filter.filtersChanged()
+    def testonlineSearches(self):
+        cloud, total, unique, smallest = Filter.onlineSearches(num=2)['bing']
+        self.assertEqual(sorted(cloud), [u'_diamonte', u'_plaza'])
+        self.assertEqual((total, unique, smallest), (16.0, 2, 0.5))
+        ratio, id, count = cloud[u'_plaza']
+        self.assertEqual(id, 2)
+        
+        searches = Filter.searches(id)
+        self.assertEqual(len(searches), count)
+        self.assertEqual(Filter.searches(id, offset=1, limit=2), searches[1:3])
+        self.assertEqual(Filter.onlineSearches(num=2)['google'], ({}, 0.0, 0, 1.0))
+    def testliteral_prefix(self):
+        self.assertEqual(literal_prefix('^www\\.google\\.'), 'www.google.')
+        self.assertEqual(literal_prefix('http://.*'), 'http://')
+        self.assertEqual(literal_prefix('^a*b'), None)
+        self.assertEqual(literal_prefix('^\\d+'), None)
+        self.assertEqual(literal_prefix('bbc$'), None)
+        self.assertEqual(glob_escape('a*b?[c]'), 'a[*]b[?][[]c]')
     def testTableLinks(self):
         pass
     
+class SummaryTestCase(unittest.TestCase):
+    def setUp(self):
+        pass
+    def tearDown(self):
+        session.rollback()
+    def testStatistics(self):
+        Summary.fill()
+        stored = Summary.getStatistics()
+        self.assertEqual(stored['newest_date'], datetime(2010, 8, 1))
+        self.assertEqual(stored['average_pages'], Entry.averagePages())
+        self.assertEqual(stored['files_accessed'], Entry.filesAccessed())
+        
+        # changed values are only used until the data changes
+        session.query(Summary).get(u'average_pages').value = -1
+        self.assertEqual(Summary.getStatistics()['average_pages'], -1)
+        version = Case.getDataVersion()
+        Case.dataChanged()
+        self.assertEqual(Case.getDataVersion(), version + 1)
+        self.assertEqual(Summary.getStatistics()['average_pages'], Entry.averagePages())
+        Summary.fill()
+        self.assertEqual(session.query(Summary).get(u'average_pages').version, version + 1)
+    
+class FilterValueTestCase(unittest.TestCase):
+    def setUp(self):
+        pass
+    def tearDown(self):
+        session.rollback()
+    def testgetValues(self):
+        counted = FilterValue.getValues(u'Browser.name')
+        self.assertEqual(sorted(counted), sorted([(b.name, len(b.entries)) 
+                                                  for b in Browser.getAll()]))
+        self.assertEqual(FilterValue.getValues(u'Browser.name', counted[0][0][:2]), 
+                         [v for v in counted if v[0].startswith(counted[0][0][:2])])
+        self.assertTrue(FilterValue.hasValue(u'Browser.name', counted[0][0]))
+        self.assertFalse(FilterValue.hasValue(u'Browser.name', u'not a browser'))
+        
+        # stored values are only used until the data changes
+        FilterValue.fill()
+        self.assertEqual(FilterValue.getValues(u'Browser.name'), counted)
+        self.assertEqual(FilterValue.getValues(u'Browser.name', offset=1, limit=1), counted[1:2])
+        self.assertTrue(FilterValue.hasValue(u'Browser.name', counted[0][0]))
+        self.assertFalse(FilterValue.hasValue(u'Browser.name', u''))
+        session.query(FilterValue).get((u'Browser.name', counted[0][0])).count = -1
+        self.assertEqual(FilterValue.getValues(u'Browser.name')[0][1], -1)
+        Case.dataChanged()
+        self.assertEqual(FilterValue.getValues(u'Browser.name'), counted)
+    
 if __name__ == "__main__":
     unittest.main()
\ No newline at end of file
@@ -1,10 +1,14 @@
 # python imports
 import unittest
+from os import path
+from StringIO import StringIO
 #library imports
 from formencode import Invalid
 # local imports
 from webscavator.forms.validators import *
-from webscavator.test.utils import FakeFileUpload
+from webscavator.test.utils import FakeFileUpload, urls
+from webscavator.controllers.baseController import FormState
+from webscavator.utils.utils import ROOT_DIR
 
 class NoDuplicatesTestCase(unittest.TestCase):
     def setUp(self):
@@ -32,11 +36,24 @@ class CheckHasItemsTestCase(unittest.TestCase):
 
 class ValidCSVDataTestCase(unittest.TestCase):
     def setUp(self):
-        pass
+        self.csv = open(path.join(ROOT_DIR, 'webscavator', 'test', 'test.csv'), 'r')
+        lines = self.csv.readlines()
+        lines[2] = lines[2].replace('01/08/2010', '99/99/2010')
+        self.bad_csv = StringIO(''.join(lines))
+        self.state = FormState(None, None, urls)
     def tearDown(self):
-        pass
+        self.csv.close()
+        self.csv = self.bad_csv = self.state = None
     def testValidator(self):
-        pass
+        vals = {'program': 'Net Analysis', 'data': self.csv}
+        ValidCSVData().validate_python(vals, self.state)
+        
+        vals = {'program': 'Net Analysis', 'data': self.bad_csv}
+        try:
+            ValidCSVData().validate_python(vals, self.state)
+            self.fail('Invalid not raised')
+        except Invalid, e:
+            self.assertTrue('line 3 ' in e.error_dict['data'])
     
 class NonAsciiTestCase(unittest.TestCase):
     def setUp(self):
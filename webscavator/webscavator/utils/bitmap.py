@@ -0,0 +1,138 @@
+"""
+    Bitmaps
+    -------
+
+    A `Bitmap` is a set of entry ids kept as the bits of one long integer, so sets of entries
+    can be combined with `|`, `&` and `-` without looking at each entry. They are used to
+    remember which entries each filter matches (see `FilterQuery.bitmap()` in :doc:`filters`).
+
+    SQL queries check whether an entry is in a bitmap with the `in_bitmap(key, id)` function,
+    which is added to each database connection by `SQLiteFunctions` in :doc:`utils`. The key
+    is given by `register()`, and stays valid for as long as the bitmap is kept.
+
+    Functions and Classes
+    ---------------------
+"""
+
+# python imports
+from binascii import hexlify, unhexlify
+from itertools import count
+from weakref import ref
+import zlib
+
+
+class Bitmap(object):
+    """
+        A set of non-negative integers. Bit `n` of `bits` is set if `n` is in the set.
+        Checking a single id with `in` uses the bits as a string of bytes, which is made the
+        first time it is needed.
+    """
+
+    def __init__(self, bits=0L):
+        self.bits = bits
+        self._bytes = None
+        self._key = None    # see register()
+
+    @staticmethod
+    def fromIds(ids):
+        """
+            Returns a bitmap of the ids, best given in ascending order.
+        """
+        bits = bytearray()
+        for id in ids:
+            i = id >> 3
+            if i >= len(bits):
+                bits.extend('\0' * (i - len(bits) + 1))
+            bits[i] = bits[i] | (1 << (id & 7))
+        if not bits:
+            return Bitmap()
+        return Bitmap(long(hexlify(str(bits[::-1])), 16))
+
+    @staticmethod
+    def fromString(s):
+        """
+            Returns the bitmap stored as `s` by `toString()`.
+        """
+        s = zlib.decompress(s)
+        if not s:
+            return Bitmap()
+        return Bitmap(long(hexlify(s[::-1]), 16))
+
+    def toString(self):
+        """
+            Returns the bitmap as a compressed string of bytes.
+        """
+        return zlib.compress(self._getBytes())
+
+    def _getBytes(self):
+        """
+            Returns the bits as a string with the lowest bits in the first byte.
+        """
+        if self._bytes is None:
+            h = '%x' % self.bits
+            if len(h) % 2:
+                h = '0' + h
+            self._bytes = unhexlify(h)[::-1]
+        return self._bytes
+
+    def __contains__(self, id):
+        b = self._getBytes()
+        i = id >> 3
+        return i < len(b) and bool((ord(b[i]) >> (id & 7)) & 1)
+
+    def __or__(self, other):
+        return Bitmap(self.bits | other.bits)
+
+    def __and__(self, other):
+        return Bitmap(self.bits & other.bits)
+
+    def __sub__(self, other):
+        return Bitmap(self.bits & ~other.bits)
+
+    def __len__(self):
+        return bin(self.bits).count('1')
+
+    def __nonzero__(self):
+        return self.bits != 0
+
+    def __repr__(self):
+        return "[bitmap of %d ids]" % len(self)
+
+
+_registered = {}    # key -> bytes of the bitmap, used by in_bitmap()
+_refs = {}          # key -> weak reference to the bitmap, which forgets the bytes when it goes
+_keys = count(1)
+
+def register(bitmap):
+    """
+        Returns the (integer) key to give `in_bitmap()` to check for ids in `bitmap`. The 
+        bitmap is remembered until it is garbage collected, so a query using the key must keep
+        a reference to the bitmap, as `Case.inBitmap()` in :doc:`models` does.
+    """
+    key = bitmap._key
+    if key is None:
+        key = _keys.next()
+        _registered[key] = bitmap._getBytes()
+        _refs[key] = ref(bitmap, lambda r, key=key: _forget(key))
+        bitmap._key = key
+    return key
+
+def _forget(key):
+    """
+        Forgets the bitmap registered as `key`, once it has been garbage collected.
+    """
+    _registered.pop(key, None)
+    _refs.pop(key, None)
+
+def in_bitmap(key, id):
+    """
+        The `in_bitmap(key, id)` SQL function. Returns whether `id` is in the bitmap
+        registered as `key`. SQLite calls this for every row it checks, so it looks at the 
+        bytes of the bitmap itself rather than using `Bitmap`.
+    """
+    b = _registered.get(key)
+    if b is None:
+        raise KeyError("in_bitmap: no bitmap is registered as %r - it must be kept while "
+                       "queries use it" % key)
+    i = id >> 3
+    return i < len(b) and (ord(b[i]) >> (id & 7)) & 1
@@ -0,0 +1,115 @@
+"""
+    A bounded cache for remembering the results of expensive functions, such as splitting
+    up URLs, while adding data to a case.
+
+    Classes
+    -------
+"""
+
+# python imports
+import threading
+
+
+class LRUCache(object):
+    """
+        Remembers up to `size` values. When it is full, the least recently used value is
+        forgotten. The values are kept in a dictionary and their order of use in a circular
+        doubly linked list, so getting and setting values is always quick.
+
+        The caches are shared by the request threads and the threads adding data, so the
+        list is only changed while holding `lock`.
+
+        `hits` and `misses` count how often `get()` found a value, for tuning the size.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self.lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        """
+            Forget all the values and reset the counters.
+        """
+        self.lock.acquire()
+        try:
+            self.map = {}   # key -> link, a list of [previous link, next link, key, value]
+            self.root = root = [] # the end of the list - root[1] is the least recently used
+            root[:] = [root, root, None, None]
+            self.hits = 0
+            self.misses = 0
+        finally:
+            self.lock.release()
+
+    def _moveToEnd(self, link):
+        """
+            Move `link` to the end of the list, marking it as the most recently used.
+        """
+        prev, next = link[0], link[1]
+        prev[1] = next
+        next[0] = prev
+        root = self.root
+        last = root[0]
+        link[0] = last
+        link[1] = root
+        last[1] = root[0] = link
+
+    def get(self, key, default=None):
+        """
+            Returns the value for `key`, marking it as the most recently used,
+            or `default` if there is no value for `key`.
+        """
+        self.lock.acquire()
+        try:
+            link = self.map.get(key)
+            if link is None:
+                self.misses = self.misses + 1
+                return default
+            self.hits = self.hits + 1
+            self._moveToEnd(link)
+            return link[3]
+        finally:
+            self.lock.release()
+
+    def set(self, key, value):
+        """
+            Remember `value` for `key`, marking it as the most recently used and forgetting 
+            the least recently used value if the cache is full.
+        """
+        self.lock.acquire()
+        try:
+            root = self.root
+            link = self.map.get(key)
+            if link is not None:
+                link[3] = value
+                self._moveToEnd(link)
+                return
+
+            if len(self.map) >= self.size:
+                # unlink the oldest value and forget it
+                oldest = root[1]
+                del self.map[oldest[2]]
+                root[1] = oldest[1]
+                oldest[1][0] = root
+
+            last = root[0]
+            link = [last, root, key, value]
+            last[1] = root[0] = self.map[key] = link
+        finally:
+            self.lock.release()
+
+    def __len__(self):
+        return len(self.map)
+
+    def __contains__(self, key):
+        return key in self.map
+
+    def stats(self):
+        """
+            Returns a dictionary with the number of values remembered, hits and misses.
+        """
+        self.lock.acquire()
+        try:
+            return {'size': len(self.map), 'hits': self.hits, 'misses': self.misses}
+        finally:
+            self.lock.release()
@@ -0,0 +1,143 @@
+"""
+    Jobs that take too long to run inside a request, such as adding large files to a case,
+    are run in the background by a pool of worker threads. The endpoint that starts a job
+    returns straight away with the job id, and the web page polls another endpoint for the
+    job's progress.
+
+    Variables
+    ---------
+
+    `job_queue`
+        the `JobQueue` all background jobs are submitted to. The number of worker threads
+        is set by `workers` in the `[import]` section of the config file.
+
+    Classes
+    -------
+"""
+
+# python imports
+import threading
+import Queue
+import time
+import traceback
+import sys
+# local imports
+from webscavator.utils.utils import session, config
+
+
+class Job(object):
+    """
+        A background job. Children override `run()` to do the work. `state` is one of
+        `queued`, `running`, `done` or `failed`. If the job failed, the exception is kept
+        in `error`.
+    """
+
+    id = None
+
+    def __init__(self):
+        self.state = 'queued'
+        self.error = None
+        self.started = None
+        self.finished = None
+
+    def run(self):
+        """
+            Override to do the job's work.
+        """
+        raise NotImplementedError
+
+    def execute(self):
+        """
+            Called by a worker thread to run the job and record whether it worked.
+            The worker's database session is removed afterwards.
+        """
+        self.state = 'running'
+        self.started = time.time()
+        try:
+            try:
+                self.run()
+                self.state = 'done'
+            except Exception, e:
+                traceback.print_exc(file=sys.stderr)
+                self.error = e
+                self.state = 'failed'
+        finally:
+            self.finished = time.time()
+            session.remove()
+
+    def _getElapsed(self):
+        """
+            A property for elapsed. Returns the number of seconds the job has been running for.
+        """
+        if self.started is None:
+            return 0.0
+        return (self.finished or time.time()) - self.started
+    elapsed = property(_getElapsed)
+
+    def status(self):
+        """
+            Returns a dictionary describing the job's progress. Children add their own progress
+            details to this.
+        """
+        return {'id': self.id, 'state': self.state, 'elapsed': self.elapsed}
+
+
+class JobQueue(object):
+    """
+        A queue of jobs run by a pool of worker threads. Finished jobs are kept for `keep`
+        seconds so their status can still be asked for.
+    """
+
+    keep = 3600
+
+    def __init__(self):
+        self.queue = Queue.Queue()
+        self.jobs = {}
+        self.workers = []
+        self.lock = threading.Lock()
+        self.next_id = 1
+
+    def submit(self, job):
+        """
+            Add a job to the queue, starting the worker threads if they are not yet running.
+            Returns the job id.
+        """
+        self.lock.acquire()
+        try:
+            self._prune()
+            if not self.workers:
+                self._startWorkers(config.getint('import', 'workers'))
+            job.id = self.next_id
+            self.next_id = self.next_id + 1
+            self.jobs[job.id] = job
+        finally:
+            self.lock.release()
+
+        self.queue.put(job)
+        return job.id
+
+    def get(self, id):
+        """
+            Returns the job with the given id, or `None` if there is no such job.
+        """
+        return self.jobs.get(id)
+
+    def _startWorkers(self, amount):
+        for i in xrange(amount):
+            worker = threading.Thread(target=self._work, name='webscavator-worker-%d' % i)
+            worker.setDaemon(True)
+            worker.start()
+            self.workers.append(worker)
+
+    def _work(self):
+        while True:
+            job = self.queue.get()
+            job.execute()
+
+    def _prune(self):
+        now = time.time()
+        for id, job in self.jobs.items():
+            if job.finished is not None and now - job.finished > self.keep:
+                del self.jobs[id]
+
+job_queue = JobQueue()
@@ -14,6 +14,9 @@
     `CONFIG_PATH`
         where the config file is kept.
     
+    `LIST_DIR`
+        where case lists are kept.
+    
     `FILE_TYPES`
         dictionary of file extensions and what type of file they are. Used in 
         displaying file accesses in the 'files' tab.
@@ -29,21 +32,30 @@
     ---------
 """
 
+from __future__ import with_statement
+
 # python imports
-from os import path, walk
+from os import path, walk, stat
+from hashlib import md5
 import csv
+import re
 from ConfigParser import ConfigParser
 # library imports
 from werkzeug import Local, LocalManager, MultiDict
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, Table, Column, MetaData, Unicode
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.interfaces import PoolListener
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import scoped_session, create_session, sessionmaker
+# local imports
+from webscavator.utils.bitmap import in_bitmap
 
 # Useful variables
 # ================
 ROOT_DIR = path.join(path.dirname(__file__), '..', '..')
 CASE_FILE_DIR = path.join(ROOT_DIR, '..', 'case files')
 CONFIG_PATH = path.join(ROOT_DIR, 'config')
+LIST_DIR = path.join(ROOT_DIR, '..', 'case lists')
 
 FILE_TYPES = {'jpg': 'image',
               'jpeg': 'image',
@@ -136,13 +148,46 @@ def checkDebugging(testing):
 # Database Stuff
 # ==============
 
-def connect(dbfile):
+def connect(dbfile, proxy=None, listeners=[]):
     """
         Given a database file, create an SQLAlchemy database engine which connects to the database.
+        The engine's connections have the functions in `SQLiteFunctions` and the list tables
+        kept by `ListTables`. `proxy` is an optional SQLAlchemy `ConnectionProxy` which sees
+        every statement run, and `listeners` are more SQLAlchemy `PoolListener`s, run after 
+        these two - see :doc:`advisor`.
     """
-    db = create_engine('sqlite:///' + dbfile, echo = False)
+    db = create_engine('sqlite:///' + dbfile, echo = False, proxy = proxy,
+                       listeners=[SQLiteFunctions(), ListTables()] + listeners)
     return db
 
+_patterns = {} # regular expression -> compiled pattern, used by regexp()
+PATTERN_CACHE_SIZE = 100
+
+def regexp(expr, item):
+    """
+        Enables regular expressions for filter queries. SQLite calls this for every row it 
+        checks, so each expression is only compiled once - up to `PATTERN_CACHE_SIZE` compiled 
+        expressions are remembered. `NULL` values never match.
+    """
+    if item is None:
+        return False
+    r = _patterns.get(expr)
+    if r is None:
+        if len(_patterns) >= PATTERN_CACHE_SIZE:
+            _patterns.clear()
+        r = _patterns[expr] = re.compile(expr)
+    return r.match(item) is not None            
+
+class SQLiteFunctions(PoolListener):
+    """
+        Adds Webscavator's own SQL functions, such as `REGEXP` using `regexp()` and `in_bitmap()`
+        from :doc:`bitmap`, to each new database connection, so they only have to be added once 
+        per connection.
+    """
+    def connect(self, dbapi_con, con_record):
+        dbapi_con.create_function("regexp", 2, regexp)
+        dbapi_con.create_function("in_bitmap", 2, in_bitmap)
+
 def bind(db):    
     """
         This binds the database to the current session.
@@ -152,10 +197,171 @@ def bind(db):
 
 def init_database(db):
     """
-        Initialises the database by creating all the tables in webscavator.models.models.py.
+        Initialises the database by creating all the tables in webscavator.models.models.py, 
+        then brings older databases up to date by calling `migrate()` in :doc:`migrations`.
+        Returns the version the database was and the version it is now.
     """
     from webscavator.model.models import Base
+    from webscavator.model.migrations import migrate
     Base.metadata.create_all(bind=db)
+    return migrate(db)
+    
+def get_indexes():
+    """
+        Returns all the indexes defined on the tables in webscavator.models.models.py.
+    """
+    from webscavator.model.models import Base
+    indexes = []
+    for table in Base.metadata.sorted_tables:
+        indexes.extend(table.indexes)
+    return indexes
+    
+def create_indexes(db, names=None):
+    """
+        Creates any of the indexes from `get_indexes()` that are missing from the database
+        (an engine or session), e.g. if they were dropped by `begin_bulk_load()` and not put 
+        back. If `names` is given, only the indexes with those names are created.
+    """
+    for index in get_indexes():
+        if names is not None and index.name not in names:
+            continue
+        db.execute('CREATE INDEX IF NOT EXISTS %s ON %s (%s)' % 
+                   (index.name, index.table.name, ', '.join([c.name for c in index.columns])))
+
+# Bulk loading
+# ============
+
+def begin_bulk_load(session, defer_indexes=True):
+    """
+        Switches the session's database connection to settings that are quicker for adding 
+        a lot of data: WAL journal mode, `synchronous=NORMAL` and a cache of `cache_size` pages
+        (from the `[import]` section of the config file). If `defer_indexes` is `True`, the 
+        indexes are dropped, so they are built once at the end rather than kept up to date 
+        row by row. 
+        
+        Must be called before anything is added in the session's transaction, as SQLite 
+        commits before changing the journal mode or dropping indexes. Returns the old settings
+        to pass to `end_bulk_load()`.
+    """
+    settings = {'cache_size': _pragma(session, 'cache_size'), 
+                'synchronous': _pragma(session, 'synchronous')}
+    _pragma(session, 'journal_mode', 'WAL')
+    _pragma(session, 'synchronous', 'NORMAL')
+    _pragma(session, 'cache_size', config.getint('import', 'cache_size'))
+    if defer_indexes:
+        for index in get_indexes():
+            session.execute('DROP INDEX IF EXISTS %s' % index.name)
+    return settings
+
+def end_bulk_load(session, settings):
+    """
+        Puts back any indexes dropped by `begin_bulk_load()`, updates the statistics the query
+        planner uses with `ANALYZE` and restores the settings for reading a case. The journal
+        mode goes back to `DELETE`, so the case is again a single file which can be hashed. 
+        Anything added in the session must already have been committed.
+        
+        SQLite can only leave WAL mode when no other connection has the database open. If 
+        the case is open elsewhere (e.g. by the web server) it is left in WAL mode, with 
+        everything copied into the database file by `checkpoint()`.
+    """
+    create_indexes(session)
+    session.execute('ANALYZE')
+    _pragma(session, 'synchronous', settings['synchronous'])
+    _pragma(session, 'cache_size', settings['cache_size'])
+    session.commit()
+    
+    checkpoint(session)
+    try:
+        _pragma(session, 'journal_mode', 'DELETE')
+    except OperationalError:
+        session.rollback() # still in use elsewhere
+    
+def checkpoint(session):
+    """
+        If the database is in WAL mode, copy everything in the WAL into the database file 
+        and empty the WAL. Used before the database file is hashed.
+    """
+    session.execute('PRAGMA wal_checkpoint(TRUNCATE)').close()
+
+def _pragma(session, name, value=None):
+    """
+        Get an SQLite pragma, or set it if a value is given.
+    """
+    if value is None:
+        return session.execute('PRAGMA %s' % name).scalar()
+    else:
+        session.execute('PRAGMA %s = %s' % (name, value)).close()
+
+# Case lists
+# ==========
+
+_lists = {}         # list name -> (modified time, values), used by readList()
+_list_tables = {}   # list name -> Table, used by listTable()
+
+def listModified(name):
+    """
+        Returns when the case list called `name` was last changed, or `None` if there is no 
+        such list.
+    """
+    try:
+        return stat(path.join(LIST_DIR, name)).st_mtime
+    except OSError:
+        return None
+
+def readList(name):
+    """
+        Returns a tuple of the lines in the case list called `name`. The file is only read 
+        again when it has changed since it was last read.
+    """
+    modified = listModified(name)
+    cached = _lists.get(name)
+    if cached is not None and cached[0] == modified:
+        return cached[1]
+    with open(path.join(LIST_DIR, name), 'r') as file:
+        values = tuple([unicode(line.strip(), 'utf-8') for line in file.readlines()])
+    _lists[name] = (modified, values)
+    return values
+
+def listTable(name):
+    """
+        Returns the temporary table holding the case list called `name` (see `ListTables`),
+        or `None` if the list has fewer than `list_table_size` lines (from the `[filters]` 
+        section of the config file) and so is not kept in a table.
+    """
+    if len(readList(name)) < config.getint('filters', 'list_table_size'):
+        return None
+    table = _list_tables.get(name)
+    if table is None:
+        key = name.encode('utf-8') if isinstance(name, unicode) else name
+        table = _list_tables[name] = Table('list_' + md5(key).hexdigest()[:16], MetaData(), 
+                                           Column('value', Unicode, primary_key=True))
+    return table
+
+class ListTables(PoolListener):
+    """
+        Copies each case list with a table from `listTable()` into a temporary table on every
+        database connection, so filters can check a value is in the list using the table's 
+        index rather than with hundreds of bound parameters. 
+        
+        The tables are brought up to date when a connection is taken from the pool, before 
+        it is used in a transaction, as SQLite commits before creating a table. A table is only
+        filled again when its list has changed.
+    """
+    def checkout(self, dbapi_con, con_record, con_proxy):
+        loaded = con_record.info.setdefault('lists', {}) # list name -> modified time
+        for name in getLists():
+            modified = listModified(name)
+            if loaded.get(name) == modified:
+                continue
+            table = listTable(name)
+            if table is None:
+                continue
+            dbapi_con.execute('DROP TABLE IF EXISTS temp.%s' % table.name)
+            dbapi_con.execute('CREATE TEMP TABLE %s (value TEXT PRIMARY KEY)' % table.name)
+            dbapi_con.executemany('INSERT OR IGNORE INTO temp.%s VALUES (?)' % table.name, 
+                                  [(v,) for v in readList(name)])
+            dbapi_con.commit()
+            loaded[name] = modified
 
 # Useful Functions
 # ================
@@ -167,14 +373,15 @@ def getCases():
     files = []
     for subdirs, dirs, f in walk(CASE_FILE_DIR):
         files.append(f)
-    return files[0] # only want files, not folders
+    # only want files, not folders, and not the files SQLite keeps next to the database
+    return [f for f in files[0] if not f.endswith(('-journal', '-wal', '-shm'))]
 
 def getLists():
     """ 
         Gets the list names (.txt files) stored in the case lists directory.
     """
     files = []
-    for subdirs, dirs, f in walk(path.join(ROOT_DIR, '..', 'case lists')):
+    for subdirs, dirs, f in walk(LIST_DIR):
         files.append(f)
     return files[0] # only want files, not folders    
 